@@ -0,0 +1,164 @@
+import io
+import os
+import random
+import struct
+
+# Synthetic media library for benchmarks. Files are tiny but structurally
+# real: JPEGs with EXIF dates, PNG screenshots with an EXIF "Screenshot"
+# marker, QuickTime stubs whose mvhd holds a chosen duration, and .wmv stubs
+# that only the fake ffprobe understands.
+
+FAKE_DURATION_MARKER = b"HANDYMAN-FAKE-DURATION "
+EXIF_DATE_PLACEHOLDER = b"2000:01:01 00:00:00"
+
+# Shares of each kind of file in the corpus
+MIX = (
+    ("dated_jpeg", 0.40),
+    ("undated_jpeg", 0.05),
+    ("screenshot_png", 0.10),
+    ("plain_png", 0.10),
+    ("short_mov", 0.12),
+    ("long_mov", 0.13),
+    ("wmv", 0.05),
+    ("named_by_date", 0.05),
+)
+
+FILES_PER_FOLDER = 200
+UNDATED_FOLDER_SHARE = 0.2  # Folders without a date in their name move as a whole
+
+
+def _jpeg_template(with_date):
+    from PIL import Image
+
+    exif = Image.Exif()
+    if with_date:
+        exif[306] = EXIF_DATE_PLACEHOLDER.decode()
+        exif.get_ifd(34665)[36867] = EXIF_DATE_PLACEHOLDER.decode()
+    buffer = io.BytesIO()
+    Image.new("RGB", (16, 16), (90, 120, 160)).save(buffer, "JPEG", exif=exif)
+    return buffer.getvalue()
+
+
+def _png_template(screenshot):
+    from PIL import Image
+
+    exif = Image.Exif()
+    if screenshot:
+        exif[305] = "Screenshot"
+        exif.get_ifd(34665)[37510] = b"ASCII\x00\x00\x00Screenshot"
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 64), (240, 240, 240)).save(buffer, "PNG", exif=exif)
+    return buffer.getvalue()
+
+
+def _box(box_type, payload):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def quicktime_stub(duration, timescale=600):
+    mvhd = _box(
+        b"mvhd",
+        b"\x00\x00\x00\x00"
+        + struct.pack(">IIII", 0, 0, timescale, int(duration * timescale))
+        + b"\x00" * 80,
+    )
+    return (
+        _box(b"ftyp", b"qt  \x00\x00\x00\x00qt  ")
+        + _box(b"moov", mvhd)
+        + _box(b"mdat", b"\x00" * 256)
+    )
+
+
+def wmv_stub(duration):
+    # ASF GUID so the header readers reject it, then the fake ffprobe payload
+    return (
+        bytes.fromhex("3026b2758e66cf11a6d900aa0062ce6c")
+        + FAKE_DURATION_MARKER
+        + f"{duration}".encode()
+        + b"\n"
+    )
+
+
+class CorpusTemplates:
+    def __init__(self):
+        self.dated_jpeg = _jpeg_template(True)
+        self.undated_jpeg = _jpeg_template(False)
+        self.screenshot_png = _png_template(True)
+        self.plain_png = _png_template(False)
+        self.short_mov = quicktime_stub(1.5)
+        self.long_mov = quicktime_stub(12.0)
+
+
+def _pick_kind(rng):
+    roll = rng.random()
+    for kind, share in MIX:
+        roll -= share
+        if roll <= 0:
+            return kind
+    return MIX[-1][0]
+
+
+def generate_corpus(root, file_count, seed=1):
+    # Builds the corpus under root and returns a {kind: count} summary
+    rng = random.Random(seed)
+    templates = CorpusTemplates()
+    summary = {}
+    folder = None
+    for index in range(file_count):
+        if index % FILES_PER_FOLDER == 0:
+            # Nested folders, some dated (files handled one by one) and some
+            # named like events (moved as a whole)
+            depth = rng.randint(1, 3)
+            parts = [f"{rng.randint(2019, 2024)}"]
+            for level in range(1, depth):
+                parts.append(f"Album {rng.randint(1, 20)}")
+            if rng.random() < UNDATED_FOLDER_SHARE:
+                parts.append(f"Trip {index // FILES_PER_FOLDER}")
+            else:
+                parts.append(
+                    f"{rng.randint(2019, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+                    f" {index // FILES_PER_FOLDER}"
+                )
+            folder = os.path.join(root, *parts)
+            os.makedirs(folder, exist_ok=True)
+
+        kind = _pick_kind(rng)
+        summary[kind] = summary.get(kind, 0) + 1
+        # Names repeat across folders so by-date runs hit collisions
+        number = rng.randint(1, 500)
+        date = f"{rng.randint(2019, 2024)}:{rng.randint(1, 12):02d}:{rng.randint(1, 28):02d} 12:00:00"
+
+        if kind == "dated_jpeg":
+            name = f"IMG_{number:04d}.JPG"
+            data = templates.dated_jpeg.replace(EXIF_DATE_PLACEHOLDER, date.encode())
+        elif kind == "undated_jpeg":
+            name = f"photo_{number:04d}.jpg"
+            data = templates.undated_jpeg
+        elif kind == "screenshot_png":
+            name = f"Screenshot_{number:04d}.png"
+            data = templates.screenshot_png
+        elif kind == "plain_png":
+            name = f"image_{number:04d}.png"
+            data = templates.plain_png
+        elif kind == "short_mov":
+            name = f"IMG_{number:04d}.MOV"
+            data = templates.short_mov
+        elif kind == "long_mov":
+            name = f"VID_{number:04d}.mp4"
+            data = templates.long_mov
+        elif kind == "wmv":
+            name = f"clip_{number:04d}.wmv"
+            data = wmv_stub(rng.choice((2.0, 8.0)))
+        else:
+            name = f"{date[:10].replace(':', '')}_{number:04d}.dat"
+            data = b"\x00" * 64
+
+        path = os.path.join(folder, name)
+        suffix = 1
+        while os.path.exists(path):
+            base, ext = os.path.splitext(name)
+            path = os.path.join(folder, f"{base}_{suffix}{ext}")
+            suffix += 1
+        with open(path, "wb") as f:
+            f.write(data)
+    return summary
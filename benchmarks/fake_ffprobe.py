@@ -0,0 +1,30 @@
+#!/usr/bin/env python3
+import sys
+
+# Stand-in for ffprobe in benchmarks. Point FFPROBE_PATH at this script; it
+# answers `-show_entries format=duration` for stubs written by
+# benchmarks.corpus and fails like ffprobe for anything else.
+
+FAKE_DURATION_MARKER = b"HANDYMAN-FAKE-DURATION "
+
+
+def main(argv):
+    if len(argv) < 2:
+        sys.stderr.write("fake_ffprobe: missing input file\n")
+        return 1
+    try:
+        with open(argv[-1], "rb") as f:
+            head = f.read(256)
+    except OSError as e:
+        sys.stderr.write(f"{argv[-1]}: {e.strerror}\n")
+        return 1
+    _, marker, rest = head.partition(FAKE_DURATION_MARKER)
+    if not marker:
+        sys.stderr.write(f"{argv[-1]}: Invalid data found when processing input\n")
+        return 1
+    sys.stdout.write(rest.split(b"\n", 1)[0].decode() + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
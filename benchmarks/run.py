@@ -0,0 +1,223 @@
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from benchmarks.corpus import generate_corpus
+
+# Throughput benchmark for the three operations on synthetic libraries.
+#
+#   python -m benchmarks.run --sizes 1000 100000 --save-baseline
+#   python -m benchmarks.run --sizes 1000 100000
+#
+# The second command exits with status 1 if any case got slower, or does
+# more stat calls or reads more bytes, than the stored baseline allows.
+# Counters cover this process only: EXIF worker processes are disabled
+# (--workers 1) unless asked for, and ffprobe children aren't counted.
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+FAKE_FFPROBE = os.path.join(BENCHMARK_DIR, "fake_ffprobe.py")
+
+OPERATIONS = ("short-videos", "screenshots", "by-date", "duplicates", "combined")
+
+
+class IOCounters:
+    # Counts os.stat/os.lstat/os.scandir calls made through the os module
+    # and bytes read according to /proc/self/io (Linux only). DirEntry.stat()
+    # is implemented in C and can't be intercepted.
+
+    def __init__(self):
+        self.stat_calls = 0
+        self.scandir_calls = 0
+        self.bytes_read = None
+        self._originals = {}
+        self._rchar = None
+
+    @staticmethod
+    def _read_rchar():
+        try:
+            with open("/proc/self/io") as f:
+                for line in f:
+                    if line.startswith("rchar:"):
+                        return int(line.split()[1])
+        except OSError:
+            pass
+        return None
+
+    def _wrap(self, name, counter):
+        original = getattr(os, name)
+        self._originals[name] = original
+
+        def counted(*args, **kwargs):
+            setattr(self, counter, getattr(self, counter) + 1)
+            return original(*args, **kwargs)
+
+        setattr(os, name, counted)
+
+    def __enter__(self):
+        self._wrap("stat", "stat_calls")
+        self._wrap("lstat", "stat_calls")
+        self._wrap("scandir", "scandir_calls")
+        self._rchar = self._read_rchar()
+        return self
+
+    def __exit__(self, *exc):
+        rchar = self._read_rchar()
+        for name, original in self._originals.items():
+            setattr(os, name, original)
+        if rchar is not None and self._rchar is not None:
+            self.bytes_read = rchar - self._rchar
+
+
+def _operation(name, workers):
+    if name == "short-videos":
+        from utils.file_operations import move_short_videos
+
+        return move_short_videos, {}
+    if name == "screenshots":
+        from utils.file_operations import move_screenshots
+
+        return move_screenshots, {}
+    if name == "duplicates":
+        from utils.duplicate_operations import move_duplicates
+
+        return move_duplicates, {}
+    if name == "combined":
+        from utils.combined_operations import organize_combined
+
+        return organize_combined, {}
+    from utils.by_date_operations import organize_by_date
+
+    return organize_by_date, {"workers": workers}
+
+
+def run_case(operation, size, workdir, workers=1):
+    from utils.catalog import close_catalog
+
+    source = os.path.join(workdir, "source")
+    destination = os.path.join(workdir, "destination")
+    for path in (source, destination):
+        shutil.rmtree(path, ignore_errors=True)
+    generate_corpus(source, size)
+
+    # Cold catalog for every case
+    catalog_path = os.path.join(workdir, "catalog.sqlite3")
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(catalog_path + suffix):
+            os.unlink(catalog_path + suffix)
+    close_catalog()
+    os.environ["HANDYMAN_CATALOG"] = catalog_path
+    os.environ["HANDYMAN_JOURNAL"] = os.path.join(workdir, "journals")
+
+    function, kwargs = _operation(operation, workers)
+    last_progress = [0, 0]
+
+    def progress(current, total, percentage, current_file=""):
+        last_progress[:] = [current, total]
+
+    with IOCounters() as counters:
+        started = time.perf_counter()
+        function(
+            source, destination, lambda message: None, progress, lambda: True, **kwargs
+        )
+        seconds = time.perf_counter() - started
+    close_catalog()
+
+    files = last_progress[1]
+    return {
+        "files": files,
+        "seconds": round(seconds, 3),
+        "files_per_sec": round(files / seconds, 1) if seconds else 0.0,
+        "stat_calls": counters.stat_calls,
+        "scandir_calls": counters.scandir_calls,
+        "bytes_read": counters.bytes_read,
+    }
+
+
+def compare(results, baseline, tolerance):
+    # Returns a list of human readable regressions
+    regressions = []
+    for key, result in results.items():
+        reference = baseline.get(key)
+        if reference is None:
+            continue
+        if result["files_per_sec"] < reference["files_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{key}: {result['files_per_sec']} files/sec, baseline {reference['files_per_sec']}"
+            )
+        for counter in ("stat_calls", "bytes_read"):
+            if result.get(counter) is None or reference.get(counter) is None:
+                continue
+            if result[counter] > reference[counter] * (1 + tolerance):
+                regressions.append(
+                    f"{key}: {result[counter]} {counter}, baseline {reference[counter]}"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HandyMan throughput benchmarks")
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1000], help="Corpus sizes to run"
+    )
+    parser.add_argument(
+        "--operations", nargs="+", choices=OPERATIONS, default=list(OPERATIONS)
+    )
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store these results as the baseline",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed relative regression before failing (default: 0.25)",
+    )
+    parser.add_argument("--workers", type=int, default=1, help="EXIF worker processes")
+    parser.add_argument("--workdir", help="Scratch folder (default: a temp folder)")
+    args = parser.parse_args(argv)
+
+    os.environ["FFPROBE_PATH"] = FAKE_FFPROBE
+    workdir = args.workdir or tempfile.mkdtemp(prefix="handyman-bench-")
+
+    results = {}
+    try:
+        for size in args.sizes:
+            for operation in args.operations:
+                key = f"{operation}@{size}"
+                results[key] = run_case(operation, size, workdir, args.workers)
+                print(json.dumps({"case": key, **results[key]}), flush=True)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline to compare against; run with --save-baseline first")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,587 @@
+import argparse
+import importlib
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+# Headless entry point. Only the module for the requested operation is
+# imported (never Qt), and every event is written to stdout as one JSON
+# object per line.
+
+OPERATIONS = {
+    "short-videos": ("utils.file_operations", "move_short_videos"),
+    "screenshots": ("utils.file_operations", "move_screenshots"),
+    "by-date": ("utils.by_date_operations", "organize_by_date"),
+    "duplicates": ("utils.duplicate_operations", "move_duplicates"),
+    "similar": ("utils.similar_operations", "move_similar_images"),
+    "combined": ("utils.combined_operations", "organize_combined"),
+}
+
+# Operations that can work on a batch of files instead of a whole tree
+WATCH_OPERATIONS = ["short-videos", "screenshots", "by-date", "combined"]
+
+# Operations that run as a scan -> probe -> decide -> move pipeline
+PIPELINE_OPERATIONS = ["short-videos", "screenshots", "by-date", "combined"]
+
+# Rules a combined run applies by default, in priority order. Rules defined
+# in a rules file can be named with --rules as well.
+COMBINED_RULES = ["short-videos", "screenshots", "by-date"]
+
+# Operations that pick files with the rules of utils.rules
+RULE_OPERATIONS = ["short-videos", "screenshots", "combined"]
+
+PLANNERS = {
+    "short-videos": ("utils.file_operations", "plan_short_videos"),
+    "screenshots": ("utils.file_operations", "plan_screenshots"),
+    "by-date": ("utils.by_date_operations", "plan_by_date"),
+    "duplicates": ("utils.duplicate_operations", "plan_duplicates"),
+    "similar": ("utils.similar_operations", "plan_similar_images"),
+    "combined": ("utils.combined_operations", "plan_combined"),
+}
+
+
+class JsonLinesReporter:
+    def __init__(self, stream, progress_interval):
+        self.stream = stream
+        self.progress_interval = progress_interval
+        self.started = time.monotonic()
+        self._last_progress = 0.0
+        self._pending_progress = None
+        # Parallel moves log from several threads
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        record = {"event": event, "elapsed": round(time.monotonic() - self.started, 3)}
+        record.update(fields)
+        with self._lock:
+            self.stream.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def log(self, message):
+        self.emit("log", message=message)
+
+    def progress(self, current, total, percentage, current_file=""):
+        # Progress is rate limited; the last update is always written
+        self._pending_progress = (current, total, percentage, current_file)
+        now = time.monotonic()
+        if now - self._last_progress >= self.progress_interval:
+            self._last_progress = now
+            self.flush_progress()
+            self.stream.flush()
+
+    def flush_progress(self):
+        if self._pending_progress is not None:
+            current, total, percentage, current_file = self._pending_progress
+            self._pending_progress = None
+            self.emit(
+                "progress",
+                current=current,
+                total=total,
+                percentage=percentage,
+                file=current_file,
+            )
+
+
+def add_progress_interval(command):
+    command.add_argument(
+        "--progress-interval",
+        type=float,
+        default=0.5,
+        help="Minimum seconds between progress lines (default: 0.5)",
+    )
+
+
+def add_profile(command):
+    command.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile the run into $HANDYMAN_PROFILES (default: ~/.handyman/profiles)",
+    )
+
+
+def add_rules_file(command):
+    command.add_argument(
+        "--rules-file",
+        help="JSON file of rules (default: $HANDYMAN_RULES or ~/.handyman/rules.json)",
+    )
+
+
+def add_probe_timeout(command):
+    command.add_argument(
+        "--probe-timeout",
+        type=float,
+        default=None,
+        help="Seconds before a hung ffprobe is killed (default: 30)",
+    )
+
+
+def add_operation_arguments(command, name):
+    command.add_argument("source", help="Source folder")
+    command.add_argument("destination", help="Destination folder")
+    add_progress_interval(command)
+    add_profile(command)
+    if name == "by-date":
+        command.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help="Processes used to read EXIF dates (default: CPU count)",
+        )
+    if name == "combined":
+        command.add_argument(
+            "--rules",
+            nargs="+",
+            default=COMBINED_RULES,
+            help="Rules to apply, highest priority first "
+            f"(default: {' '.join(COMBINED_RULES)})",
+        )
+        for rule in COMBINED_RULES:
+            command.add_argument(
+                f"--{rule}-to",
+                metavar="FOLDER",
+                help=f"Destination for {rule} (default: the destination folder)",
+            )
+        command.add_argument(
+            "--rule-to",
+            nargs=2,
+            action="append",
+            default=[],
+            metavar=("RULE", "FOLDER"),
+            help="Destination for any rule, such as one from the rules file",
+        )
+    if name in RULE_OPERATIONS:
+        add_rules_file(command)
+        command.add_argument(
+            "--probe-workers",
+            type=int,
+            default=None,
+            help="Threads reading file headers (default: twice the CPU count)",
+        )
+        add_probe_timeout(command)
+    if name == "similar":
+        command.add_argument(
+            "--max-distance",
+            type=int,
+            default=8,
+            help="Differing hash bits (of 64) still counted as similar (default: 8)",
+        )
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="handyman", description="Organize photos and videos without the GUI"
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    operations = (
+        ("short-videos", "Move short videos (3 seconds or less by default)"),
+        ("screenshots", "Move screenshots"),
+        ("by-date", "Organize files into year/month/day folders"),
+        ("duplicates", "Move exact duplicates, keeping the oldest copy"),
+        ("similar", "Move near-duplicate photos, keeping the largest"),
+        ("combined", "Apply several operations in one pass over the files"),
+    )
+    for name, help_text in operations:
+        command = subparsers.add_parser(name, help=help_text)
+        add_operation_arguments(command, name)
+        command.add_argument(
+            "--parallel-moves",
+            type=int,
+            default=1,
+            help="Moves run at once, spread by destination folder (default: 1)",
+        )
+
+    plan = subparsers.add_parser(
+        "plan", help="Decide what an operation would move without moving anything"
+    )
+    plan_operations = plan.add_subparsers(dest="operation", required=True)
+    for name, help_text in operations:
+        command = plan_operations.add_parser(name, help=help_text)
+        add_operation_arguments(command, name)
+        command.add_argument(
+            "--manifest",
+            help="Write the planned moves to this file instead of to stdout",
+        )
+
+    watch = subparsers.add_parser(
+        "watch", help="Keep running and handle files as they arrive"
+    )
+    watch.add_argument("source", help="Folder to watch")
+    watch.add_argument("destination", help="Destination folder")
+    add_progress_interval(watch)
+    add_profile(watch)
+    watch.add_argument(
+        "--operations",
+        nargs="+",
+        choices=WATCH_OPERATIONS,
+        default=COMBINED_RULES,
+        help="Operations applied to each batch of new files, in order",
+    )
+    watch.add_argument(
+        "--settle",
+        type=float,
+        default=2.0,
+        help="Seconds a file must stay unchanged before it is handled (default: 2)",
+    )
+    watch.add_argument(
+        "--poll",
+        action="store_true",
+        help="Compare snapshots of the folder instead of using inotify",
+    )
+    watch.add_argument(
+        "--poll-interval",
+        type=float,
+        default=5.0,
+        help="Seconds between snapshots with --poll (default: 5)",
+    )
+    watch.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Processes used to read EXIF dates for by-date (default: 1)",
+    )
+    add_rules_file(watch)
+    add_probe_timeout(watch)
+
+    execute = subparsers.add_parser("execute", help="Run the moves of a manifest")
+    execute.add_argument("manifest", help="Manifest written by 'plan'")
+    add_progress_interval(execute)
+    add_profile(execute)
+    execute.add_argument(
+        "--parallel",
+        type=int,
+        default=4,
+        help="Moves run at once, spread by destination folder (default: 4)",
+    )
+
+    rules = subparsers.add_parser(
+        "rules", help="Show the rules and the order their conditions are checked in"
+    )
+    add_rules_file(rules)
+
+    catalog = subparsers.add_parser("catalog", help="Manage the metadata catalog")
+    catalog.add_argument("action", choices=["compact", "stats"])
+    catalog.add_argument(
+        "--catalog", help="Catalog path (defaults to $HANDYMAN_CATALOG)"
+    )
+    return parser
+
+
+def check_ffprobe(operation, reporter):
+    if operation == "short-videos":
+        from utils.system_checks import find_ffprobe
+
+        if not find_ffprobe():
+            reporter.log("ffprobe not found; durations come from file headers only")
+
+
+def install_stop_handlers(reporter):
+    # Returns a list whose only item turns False on SIGINT/SIGTERM
+    running = [True]
+
+    def stop(signum, frame):
+        running[0] = False
+        reporter.log("Stopping...")
+        # Kill probes in flight; if the runner was never imported, none ran
+        probe_runner = sys.modules.get("utils.probe_runner")
+        if probe_runner is not None:
+            probe_runner.cancel_probes()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    return running
+
+
+def operation_kwargs(name, args):
+    # Options of one operation, as keyword arguments for its function
+    kwargs = {}
+    if name == "by-date":
+        kwargs["workers"] = args.workers
+    if name in RULE_OPERATIONS:
+        kwargs["probe_workers"] = args.probe_workers
+    if name == "combined":
+        kwargs["rules"] = args.rules
+        destinations = {
+            rule: getattr(args, rule.replace("-", "_") + "_to")
+            for rule in COMBINED_RULES
+        }
+        destinations.update(dict(args.rule_to))
+        kwargs["destinations"] = {
+            rule: os.path.abspath(destinations[rule])
+            for rule in args.rules
+            if destinations.get(rule)
+        }
+    if name == "similar":
+        kwargs["max_distance"] = args.max_distance
+    return kwargs
+
+
+def load_rules(parser, args):
+    # Rules are checked before anything runs, so a typo fails fast
+    from utils.rules import RULES_ENV, RuleError, get_rules
+
+    if args.rules_file:
+        # Through the environment, so every part of the run sees the file
+        os.environ[RULES_ENV] = os.path.abspath(args.rules_file)
+    try:
+        rules = get_rules()
+    except RuleError as e:
+        parser.error(str(e))
+    for rule in getattr(args, "rules", None) or []:
+        if rule != "by-date" and rule not in rules:
+            parser.error(
+                f"No rule named '{rule}' (rules: {', '.join(list(rules) + ['by-date'])})"
+            )
+    return rules
+
+
+class RunRecording:
+    # Metrics of a run, and a profile of it with --profile
+
+    def __init__(self, operation, profile=False):
+        from utils.metrics import start_run
+
+        self.operation = operation
+        self.metrics = start_run(operation)
+        self.profiler = None
+        if profile:
+            from utils.profiling import SamplingProfiler
+
+            self.profiler = SamplingProfiler()
+            self.profiler.start()
+
+    def finish(self, monitor=None, **extra):
+        # Fields for the "finished" event; the metrics summary file also
+        # gets the stage occupancy
+        from utils.metrics import finish_run
+
+        fields = {}
+        if self.profiler is not None:
+            from utils.profiling import profile_path
+
+            self.profiler.stop()
+            fields["profile"] = self.profiler.write(
+                profile_path(self.operation), self.metrics
+            )
+        summary, path = finish_run(self.metrics, **extra, **stage_fields(monitor))
+        fields["metrics"] = {
+            "counters": summary["counters"],
+            "timings": summary["timings"],
+        }
+        fields["metrics_file"] = path
+        return fields
+
+
+def stage_fields(monitor):
+    # Stage occupancy for the "finished" event
+    if monitor is None:
+        return {}
+    return {"stages": monitor.snapshot(), "bottleneck": monitor.bottleneck()}
+
+
+def run_operation(args, reporter):
+    module_name, function_name = OPERATIONS[args.command]
+    check_ffprobe(args.command, reporter)
+    function = getattr(importlib.import_module(module_name), function_name)
+    running = install_stop_handlers(reporter)
+
+    kwargs = operation_kwargs(args.command, args)
+    kwargs["parallel_moves"] = args.parallel_moves
+    monitor = None
+    if args.command in PIPELINE_OPERATIONS:
+        from utils.pipeline import PipelineMonitor
+
+        monitor = kwargs["monitor"] = PipelineMonitor()
+
+    source = os.path.abspath(args.source)
+    destination = os.path.abspath(args.destination)
+    reporter.emit(
+        "start", operation=args.command, source=source, destination=destination
+    )
+    recording = RunRecording(args.command, args.profile)
+    function(
+        source,
+        destination,
+        reporter.log,
+        reporter.progress,
+        lambda: running[0],
+        **kwargs,
+    )
+    reporter.flush_progress()
+    reporter.emit(
+        "finished",
+        cancelled=not running[0],
+        **stage_fields(monitor),
+        **recording.finish(monitor, source=source, destination=destination),
+    )
+    return 0 if running[0] else 130
+
+
+def run_plan(args, reporter):
+    from utils.catalog import flush_catalog
+    from utils.manifest import PlanSummary, write_manifest
+
+    module_name, function_name = PLANNERS[args.operation]
+    check_ffprobe(args.operation, reporter)
+    planner = getattr(importlib.import_module(module_name), function_name)
+    running = install_stop_handlers(reporter)
+
+    kwargs = operation_kwargs(args.operation, args)
+    monitor = None
+    if args.operation in PIPELINE_OPERATIONS:
+        from utils.pipeline import PipelineMonitor
+
+        monitor = kwargs["monitor"] = PipelineMonitor()
+
+    source = os.path.abspath(args.source)
+    destination = os.path.abspath(args.destination)
+    reporter.emit(
+        "start", operation=args.operation, source=source, destination=destination
+    )
+    summary = PlanSummary()
+    recording = RunRecording(f"plan-{args.operation}", args.profile)
+    moves = planner(
+        source,
+        destination,
+        reporter.log,
+        reporter.progress,
+        lambda: running[0],
+        summary,
+        **kwargs,
+    )
+    if args.manifest:
+        write_manifest(args.manifest, moves)
+    else:
+        # Dry run: the plan itself is the output
+        for move in moves:
+            reporter.emit("planned", **move.to_dict())
+    flush_catalog()
+    reporter.flush_progress()
+    reporter.emit(
+        "finished",
+        manifest=args.manifest,
+        examined=summary.examined,
+        planned=summary.planned,
+        bytes=summary.planned_bytes,
+        cancelled=not running[0],
+        **stage_fields(monitor),
+        **recording.finish(monitor, source=source, destination=destination),
+    )
+    return 0 if running[0] else 130
+
+
+def run_watch(args, reporter):
+    from utils.watcher import watch_folder
+
+    operations = []
+    for name in args.operations:
+        check_ffprobe(name, reporter)
+        module_name, function_name = OPERATIONS[name]
+        function = getattr(importlib.import_module(module_name), function_name)
+        kwargs = {"workers": args.workers} if name == "by-date" else {}
+        operations.append((function, kwargs))
+    running = install_stop_handlers(reporter)
+
+    def log(message):
+        # Batches can be minutes apart; don't leave lines sitting in a pipe
+        reporter.log(message)
+        reporter.stream.flush()
+
+    source = os.path.abspath(args.source)
+    destination = os.path.abspath(args.destination)
+    reporter.emit(
+        "start",
+        operation="watch",
+        operations=args.operations,
+        source=source,
+        destination=destination,
+    )
+    recording = RunRecording("watch", args.profile)
+    watch_folder(
+        source,
+        destination,
+        operations,
+        log,
+        reporter.progress,
+        lambda: running[0],
+        settle=args.settle,
+        poll=args.poll,
+        poll_interval=args.poll_interval,
+    )
+    reporter.flush_progress()
+    reporter.emit(
+        "finished",
+        cancelled=True,
+        **recording.finish(source=source, destination=destination),
+    )
+    return 0
+
+
+def run_execute(args, reporter):
+    from utils.catalog import flush_catalog
+    from utils.manifest import execute_manifest
+
+    running = install_stop_handlers(reporter)
+    reporter.emit("start", operation="execute", manifest=args.manifest)
+    recording = RunRecording("execute", args.profile)
+    executor = execute_manifest(
+        args.manifest,
+        reporter.log,
+        reporter.progress,
+        lambda: running[0],
+        args.parallel,
+    )
+    flush_catalog()
+    reporter.flush_progress()
+    reporter.emit(
+        "finished",
+        moved=executor.moved,
+        skipped=executor.skipped,
+        failed=executor.failed,
+        cancelled=not running[0],
+        **recording.finish(manifest=args.manifest),
+    )
+    return 0 if running[0] else 130
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if getattr(args, "probe_timeout", None):
+        from utils.probe_runner import PROBE_TIMEOUT_ENV
+
+        os.environ[PROBE_TIMEOUT_ENV] = str(args.probe_timeout)
+
+    if getattr(args, "rules_file", False) is not False:
+        rules = load_rules(parser, args)
+        if args.command == "rules":
+            for name, rule in rules.items():
+                print(f"{name}: {rule.describe()}")
+            return 0
+
+    if args.command == "catalog":
+        from utils import catalog
+
+        catalog_args = [args.action]
+        if args.catalog:
+            catalog_args += ["--catalog", args.catalog]
+        return catalog.main(catalog_args)
+
+    reporter = JsonLinesReporter(sys.stdout, args.progress_interval)
+    try:
+        if args.command == "plan":
+            return run_plan(args, reporter)
+        if args.command == "execute":
+            return run_execute(args, reporter)
+        if args.command == "watch":
+            return run_watch(args, reporter)
+        return run_operation(args, reporter)
+    finally:
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
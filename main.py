@@ -1,21 +1,12 @@
 import sys
-import shutil
-import os
+import multiprocessing
 from PyQt6.QtWidgets import QApplication, QMessageBox
 from ui.main_window import MainWindow
+from utils.system_checks import find_ffprobe
 
 def check_ffmpeg():
-    ffmpeg_paths = [
-        "ffprobe",  # Check if ffprobe is available globally
-        "/opt/homebrew/bin/ffprobe",  # Path for Homebrew on M1 Mac
-        "/usr/local/bin/ffprobe",  # Standard path for Homebrew on Intel Mac
-        "/opt/homebrew/opt/ffmpeg/bin/ffprobe",  # Alternative path for Homebrew
-    ]
-    
-    for path in ffmpeg_paths:
-        if shutil.which(path):
-            os.environ["FFPROBE_PATH"] = path
-            return True
+    if find_ffprobe():
+        return True
     
     QMessageBox.critical(None, "Error", "FFmpeg not found. Please install FFmpeg and make sure it's in your system PATH.")
     return False
@@ -30,4 +21,5 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Worker processes in the bundled app
     main()
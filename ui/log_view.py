@@ -0,0 +1,100 @@
+from PyQt6.QtWidgets import QAbstractItemView, QApplication, QListView
+from PyQt6.QtCore import (
+    Qt,
+    QAbstractListModel,
+    QModelIndex,
+    QSortFilterProxyModel,
+)
+from PyQt6.QtGui import QColor, QKeySequence
+from utils.log_store import ERROR, SKIPPED, LogRing, LogSpill, log_level, spill_path
+
+LEVEL_COLORS = {ERROR: QColor("#EF9A9A"), SKIPPED: QColor("#90A4AE")}
+
+
+class LogModel(QAbstractListModel):
+    # List model over a LogRing, and the view only ever draws the rows on
+    # screen. Every line also goes to the spill file; lines pushed out of the
+    # ring are simply forgotten.
+
+    def __init__(self, parent=None, ring=None, spill=None):
+        super().__init__(parent)
+        self.ring = ring if ring is not None else LogRing()
+        self.spill = spill if spill is not None else LogSpill(spill_path())
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.ring)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        level, message = self.ring[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return message
+        if role == Qt.ItemDataRole.ForegroundRole:
+            return LEVEL_COLORS.get(level)
+        return None
+
+    def level(self, row):
+        return self.ring[row][0]
+
+    def append(self, lines, written=False):
+        # written: the lines are in the spill already (a worker's EventBatcher
+        # wrote them)
+        if not lines:
+            return
+        if not written:
+            self.spill.write(lines)
+        # A batch bigger than the ring never reaches the screen
+        entries = [(log_level(line), line) for line in lines[-self.ring.capacity :]]
+        excess = len(entries) - self.ring.room()
+        if excess > 0:
+            self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+            self.ring.drop_oldest(excess)
+            self.endRemoveRows()
+        first = len(self.ring)
+        self.beginInsertRows(QModelIndex(), first, first + len(entries) - 1)
+        self.ring.extend(entries)
+        self.endInsertRows()
+
+
+class LevelFilter(QSortFilterProxyModel):
+    # Hides lines below a level. Changing the level rebuilds the row mapping
+    # only; the lines themselves aren't touched.
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.minimum = SKIPPED
+
+    def set_minimum(self, level):
+        if level != self.minimum:
+            self.minimum = level
+            self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        return (
+            self.minimum <= SKIPPED
+            or self.sourceModel().level(source_row) >= self.minimum
+        )
+
+
+class LogView(QListView):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        # All rows the same height, so scrolling never measures the text
+        self.setUniformItemSizes(True)
+        self.setWordWrap(False)
+        self.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollMode.ScrollPerItem)
+        self.setHorizontalScrollMode(QAbstractItemView.ScrollMode.ScrollPerPixel)
+
+    def at_bottom(self):
+        bar = self.verticalScrollBar()
+        return bar.value() >= bar.maximum()
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.StandardKey.Copy):
+            rows = sorted(self.selectedIndexes(), key=lambda index: index.row())
+            QApplication.clipboard().setText("\n".join(index.data() for index in rows))
+            return
+        super().keyPressEvent(event)
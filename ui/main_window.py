@@ -10,41 +10,94 @@ from PyQt6.QtWidgets import (
     QLineEdit,
     QLabel,
     QProgressBar,
-    QTextEdit,
+    QComboBox,
     QFileDialog,
     QStatusBar,
     QFrame,
     QApplication,
 )
-from PyQt6.QtCore import Qt, QPoint, QThread, pyqtSignal
+from PyQt6.QtCore import Qt, QPoint, QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QFont, QPalette, QColor, QIcon
+from ui.log_view import LevelFilter, LogModel, LogView
+from utils.event_batcher import EventBatcher
+from utils.log_store import ERROR, INFO, MOVED, SKIPPED
+from utils.duplicate_operations import move_duplicates
+from utils.similar_operations import move_similar_images
+from utils.combined_operations import organize_combined
 from utils.file_operations import move_short_videos, move_screenshots
+from utils.metrics import finish_run, start_run
+from utils.probe_runner import allow_probes, cancel_probes
+from utils.profiling import SamplingProfiler, profile_path
+
+UI_REFRESH_RATE = 20  # Log and progress updates per second while a worker runs
+CANCEL_WAIT_MS = 2000  # Longest the window blocks on Cancel
+
+# Log filter choices and the lowest level each one shows
+LOG_FILTERS = [
+    ("All messages", SKIPPED),
+    ("Hide skipped", MOVED),
+    ("Summaries and errors", INFO),
+    ("Errors only", ERROR),
+]
 
 
 class WorkerThread(QThread):
-    update_progress = pyqtSignal(int, int, int, str)
-    update_log = pyqtSignal(str)
     finished = pyqtSignal()
 
-    def __init__(self, function, source, destination):
+    def __init__(self, function, source, destination, profile=False, spill=None):
         super().__init__()
         self.function = function
         self.source = source
         self.destination = destination
         self.is_running = True
+        self.metrics = None
+        self.summary_path = None
+        # Sampled while the operation runs; None unless profiling
+        self.profiler = SamplingProfiler() if profile else None
+        self.profile_paths = None
+        self.error = None  # What the operation raised, if it failed
+        # Log lines and progress are buffered here and picked up by the
+        # window's refresh timer instead of being signalled per file; the
+        # spill gets every line, even those the window leaves out
+        self.events = EventBatcher(spill=spill)
 
     def run(self):
-        self.function(
-            self.source,
-            self.destination,
-            self.update_log.emit,
-            self.update_progress.emit,
-            self.check_if_running,
-        )
-        self.finished.emit()
+        allow_probes()
+        self.metrics = start_run(self.function.__name__)
+        if self.profiler is not None:
+            self.profiler.start()
+        try:
+            try:
+                self.function(
+                    self.source,
+                    self.destination,
+                    self.events.log,
+                    self.events.progress,
+                    self.check_if_running,
+                )
+            except Exception as e:
+                self.error = e
+                self.events.log(f"Error: {str(e)}")
+            finally:
+                if self.profiler is not None:
+                    self.profiler.stop()
+                    try:
+                        self.profile_paths = self.profiler.write(
+                            profile_path(self.function.__name__), self.metrics
+                        )
+                    except OSError as e:
+                        self.events.log(f"Could not write the profile: {str(e)}")
+                _, self.summary_path = finish_run(
+                    self.metrics, source=self.source, destination=self.destination
+                )
+        finally:
+            # The window waits for this to enable its buttons again
+            self.finished.emit()
 
     def stop(self):
         self.is_running = False
+        # Probes in flight are killed rather than waited for
+        cancel_probes()
 
     def check_if_running(self):
         return self.is_running
@@ -181,6 +234,24 @@ class MainWindow(QMainWindow):
         self.screenshots_button.clicked.connect(self.move_screenshots)
         action_buttons_layout.addWidget(self.screenshots_button)
 
+        # Duplicates button
+        self.duplicates_button = QPushButton("Duplicates", self)
+        self.duplicates_button.setStyleSheet(button_style)
+        self.duplicates_button.clicked.connect(self.move_duplicates)
+        action_buttons_layout.addWidget(self.duplicates_button)
+
+        # Similar photos button
+        self.similar_button = QPushButton("Similar", self)
+        self.similar_button.setStyleSheet(button_style)
+        self.similar_button.clicked.connect(self.move_similar_images)
+        action_buttons_layout.addWidget(self.similar_button)
+
+        # All-in-one button
+        self.combined_button = QPushButton("All", self)
+        self.combined_button.setStyleSheet(button_style)
+        self.combined_button.clicked.connect(self.organize_combined)
+        action_buttons_layout.addWidget(self.combined_button)
+
         content_layout.addLayout(action_buttons_layout)
 
         # Progress bar
@@ -210,10 +281,44 @@ class MainWindow(QMainWindow):
         )
         content_layout.addWidget(self.progress_bar)
 
-        # Log output
-        self.log_output = QTextEdit(self)
-        self.log_output.setReadOnly(True)  # Make console read-only
+        # Collapsible run metrics, refreshed while a worker runs
+        self.metrics_button = QPushButton("Metrics ▸", self)
+        self.metrics_button.setStyleSheet(button_style)
+        self.metrics_button.setCheckable(True)
+        self.metrics_button.toggled.connect(self.toggle_metrics)
+        self.profile_button = QPushButton("Profile runs", self)
+        self.profile_button.setStyleSheet(button_style)
+        self.profile_button.setCheckable(True)
+        self.profile_button.setToolTip(
+            "Record a profile of each run for flame graphs and pstats"
+        )
+        self.log_filter = QComboBox(self)
+        for label, _ in LOG_FILTERS:
+            self.log_filter.addItem(label)
+        self.log_filter.currentIndexChanged.connect(self.filter_log)
+        metrics_layout = QHBoxLayout()
+        metrics_layout.addWidget(self.metrics_button)
+        metrics_layout.addWidget(self.profile_button)
+        metrics_layout.addWidget(self.log_filter)
+        content_layout.addLayout(metrics_layout)
+
+        self.metrics_label = QLabel(self)
+        self.metrics_label.setFont(QFont("Monospace", 9))
+        self.metrics_label.setStyleSheet("color: white;")
+        self.metrics_label.setTextInteractionFlags(
+            Qt.TextInteractionFlag.TextSelectableByMouse
+        )
+        self.metrics_label.setVisible(False)
+        content_layout.addWidget(self.metrics_label)
+
+        # Log output: the newest lines in memory, every line on disk
+        self.log_model = LogModel(self)
+        self.log_proxy = LevelFilter(self)
+        self.log_proxy.setSourceModel(self.log_model)
+        self.log_output = LogView(self)
+        self.log_output.setModel(self.log_proxy)
         content_layout.addWidget(self.log_output)
+        self.logged_at_start = 0
 
         # Cancel button
         self.cancel_button = QPushButton("Cancel", self)
@@ -253,6 +358,11 @@ class MainWindow(QMainWindow):
         # Set margins for main layout
         main_layout.setContentsMargins(0, 0, 0, 0)
 
+        # Pulls buffered worker output onto the screen at a fixed rate
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setInterval(1000 // UI_REFRESH_RATE)
+        self.refresh_timer.timeout.connect(self.flush_worker_events)
+
     def mousePressEvent(self, event):
         if event.button() == Qt.MouseButton.LeftButton:
             self.old_pos = event.globalPosition().toPoint()
@@ -318,7 +428,7 @@ class MainWindow(QMainWindow):
             QPushButton:pressed {
                 background-color: #263238;
             }
-            QLineEdit, QTextEdit {
+            QLineEdit, QListView, QComboBox {
                 background-color: #37474F;
                 color: #E0E0E0;
                 border: 1px solid #455A64;
@@ -374,53 +484,162 @@ class MainWindow(QMainWindow):
         destination_folder = self.destination_input.text()
 
         if not source_folder or not destination_folder:
-            self.log_output.append("Please select both source and destination folders.")
+            self.append_log("Please select both source and destination folders.")
             self.update_status("Error: Missing folders")
             return
 
         self.reset_progress_bar()
         self.update_status("Processing videos...")
-        self.log_output.append("Moving videos...")
+        self.append_log("Moving videos...")
 
-        self.worker = WorkerThread(move_short_videos, source_folder, destination_folder)
-        self.worker.update_progress.connect(self.update_progress)
-        self.worker.update_log.connect(self.append_log)
-        self.worker.finished.connect(self.on_operation_finished)
-        self.worker.start()
-
-        self.cancel_button.setEnabled(True)  # Enable Cancel button
+        self.start_worker(move_short_videos, source_folder, destination_folder)
 
     def move_screenshots(self):
         source_folder = self.source_input.text()
         destination_folder = self.destination_input.text()
 
         if not source_folder or not destination_folder:
-            self.log_output.append("Please select both source and destination folders.")
+            self.append_log("Please select both source and destination folders.")
             self.update_status("Error: Folders not selected")
             return
 
         self.reset_progress_bar()
         self.update_status("Processing screenshots...")
-        self.log_output.append("Starting search and moving of screenshots...")
+        self.append_log("Starting search and moving of screenshots...")
+
+        self.start_worker(move_screenshots, source_folder, destination_folder)
+
+    def move_duplicates(self):
+        source_folder = self.source_input.text()
+        destination_folder = self.destination_input.text()
+
+        if not source_folder or not destination_folder:
+            self.append_log("Please select both source and destination folders.")
+            self.update_status("Error: Folders not selected")
+            return
+
+        self.reset_progress_bar()
+        self.update_status("Looking for duplicates...")
+        self.append_log("Starting search and moving of duplicates...")
+
+        self.start_worker(move_duplicates, source_folder, destination_folder)
+
+    def move_similar_images(self):
+        source_folder = self.source_input.text()
+        destination_folder = self.destination_input.text()
+
+        if not source_folder or not destination_folder:
+            self.append_log("Please select both source and destination folders.")
+            self.update_status("Error: Folders not selected")
+            return
+
+        self.reset_progress_bar()
+        self.update_status("Looking for similar photos...")
+        self.append_log("Starting search and moving of similar photos...")
+
+        self.start_worker(move_similar_images, source_folder, destination_folder)
+
+    def organize_combined(self):
+        source_folder = self.source_input.text()
+        destination_folder = self.destination_input.text()
+
+        if not source_folder or not destination_folder:
+            self.append_log("Please select both source and destination folders.")
+            self.update_status("Error: Folders not selected")
+            return
+
+        self.reset_progress_bar()
+        self.update_status("Processing all rules...")
+        self.append_log(
+            "Moving short videos and screenshots and organizing the rest by date..."
+        )
 
-        self.worker = WorkerThread(move_screenshots, source_folder, destination_folder)
-        self.worker.update_progress.connect(self.update_progress)
-        self.worker.update_log.connect(self.append_log)
+        self.start_worker(organize_combined, source_folder, destination_folder)
+
+    def start_worker(self, function, source_folder, destination_folder):
+        if hasattr(self, "worker") and self.worker.isRunning():
+            self.append_log(
+                "The previous operation is still stopping; try again shortly."
+            )
+            return
+        self.worker = WorkerThread(
+            function,
+            source_folder,
+            destination_folder,
+            profile=self.profile_button.isChecked(),
+            spill=self.log_model.spill,
+        )
         self.worker.finished.connect(self.on_operation_finished)
+        self.logged_at_start = self.log_model.spill.written
         self.worker.start()
+        self.refresh_timer.start()
 
         self.cancel_button.setEnabled(True)  # Enable Cancel button
 
+    def toggle_metrics(self, shown):
+        self.metrics_button.setText("Metrics ▾" if shown else "Metrics ▸")
+        self.metrics_label.setVisible(shown)
+        self.refresh_metrics()
+
+    def refresh_metrics(self):
+        if not self.metrics_button.isChecked():
+            return
+        metrics = self.worker.metrics if hasattr(self, "worker") else None
+        if metrics is None:
+            self.metrics_label.setText("No run yet.")
+        else:
+            self.metrics_label.setText("\n".join(metrics.describe()))
+
+    def flush_worker_events(self):
+        if not hasattr(self, "worker"):
+            return
+        self.refresh_metrics()
+        batch = self.worker.events.drain()
+        if batch.dropped:
+            # The left-out lines came before these; the file has them all
+            batch.lines.insert(0, f"... {batch.dropped} lines only in the log file ...")
+        if batch.lines:
+            # One insert and one scroll per frame, however many lines arrived.
+            # The worker has written them to the log file already.
+            self.append_lines(batch.lines, written=True)
+        if batch.progress is not None:
+            self.update_progress(*batch.progress)
+
     def cancel_operation(self):
         if hasattr(self, "worker") and self.worker.isRunning():
             self.worker.stop()
-            self.worker.wait()  # Wait for thread completion
+            # A file stuck on a slow disk can't be interrupted; the window
+            # stays responsive and the finished signal wraps up later
+            if not self.worker.wait(CANCEL_WAIT_MS):
+                self.cancel_button.setEnabled(False)
+                self.update_status("Cancelling...")
+                self.append_log("Cancelling; waiting for the current file to finish...")
+                return
             self.on_operation_finished()
             self.append_log("Operation cancelled by user.")
 
     def on_operation_finished(self):
-        self.update_status("Done")
-        self.log_output.append("Operation completed.")
+        self.refresh_timer.stop()
+        self.flush_worker_events()
+        failed = hasattr(self, "worker") and self.worker.error is not None
+        self.update_status("Failed" if failed else "Done")
+        events = self.worker.events if hasattr(self, "worker") else None
+        if events is not None and events.total_dropped:
+            self.append_log(
+                f"{events.total_dropped} log lines were left out of the window and "
+                f"{events.total_compacted} progress updates merged to keep the UI responsive."
+            )
+        if hasattr(self, "worker") and self.worker.summary_path:
+            self.append_log(f"Run metrics saved to {self.worker.summary_path}")
+        if hasattr(self, "worker") and self.worker.profile_paths:
+            for kind, path in self.worker.profile_paths.items():
+                self.append_log(f"Profile ({kind}) saved to {path}")
+        logged = self.log_model.spill.written - self.logged_at_start
+        if logged:
+            self.append_log(
+                f"The full log ({logged} lines) is in {self.log_model.spill.path}"
+            )
+        self.append_log("Operation failed." if failed else "Operation completed.")
         self.cancel_button.setEnabled(False)  # Disable Cancel button
 
     def update_progress(self, current, total, percentage, current_file=""):
@@ -434,8 +653,16 @@ class MainWindow(QMainWindow):
             self.progress_bar.setFormat(f"{current}/{total} {percentage}%")
 
     def append_log(self, message):
-        self.log_output.append(message)
-        self.log_output.verticalScrollBar().setValue(
-            self.log_output.verticalScrollBar().maximum()
-        )
+        self.append_lines([message])
+
+    def append_lines(self, lines, written=False):
+        # Stay at the newest line unless the user has scrolled up
+        follow = self.log_output.at_bottom()
+        self.log_model.append(lines, written)
+        if follow:
+            self.log_output.scrollToBottom()
+
+    def filter_log(self, index):
+        self.log_proxy.set_minimum(LOG_FILTERS[index][1])
+        self.log_output.scrollToBottom()
 
@@ -1,8 +1,37 @@
 import os
-import shutil
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
-from PIL import Image
 import re
+from utils.catalog import (
+    MISSING,
+    cached_attribute,
+    flush_catalog,
+    lookup_attribute,
+    store_attribute,
+)
+from utils.destination_index import DestinationIndex
+from utils.image_headers import DATE_TAGS, HEADER_ERRORS, read_image_header
+from utils.journal import open_journal
+from utils.manifest import PlannedMove, PlanSummary, run_plan
+from utils.metrics import measured
+from utils.pipeline import PipelineMonitor
+from utils.probe_pool import batched, ordered_map
+from utils.scanner import open_scanner, report_progress
+from utils.video_headers import read_video_creation_time
+
+EXIF_BATCH_SIZE = 32  # Files per task sent to a worker process
+
+# A folder moved as a whole is dated by the first of its files that has a
+# date, looking at the likeliest files first: photos' EXIF, then videos'
+# recording time, then other images' EXIF, and file names last
+HEADER_DATE_FORMATS = (".jpg", ".jpeg", ".heic", ".heif")
+HEIF_FORMATS = (".heic", ".heif")  # Pillow can't open these without a plugin
+CREATION_TIME_FORMATS = (".mp4", ".mov", ".m4v", ".3gp")
+EXIF_FORMATS = (".png", ".tif", ".tiff", ".webp", ".dng")
+FOLDER_DATE_PROBES = 4  # Files of a folder read at once
+FOLDER_DATE_KEY = "folder_date"
 
 
 def extract_date_from_filename(filename):
@@ -30,151 +59,519 @@ def extract_date_from_filename(filename):
     return None
 
 
-def extract_date_from_exif(file_path):
+def extract_date_from_exif(file_path, st=None):
+    date_str = cached_attribute(
+        file_path, "exif_date", lambda: _exif_date_as_string(file_path), st=st
+    )
+    return datetime.fromisoformat(date_str) if date_str else None
+
+
+def extract_date_from_header(file_path, st=None):
+    # Same as extract_date_from_exif, for JPEG and HEIF, without Pillow
+    date_str = cached_attribute(
+        file_path, "exif_date", lambda: _header_date_as_string(file_path), st=st
+    )
+    return datetime.fromisoformat(date_str) if date_str else None
+
+
+def _exif_date_as_string(file_path):
+    # The catalog stores JSON, so dates travel as ISO strings
+    file_date = read_exif_date(file_path)
+    return file_date.isoformat() if file_date else None
+
+
+def _header_date_as_string(file_path):
+    file_date = read_header_date(file_path)
+    return file_date.isoformat() if file_date else None
+
+
+def read_exif_date(file_path):
+    if file_path.lower().endswith(HEIF_FORMATS):
+        return read_header_date(file_path)
+    return read_pillow_exif_date(file_path)
+
+
+def read_header_date(file_path):
+    try:
+        header = read_image_header(file_path, DATE_TAGS)
+    except HEADER_ERRORS:
+        return None
+    return date_from_exif_tags(header.tags) if header is not None else None
+
+
+@measured("exif.pillow")
+def read_pillow_exif_date(file_path):
+    # Pillow is imported on first use to keep startup fast
+    from PIL import Image
+
     try:
         with Image.open(file_path) as img:
             if hasattr(img, "_getexif") and img._getexif() is not None:
-                exif = img._getexif()
-                # List of EXIF tags that may contain creation date
-                date_tags = [
-                    36867,
-                    36868,
-                    306,
-                    50971,
-                ]  # DateTimeOriginal, DateTime, etc.
-
-                for tag in date_tags:
-                    if tag in exif:
-                        try:
-                            date_str = exif[tag]
-                            # Processing various date formats in EXIF
-                            for fmt in ["%Y:%m:%d %H:%M:%S", "%Y-%m-%d %H:%M:%S"]:
-                                try:
-                                    return datetime.strptime(
-                                        date_str.split(".")[0], fmt
-                                    )
-                                except ValueError:
-                                    continue
-                        except Exception:
-                            continue
+                return date_from_exif_tags(img._getexif())
     except Exception:
         pass
     return None
 
 
+def date_from_exif_tags(exif):
+    # First creation date among the EXIF tags (tag id -> value) that parses
+    for tag in DATE_TAGS:
+        if tag in exif:
+            try:
+                date_str = exif[tag]
+                # Processing various date formats in EXIF
+                for fmt in ["%Y:%m:%d %H:%M:%S", "%Y-%m-%d %H:%M:%S"]:
+                    try:
+                        return datetime.strptime(date_str.split(".")[0], fmt)
+                    except ValueError:
+                        continue
+            except Exception:
+                continue
+    return None
+
+
+def resolve_exif_dates(file_paths):
+    # Runs in worker processes; the catalog is only written by the parent
+    return [_exif_date_as_string(file_path) for file_path in file_paths]
+
+
+def _split_cached(batch):
+    # Pairs each entry with its cached date (or MISSING) and returns the
+    # paths that still need to be read
+    resolved = []
+    uncached = []
+    for entry in batch:
+        try:
+            date_str = lookup_attribute(entry.path, "exif_date", entry.stat())
+        except OSError:
+            date_str = MISSING
+        resolved.append([entry, date_str])
+        if date_str is MISSING:
+            uncached.append(entry.path)
+    return resolved, uncached
+
+
+class _ExifPool:
+    # Process pool that is abandoned once broken (a worker crashed or was
+    # killed): later batches get a failed future instead of aborting the
+    # run, and are read in this process
+    def __init__(self, workers):
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.broken = False
+
+    def submit(self, function, argument):
+        if not self.broken:
+            try:
+                return self.executor.submit(function, argument)
+            except BrokenProcessPool:
+                self.broken = True
+        future = Future()
+        future.set_exception(BrokenProcessPool("EXIF worker pool is broken"))
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        self.executor.shutdown(wait=wait, cancel_futures=cancel_futures)
+
+
+def iter_exif_dates(entries, workers=None, check_if_running=None, stats=None):
+    # Yields (entry, datetime or None) in input order. With more than one
+    # worker, EXIF is decoded in batches on a process pool while this thread
+    # keeps consuming results, so the caller stays the single mover.
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1:
+        for entry in entries:
+            started = stats.begin() if stats is not None else None
+            try:
+                st = entry.stat()
+            except OSError:
+                st = None
+            file_date = extract_date_from_exif(entry.path, st)
+            if started is not None:
+                stats.end(started)
+            yield entry, file_date
+        return
+
+    batches = (_split_cached(batch) for batch in batched(entries, EXIF_BATCH_SIZE))
+    pool = _ExifPool(workers)
+    results = ordered_map(
+        resolve_exif_dates,
+        batches,
+        check_if_running,
+        max_workers=workers * 2,
+        executor=pool,
+        payload=lambda batch: batch[1],
+        stats=stats,
+    )
+    try:
+        for (resolved, uncached), future in results:
+            try:
+                dates = iter(future.result())
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    pool.broken = True
+                # The batch was never read; don't cache it as dateless
+                dates = iter(resolve_exif_dates(uncached))
+            for entry, date_str in resolved:
+                if date_str is MISSING:
+                    date_str = next(dates)
+                    try:
+                        store_attribute(entry.path, "exif_date", date_str, entry.stat())
+                    except OSError:
+                        pass
+                yield entry, datetime.fromisoformat(date_str) if date_str else None
+    finally:
+        results.close()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 def should_move_folder(folder_name):
     # Check if folder contains date in YYYY.MM.DD or YYYY-MM-DD format
     date_pattern = r"\d{4}[.-]\d{2}[.-]\d{2}"
     return not re.match(date_pattern, folder_name)
 
 
-def organize_by_date(
-    source_folder, destination_folder, log_callback, progress_callback
-):
-    total_files = 0
-    processed_files = 0
-    moved_files = 0
+def may_move_folder(root, source_folder, paths=None):
+    # Folders only move as a whole when the tree is walked. Files of a batch
+    # (watch) may sit in a folder that is still being filled, and the
+    # source folder itself always stays where it is.
+    return (
+        paths is None
+        and os.path.normpath(root) != os.path.normpath(source_folder)
+        and should_move_folder(os.path.basename(root))
+    )
 
-    # Count files
-    log_callback("Counting files...")
-    for root, dirs, files in os.walk(source_folder):
-        total_files += len(files)
 
-    if total_files == 0:
-        log_callback("No files found.")
-        progress_callback(0, 0, 0, "")
-        return
+_folder_pool = None
+_folder_pool_lock = threading.Lock()
+
+
+def _folder_date_pool():
+    global _folder_pool
+    with _folder_pool_lock:
+        if _folder_pool is None:
+            _folder_pool = ThreadPoolExecutor(
+                max_workers=FOLDER_DATE_PROBES, thread_name_prefix="folder-date"
+            )
+        return _folder_pool
+
+
+def _metadata_date(path, skip):
+    if skip is not None and skip(path):
+        return None
+    name = path.lower()
+    if name.endswith(HEADER_DATE_FORMATS):
+        return extract_date_from_header(path)
+    if name.endswith(CREATION_TIME_FORMATS):
+        return read_video_creation_time(path)
+    return extract_date_from_exif(path)
 
-    log_callback(f"Found {total_files} files")
-
-    for root, dirs, files in os.walk(source_folder):
-        rel_path = os.path.relpath(root, source_folder)
-        current_folder = os.path.basename(root)
-
-        # Check if we need to move the entire folder
-        if should_move_folder(current_folder):
-            folder_date = None
-            # Find creation date of first file in folder
-            for file in files:
-                file_path = os.path.join(root, file)
-                file_date = extract_date_from_exif(file_path)
-                if file_date:
-                    folder_date = file_date
-                    break
-
-            if folder_date:
-                # Remove date from folder name if present
-                folder_name = re.sub(
-                    r"^\d{2}(\.\d{2})?(\s+|$)", "", current_folder
-                ).strip()
-
-                # If folder name is empty after date removal, use original name
-                if not folder_name:
-                    folder_name = current_folder
-
-                # Create destination path including cleaned folder name
-                dest_path = os.path.join(
-                    destination_folder,
-                    str(folder_date.year),
-                    f"{folder_date.month:02d}",
-                    f"{folder_date.day:02d} {folder_name}".strip(),
-                )
+
+def infer_folder_date(folder, skip=None):
+    # Date of the first file, in order of how likely it is to carry one,
+    # that has a date, leaving out files for which skip(path) is true. A few
+    # files are read at once and the search stops at the first hit.
+    files = []
+    try:
+        with os.scandir(folder) as it:
+            for entry in it:
                 try:
-                    if not os.path.exists(dest_path):
-                        shutil.copytree(root, dest_path)
-                        shutil.rmtree(root)
-                        log_callback(
-                            f"Moved entire folder: {rel_path} -> {os.path.relpath(dest_path, destination_folder)}"
-                        )
-                    continue
-                except Exception as e:
-                    log_callback(f"Error moving folder {rel_path}: {str(e)}")
+                    if entry.is_file():
+                        files.append(entry.path)
+                except OSError:
                     continue
+    except OSError:
+        return None
 
-        for file in files:
-            processed_files += 1
-            percentage = int((processed_files / total_files) * 100)
-            progress_callback(processed_files, total_files, percentage, file)
+    candidates = [
+        path
+        for formats in (HEADER_DATE_FORMATS, CREATION_TIME_FORMATS, EXIF_FORMATS)
+        for path in files
+        if path.lower().endswith(formats)
+    ]
+    results = ordered_map(
+        lambda path: _metadata_date(path, skip),
+        candidates,
+        max_workers=FOLDER_DATE_PROBES,
+        executor=_folder_date_pool(),
+    )
+    try:
+        for _, future in results:
+            try:
+                file_date = future.result()
+            except Exception:
+                continue
+            if file_date:
+                return file_date
+    finally:
+        results.close()
 
-            file_path = os.path.join(root, file)
+    for path in files:
+        file_date = extract_date_from_filename(os.path.basename(path))
+        if file_date and not (skip is not None and skip(path)):
+            return file_date
+    return None
 
-            # Get file date
-            file_date = extract_date_from_exif(file_path)
 
-            if not file_date:
-                file_date = extract_date_from_filename(file)
+def find_folder_date(folder, skip=None, cache_key=FOLDER_DATE_KEY):
+    # infer_folder_date, cached per folder until files come or go. Callers
+    # passing skip need a cache_key of their own for it.
+    try:
+        st = os.stat(folder)
+    except OSError:
+        return None
+    date_str = cached_attribute(
+        folder, cache_key, lambda: _folder_date_as_string(folder, skip), st=st
+    )
+    return datetime.fromisoformat(date_str) if date_str else None
 
-            if not file_date:
-                log_callback(f"Could not determine date for file: {file}")
-                continue
 
-            # Create destination path
-            date_path = os.path.join(
-                destination_folder,
-                str(file_date.year),
-                f"{file_date.month:02d}",
-                f"{file_date.day:02d}",
-            )
+def _folder_date_as_string(folder, skip):
+    folder_date = infer_folder_date(folder, skip)
+    return folder_date.isoformat() if folder_date else None
+
+
+def plan_folder_by_date(root, folder_date, source_folder, destination_folder, index):
+    # Returns a PlannedMove for the whole folder, or None when its
+    # destination is already taken
+    rel_path = os.path.relpath(root, source_folder)
+    current_folder = os.path.basename(root)
 
+    # Remove date from folder name if present
+    folder_name = re.sub(r"^\d{2}(\.\d{2})?(\s+|$)", "", current_folder).strip()
+
+    # If folder name is empty after date removal, use original name
+    if not folder_name:
+        folder_name = current_folder
+
+    # Create destination path including cleaned folder name
+    dest_path = os.path.join(
+        destination_folder,
+        str(folder_date.year),
+        f"{folder_date.month:02d}",
+        f"{folder_date.day:02d} {folder_name}".strip(),
+    )
+    if index.exists(dest_path):
+        return None
+    index.add(dest_path)
+    return PlannedMove(
+        root,
+        dest_path,
+        f"folder date {folder_date:%Y-%m-%d}",
+        kind="folder",
+        message=f"Moved entire folder: {rel_path} -> {os.path.relpath(dest_path, destination_folder)}",
+    )
+
+
+def plan_file_by_date(
+    entry, exif_date, destination_folder, index, log_callback, journal=None
+):
+    # Returns a PlannedMove into the file's year/month/day folder, or None
+    # when no date can be found
+    file = entry.name
+    file_date = exif_date
+    reason = "exif"
+
+    if not file_date:
+        file_date = extract_date_from_filename(file)
+        reason = "filename"
+
+    if not file_date:
+        log_callback(f"Could not determine date for file: {file}")
+        if journal is not None:
             try:
-                os.makedirs(date_path, exist_ok=True)
-                dest_file = os.path.join(date_path, file)
-
-                # If file already exists, add a number
-                counter = 1
-                base_name, ext = os.path.splitext(file)
-                while os.path.exists(dest_file):
-                    dest_file = os.path.join(date_path, f"{base_name}_{counter}{ext}")
-                    counter += 1
-
-                shutil.move(file_path, dest_file)
-                moved_files += 1
-                log_callback(
-                    f"Moved: {file} -> {os.path.relpath(dest_file, destination_folder)}"
-                )
+                journal.keep(entry.path, entry.stat())
+            except OSError:
+                pass
+        return None
 
-            except Exception as e:
-                log_callback(f"Error moving {file}: {str(e)}")
+    # Create destination path
+    date_path = os.path.join(
+        destination_folder,
+        str(file_date.year),
+        f"{file_date.month:02d}",
+        f"{file_date.day:02d}",
+    )
+
+    try:
+        st = entry.stat(follow_symlinks=False)
+    except OSError as e:
+        log_callback(f"Error moving {file}: {str(e)}")
+        return None
+
+    # If file already exists, add a number
+    dest_file = index.reserve(date_path, file)
+    return PlannedMove(
+        entry.path,
+        dest_file,
+        f"date {file_date:%Y-%m-%d} ({reason})",
+        st.st_size,
+        message=f"Moved: {file} -> {os.path.relpath(dest_file, destination_folder)}",
+        st=st,
+    )
+
+
+def plan_by_date(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    summary,
+    workers=None,
+    index=None,
+    journal=None,
+    paths=None,
+    monitor=None,
+):
+    # Yields PlannedMoves into year/month/day folders. Destination names are
+    # reserved in the index, so the plan is valid before anything is moved.
+    processed_files = 0
+    index = index or DestinationIndex()
+    monitor = monitor or PipelineMonitor()
+    decide = monitor.stage("decide")
+
+    # Files are processed while the tree is still being scanned
+    log_callback("Scanning files...")
+    scanner = open_scanner(
+        source_folder,
+        None,
+        [destination_folder],
+        check_if_running,
+        paths,
+        stats=monitor.stage("scan"),
+    )
+
+    current_root = None
+    skip_files = False  # Files of current_root are not handled one by one
+    planned_folders = set()
+
+    # Files a resumed run already looked at aren't read again
+    entries = journal.unfinished(scanner) if journal is not None else scanner
+
+    # EXIF dates are resolved ahead of this loop, possibly in other processes
+    dated_entries = iter_exif_dates(
+        entries, workers, check_if_running, monitor.stage("probe")
+    )
+
+    try:
+        for entry, exif_date in dated_entries:
+            if check_if_running is not None and not check_if_running():
+                return
+            moves = []
+            with decide.measure():
+                root = os.path.dirname(entry.path)
+
+                if root != current_root:
+                    current_root = root
+                    skip_files = False
+
+                    # Folders moved as a whole take their subfolders along
+                    parent = root
+                    while parent not in planned_folders:
+                        next_parent = os.path.dirname(parent)
+                        if next_parent == parent:
+                            break
+                        parent = next_parent
+                    if parent in planned_folders:
+                        skip_files = True
+
+                    # Check if we need to move the entire folder
+                    elif may_move_folder(root, source_folder, paths):
+                        folder_date = find_folder_date(root)
+                        if folder_date:
+                            skip_files = True
+                            move = plan_folder_by_date(
+                                root,
+                                folder_date,
+                                source_folder,
+                                destination_folder,
+                                index,
+                            )
+                            if move is not None:
+                                planned_folders.add(root)
+                                moves.append(move)
+
+                if not skip_files:
+                    processed_files += 1
+                    report_progress(
+                        progress_callback, processed_files, scanner, entry.name
+                    )
+                    move = plan_file_by_date(
+                        entry,
+                        exif_date,
+                        destination_folder,
+                        index,
+                        log_callback,
+                        journal,
+                    )
+                    if move is not None:
+                        moves.append(move)
+
+            # Handed on outside the timing: waiting for the movers isn't work
+            for move in moves:
+                summary.add(move)
+                yield move
+    finally:
+        dated_entries.close()
+        scanner.close()
+        summary.examined = scanner.discovered
+
+
+def organize_by_date(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running=None,
+    workers=None,
+    parallel_moves=1,
+    paths=None,
+    monitor=None,
+):
+    journal = open_journal("by-date", [source_folder, destination_folder], log_callback)
+    summary = PlanSummary()
+    index = DestinationIndex()
+    monitor = monitor or PipelineMonitor()
+    moves = plan_by_date(
+        source_folder,
+        destination_folder,
+        log_callback,
+        progress_callback,
+        check_if_running,
+        summary,
+        workers,
+        index,
+        journal,
+        paths,
+        monitor,
+    )
+    completed = False
+    try:
+        executor = run_plan(
+            moves,
+            log_callback,
+            check_if_running,
+            parallel_moves,
+            index=index,
+            journal=journal,
+            monitor=monitor,
+        )
+        completed = check_if_running is None or check_if_running()
+    finally:
+        if journal is not None:
+            # Kept after a cancel or a crash so the next run picks up where
+            # this one stopped
+            journal.close(completed=completed)
+    flush_catalog()
+    if check_if_running is not None and not check_if_running():
+        return
+
+    total_files = summary.examined
+    if total_files == 0:
+        log_callback("No files found.")
+        progress_callback(0, 0, 0, "")
+        return
 
     progress_callback(total_files, total_files, 100, "Complete")
-    log_callback(f"Moved {moved_files} out of {total_files} files")
+    log_callback(f"Moved {executor.moved} out of {total_files} files")
+    log_callback(f"Stage occupancy: {monitor.describe()}")
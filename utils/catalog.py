@@ -0,0 +1,265 @@
+import atexit
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from utils import metrics
+
+# Persistent cache of per-file metadata (durations, EXIF dates, screenshot
+# verdicts, ...). Entries are keyed by path and only trusted while the file's
+# size, mtime and inode are unchanged, so a second pass over a library only
+# has to look at new or modified files.
+
+DEFAULT_CATALOG_PATH = os.path.join(
+    os.path.expanduser("~"), ".handyman", "catalog.sqlite3"
+)
+CATALOG_ENV = "HANDYMAN_CATALOG"  # Path to the catalog, or "off" to disable it
+
+COMMIT_EVERY = 500  # Pending writes before a commit
+COMMIT_INTERVAL = 2.0  # Seconds between commits while writes trickle in
+
+MISSING = object()
+
+
+def file_fingerprint(st):
+    return st.st_size, st.st_mtime_ns, st.st_ino
+
+
+class MetadataCatalog:
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                attributes TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def _load(self, path, fingerprint):
+        row = self._conn.execute(
+            "SELECT size, mtime_ns, inode, attributes FROM files WHERE path = ?",
+            (path,),
+        ).fetchone()
+        if row is None or tuple(row[:3]) != fingerprint:
+            return None
+        return json.loads(row[3])
+
+    def lookup(self, path, st):
+        # All attributes stored for the file, or {} if it is new or changed
+        with self._lock:
+            return self._load(path, file_fingerprint(st)) or {}
+
+    def get(self, path, key, st):
+        return self.lookup(path, st).get(key, MISSING)
+
+    def put(self, path, key, value, st):
+        fingerprint = file_fingerprint(st)
+        with self._lock:
+            attributes = self._load(path, fingerprint) or {}
+            attributes[key] = value
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)",
+                (path, *fingerprint, json.dumps(attributes)),
+            )
+            self._pending += 1
+            if (
+                self._pending >= COMMIT_EVERY
+                or time.monotonic() - self._last_commit > COMMIT_INTERVAL
+            ):
+                self._commit()
+
+    def rename(self, old_path, new_path):
+        # Keep cached attributes when a file is moved; a same-device move
+        # keeps the fingerprint, anything else is invalidated on next lookup
+        with self._lock:
+            self._conn.execute("DELETE FROM files WHERE path = ?", (new_path,))
+            self._conn.execute(
+                "UPDATE files SET path = ? WHERE path = ?", (new_path, old_path)
+            )
+            self._pending += 1
+
+    def _commit(self):
+        self._conn.commit()
+        self._pending = 0
+        self._last_commit = time.monotonic()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self._commit()
+
+    def compact(self, check_if_running=None):
+        # Drop entries for files that are gone or changed, then reclaim space
+        removed = 0
+        with self._lock:
+            self._commit()
+            rows = self._conn.execute(
+                "SELECT path, size, mtime_ns, inode FROM files"
+            ).fetchall()
+            stale = []
+            for path, size, mtime_ns, inode in rows:
+                if check_if_running is not None and not check_if_running():
+                    break
+                try:
+                    current = file_fingerprint(os.stat(path))
+                except OSError:
+                    current = None
+                if current != (size, mtime_ns, inode):
+                    stale.append((path,))
+            self._conn.executemany("DELETE FROM files WHERE path = ?", stale)
+            self._conn.commit()
+            removed = len(stale)
+            self._conn.execute("VACUUM")
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    def stats(self):
+        with self._lock:
+            count = self._conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return {"path": self.path, "entries": count, "bytes": size}
+
+    def close(self):
+        with self._lock:
+            self._conn.commit()
+            self._conn.close()
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    # Shared catalog for the process; None when disabled or unavailable
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            path = os.environ.get(CATALOG_ENV, DEFAULT_CATALOG_PATH)
+            if not path or path.lower() == "off":
+                _catalog = False
+            else:
+                try:
+                    _catalog = MetadataCatalog(path)
+                    atexit.register(_catalog.close)
+                except (OSError, sqlite3.Error):
+                    _catalog = False
+        return _catalog or None
+
+
+def close_catalog():
+    # Closes the shared catalog; the next get_catalog() reopens it, picking
+    # up any change to $HANDYMAN_CATALOG
+    global _catalog
+    with _catalog_lock:
+        if _catalog:
+            atexit.unregister(_catalog.close)
+            _catalog.close()
+        _catalog = None
+
+
+def flush_catalog():
+    catalog = get_catalog()
+    if catalog is not None:
+        catalog.flush()
+
+
+def record_move(old_path, new_path):
+    catalog = get_catalog()
+    if catalog is not None:
+        try:
+            catalog.rename(old_path, new_path)
+        except sqlite3.Error:
+            pass
+
+
+def lookup_attribute(file_path, key, st=None):
+    # Cached value of key for file_path, or MISSING
+    catalog = get_catalog()
+    if catalog is None:
+        return MISSING
+    try:
+        if st is None:
+            st = os.stat(file_path)
+        return catalog.get(file_path, key, st)
+    except (OSError, sqlite3.Error):
+        return MISSING
+
+
+def store_attribute(file_path, key, value, st=None):
+    catalog = get_catalog()
+    if catalog is None:
+        return
+    try:
+        if st is None:
+            st = os.stat(file_path)
+        catalog.put(file_path, key, value, st)
+    except (OSError, sqlite3.Error):
+        pass
+
+
+def cached_attribute(file_path, key, compute, st=None, cache_none=True):
+    # Return the cached value of key for file_path, computing and storing it
+    # when the file is new or changed since it was last seen
+    catalog = get_catalog()
+    if catalog is None:
+        return compute()
+    if st is None:
+        try:
+            st = os.stat(file_path)
+        except OSError:
+            return compute()
+    value = lookup_attribute(file_path, key, st)
+    if value is not MISSING:
+        metrics.count("catalog.hits")
+        return value
+    metrics.count("catalog.misses")
+    value = compute()
+    if value is not None or cache_none:
+        store_attribute(file_path, key, value, st)
+    return value
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Manage the HandyMan metadata catalog")
+    parser.add_argument("command", choices=["compact", "stats"])
+    parser.add_argument("--catalog", help="Catalog path (defaults to $HANDYMAN_CATALOG)")
+    args = parser.parse_args(argv)
+
+    path = args.catalog or os.environ.get(CATALOG_ENV, DEFAULT_CATALOG_PATH)
+    if not path or path.lower() == "off":
+        print(f"The catalog is disabled (${CATALOG_ENV}={path})", file=sys.stderr)
+        return 1
+    catalog = MetadataCatalog(path)
+    try:
+        if args.command == "compact":
+            removed = catalog.compact()
+            print(f"Removed {removed} stale entries")
+        stats = catalog.stats()
+        print(f"{stats['entries']} entries, {stats['bytes']} bytes in {stats['path']}")
+    finally:
+        catalog.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
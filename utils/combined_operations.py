@@ -0,0 +1,330 @@
+import hashlib
+import json
+import os
+from contextlib import closing
+from datetime import datetime
+from utils.by_date_operations import (
+    FOLDER_DATE_KEY,
+    date_from_exif_tags,
+    extract_date_from_filename,
+    find_folder_date,
+    plan_file_by_date,
+    plan_folder_by_date,
+    may_move_folder,
+    read_exif_date,
+)
+from utils.catalog import cached_attribute, flush_catalog
+from utils.destination_index import DestinationIndex
+from utils.file_operations import load_rule
+from utils.journal import open_journal
+from utils.manifest import PlannedMove, PlanSummary, run_plan
+from utils.pipeline import PipelineMonitor
+from utils.probe_pool import batched_map
+from utils.rules import VIDEO_FORMATS, FileFacts, get_rule
+from utils.scanner import PathEntry, open_scanner, report_progress
+
+# Runs several operations in one pass: the tree is walked once, each file's
+# metadata is read once (one header read gives both the EXIF fields rules
+# look at and the EXIF date), and the file goes to the first rule that
+# claims it. The outcome is the same as running the operations one after
+# another in rule order, without walking the tree and opening the files once
+# per operation. Besides by-date, any rule from utils.rules can take part.
+
+RULES = ("short-videos", "screenshots", "by-date")  # Default priority order
+
+
+def _read_exif_date(facts):
+    # JPEG and HEIF dates come from the header already read; anything else
+    # goes through Pillow like a by-date run does
+    header = facts.image_header()
+    if header is not None and header.format in ("JPEG", "HEIF"):
+        file_date = date_from_exif_tags(header.tags)
+    else:
+        file_date = read_exif_date(facts.entry.path)
+    return file_date.isoformat() if file_date else None
+
+
+def _has_date(facts):
+    entry = facts.entry
+    if not entry.name.lower().endswith(VIDEO_FORMATS):
+        date_str = cached_attribute(
+            entry.path, "exif_date", lambda: _read_exif_date(facts), st=entry.stat()
+        )
+        if date_str:
+            facts.exif_date = datetime.fromisoformat(date_str)
+    return (
+        facts.exif_date is not None
+        or extract_date_from_filename(entry.name) is not None
+    )
+
+
+def compile_tests(rules):
+    # (rule name, test) for every rule, in priority order
+    return [
+        (rule, _has_date if rule == "by-date" else get_rule(rule).test)
+        for rule in rules
+    ]
+
+
+def probe_file(entry, tests):
+    # Returns (first rule that claims the file or None, FileFacts). Rules
+    # after the first match aren't evaluated, and a rule that fails on the
+    # file doesn't claim it, as if it had been run on its own.
+    facts = FileFacts(entry)
+    for rule, test in tests:
+        try:
+            if test(facts):
+                return rule, facts
+        except Exception as e:
+            facts.errors.append(f"{rule}: {str(e)}")
+    return None, facts
+
+
+def plan_combined(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    summary,
+    rules=RULES,
+    destinations=None,
+    journal=None,
+    paths=None,
+    probe_workers=None,
+    monitor=None,
+    index=None,
+):
+    # Yields PlannedMoves for every enabled rule in one pass. `rules` is the
+    # priority order; `destinations` maps a rule to its own destination
+    # folder (destination_folder otherwise).
+    rules = list(rules)
+    destinations = destinations or {}
+    targets = {rule: destinations.get(rule) or destination_folder for rule in rules}
+    monitor = monitor or PipelineMonitor()
+    decide = monitor.stage("decide")
+    index = index or DestinationIndex()
+    tests = compile_tests(rules)
+    by_date = "by-date" in rules
+    # Rules that get a file before by-date can move its folder as a whole
+    before_by_date = rules[: rules.index("by-date")] if by_date else rules
+    tests_before_by_date = tests[: len(before_by_date)]
+    # Files no rule could claim aren't scanned; by-date looks at everything
+    extensions = None
+    formats = [get_rule(rule).extensions for rule in rules if rule != "by-date"]
+    if not by_date and all(formats):
+        extensions = tuple({ext for rule_formats in formats for ext in rule_formats})
+
+    log_callback("Scanning files...")
+    scanner = open_scanner(
+        source_folder,
+        extensions,
+        sorted(set(targets.values())),
+        check_if_running,
+        paths,
+        stats=monitor.stage("scan"),
+    )
+    entries = journal.unfinished(scanner) if journal is not None else scanner
+    probes = batched_map(
+        lambda entry: probe_file(entry, tests),
+        entries,
+        check_if_running,
+        max_workers=probe_workers,
+        stats=monitor.stage("probe"),
+    )
+
+    def claimed_before_by_date(path):
+        # Files an earlier rule takes don't count toward a folder's date
+        return probe_file(PathEntry(path), tests_before_by_date)[0] is not None
+
+    # Which files count depends on those rules, so their folder dates are
+    # cached apart
+    folder_date_key = FOLDER_DATE_KEY
+    if tests_before_by_date:
+        specs = [[rule, get_rule(rule).spec] for rule in before_by_date]
+        key = hashlib.sha1(json.dumps(specs, sort_keys=True).encode()).hexdigest()
+        folder_date_key = f"{FOLDER_DATE_KEY}:{key[:12]}"
+
+    processed_files = 0
+    current_root = None
+    skip_files = False  # Files of current_root travel with their folder
+    planned_folders = set()
+    folder_moves = []  # Held back until every file has been routed
+
+    try:
+        with closing(probes):
+            for entry, outcome in probes:
+                if not check_if_running():
+                    return
+                move = None
+                with decide.measure():
+                    file = entry.name
+                    processed_files += 1
+                    report_progress(progress_callback, processed_files, scanner, file)
+                    try:
+                        rule, facts = outcome.result()
+                    except Exception as e:
+                        log_callback(f"Error processing {file}: {str(e)}")
+                        continue
+                    for error in facts.errors:
+                        log_callback(f"Error processing {file} ({error})")
+
+                    root = os.path.dirname(entry.path)
+                    if by_date and rule not in before_by_date:
+                        if root != current_root:
+                            current_root = root
+                            skip_files = False
+
+                            # Folders moved as a whole take their subfolders along
+                            parent = root
+                            while parent not in planned_folders:
+                                next_parent = os.path.dirname(parent)
+                                if next_parent == parent:
+                                    break
+                                parent = next_parent
+                            if parent in planned_folders:
+                                skip_files = True
+
+                            elif may_move_folder(root, source_folder, paths):
+                                folder_date = find_folder_date(
+                                    root, claimed_before_by_date, folder_date_key
+                                )
+                                if folder_date:
+                                    skip_files = True
+                                    folder_move = plan_folder_by_date(
+                                        root,
+                                        folder_date,
+                                        source_folder,
+                                        targets["by-date"],
+                                        index,
+                                    )
+                                    if folder_move is not None:
+                                        planned_folders.add(root)
+                                        folder_moves.append(folder_move)
+                        if skip_files:
+                            continue
+
+                    if rule == "by-date":
+                        move = plan_file_by_date(
+                            entry,
+                            facts.exif_date,
+                            targets["by-date"],
+                            index,
+                            log_callback,
+                        )
+                    elif rule is not None:
+                        # Files other rules take keep their folders
+                        rel_path = os.path.relpath(entry.path, source_folder)
+                        st = entry.stat(follow_symlinks=False)
+                        duration = facts.duration_if_read()
+                        guess = facts.screenshot_if_read()
+                        if duration is not None:
+                            reason = f"duration {duration:.2f}s"
+                        elif guess is not None:
+                            reason = f"screenshot {guess[0]:.2f}"
+                        else:
+                            reason = rule
+                        move = PlannedMove(
+                            entry.path,
+                            os.path.join(targets[rule], rel_path),
+                            reason,
+                            st.st_size,
+                            message=f"Moved: {rel_path} ({rule})",
+                            st=st,
+                        )
+                    else:
+                        if by_date:
+                            log_callback(f"Could not determine date for file: {file}")
+                        if journal is not None:
+                            try:
+                                journal.keep(entry.path, entry.stat())
+                            except OSError:
+                                pass
+
+                if move is not None:
+                    summary.add(move, rule)
+                    yield move
+
+        # Last, so the files other rules take out of them are gone first
+        for folder_move in folder_moves:
+            if not check_if_running():
+                return
+            summary.add(folder_move, "by-date")
+            yield folder_move
+    finally:
+        scanner.close()
+        summary.examined = scanner.discovered
+
+
+def organize_combined(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    rules=RULES,
+    destinations=None,
+    parallel_moves=1,
+    paths=None,
+    probe_workers=None,
+    monitor=None,
+):
+    rules = list(rules)
+    for rule in rules:
+        if rule != "by-date" and load_rule(rule, log_callback) is None:
+            return
+    journal = open_journal(
+        "combined-" + "+".join(rules),
+        [source_folder, destination_folder]
+        + [(destinations or {}).get(rule) or destination_folder for rule in rules],
+        log_callback,
+    )
+    summary = PlanSummary()
+    index = DestinationIndex()
+    monitor = monitor or PipelineMonitor()
+    moves = plan_combined(
+        source_folder,
+        destination_folder,
+        log_callback,
+        progress_callback,
+        check_if_running,
+        summary,
+        rules,
+        destinations,
+        journal,
+        paths,
+        probe_workers,
+        monitor,
+        index,
+    )
+    completed = False
+    try:
+        executor = run_plan(
+            moves,
+            log_callback,
+            check_if_running,
+            parallel_moves,
+            index=index,
+            journal=journal,
+            monitor=monitor,
+        )
+        completed = check_if_running()
+    finally:
+        if journal is not None:
+            # Kept after a cancel or a crash so the next run picks up where
+            # this one stopped
+            journal.close(completed=completed)
+    flush_catalog()
+    if not check_if_running():
+        return
+
+    total_files = summary.examined
+    if total_files == 0:
+        log_callback("No files found.")
+        progress_callback(0, 0, 0, "")
+        return
+
+    progress_callback(total_files, total_files, 100, "Complete")
+    counts = ", ".join(f"{rule}: {summary.rules.get(rule, 0)}" for rule in rules)
+    log_callback(f"Moved {executor.moved} out of {total_files} files ({counts})")
+    log_callback(f"Stage occupancy: {monitor.describe()}")
@@ -0,0 +1,80 @@
+import os
+import sys
+import threading
+
+# In-memory view of the destination tree. Each folder is listed once, the
+# first time something is planned into it, and the index is updated as names
+# are reserved, so picking a free name needs no stat calls and makedirs runs
+# once per folder. Reserving never touches the disk, which lets plans be made
+# without moving anything.
+
+# Default APFS/HFS+ and NTFS volumes treat names that differ only in case as
+# the same file
+CASE_INSENSITIVE = sys.platform in ("darwin", "win32")
+
+
+class DestinationIndex:
+    def __init__(self, case_insensitive=CASE_INSENSITIVE):
+        self.case_insensitive = case_insensitive
+        self._names = {}  # folder -> set of names already present
+        self._next_suffix = {}  # (folder, base, ext) -> next counter to try
+        self._created = set()  # Folders makedirs has already run for
+        self._lock = threading.RLock()
+
+    def _key(self, name):
+        return name.casefold() if self.case_insensitive else name
+
+    def _folder(self, directory):
+        names = self._names.get(directory)
+        if names is None:
+            try:
+                names = {self._key(name) for name in os.listdir(directory)}
+            except (FileNotFoundError, NotADirectoryError):
+                names = set()  # Doesn't exist yet
+            self._names[directory] = names
+            # The folder is (or will be) an entry of its parent
+            parent, name = os.path.split(directory)
+            if parent != directory and parent in self._names:
+                self._names[parent].add(self._key(name))
+        return names
+
+    def ensure_dir(self, directory):
+        with self._lock:
+            if directory not in self._created:
+                os.makedirs(directory, exist_ok=True)
+                self._created.add(directory)
+
+    def exists(self, path):
+        directory, name = os.path.split(path)
+        with self._lock:
+            return self._key(name) in self._folder(directory)
+
+    def add(self, path):
+        directory, name = os.path.split(path)
+        with self._lock:
+            self._folder(directory).add(self._key(name))
+
+    def discard(self, path):
+        directory, name = os.path.split(path)
+        with self._lock:
+            names = self._names.get(directory)
+            if names is not None:
+                names.discard(self._key(name))
+
+    def reserve(self, directory, file_name):
+        # Picks a free name in directory (file, file_1, file_2, ...) and marks
+        # it as taken
+        with self._lock:
+            names = self._folder(directory)
+            candidate = file_name
+            if self._key(candidate) in names:
+                base_name, ext = os.path.splitext(file_name)
+                suffix_key = (directory, self._key(base_name), self._key(ext))
+                counter = self._next_suffix.get(suffix_key, 1)
+                candidate = f"{base_name}_{counter}{ext}"
+                while self._key(candidate) in names:
+                    counter += 1
+                    candidate = f"{base_name}_{counter}{ext}"
+                self._next_suffix[suffix_key] = counter + 1
+            names.add(self._key(candidate))
+            return os.path.join(directory, candidate)
@@ -0,0 +1,224 @@
+import hashlib
+import mmap
+import os
+import stat
+from contextlib import closing
+from utils.catalog import cached_attribute, flush_catalog
+from utils.journal import open_journal
+from utils.manifest import PlannedMove, PlanSummary, run_plan
+from utils.metrics import measured
+from utils.move_engine import BUFFER_SIZE
+from utils.probe_pool import ordered_map
+from utils.scanner import StreamingScanner, report_progress
+
+# Exact duplicates are found in stages so that most files are never read:
+# files are grouped by size, files sharing a size are compared by a hash of
+# their first and last chunk, and only files that still collide are hashed
+# in full. Both hashes are kept in the catalog.
+
+EDGE_CHUNK = 64 * 1024  # Bytes hashed from each end of a file
+MMAP_THRESHOLD = 16 * 1024 * 1024  # Larger files are hashed through mmap
+
+
+@measured("hash.edges")
+def hash_file_edges(file_path):
+    # blake2b of the first and last EDGE_CHUNK bytes; covers the whole file
+    # when it is no larger than two chunks
+    digest = hashlib.blake2b()
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update(f.read(EDGE_CHUNK))
+        if size > EDGE_CHUNK:
+            f.seek(max(EDGE_CHUNK, size - EDGE_CHUNK))
+            digest.update(f.read(EDGE_CHUNK))
+    return digest.hexdigest()
+
+
+@measured("hash.full")
+def hash_file(file_path):
+    # blake2b of the whole file. hashlib releases the GIL on large updates,
+    # so several files can be hashed at once on worker threads.
+    digest = hashlib.blake2b()
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size >= MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                if hasattr(mapped, "madvise"):
+                    mapped.madvise(mmap.MADV_SEQUENTIAL)
+                with memoryview(mapped) as view:
+                    for offset in range(0, size, BUFFER_SIZE):
+                        digest.update(view[offset : offset + BUFFER_SIZE])
+        else:
+            buffer = bytearray(min(BUFFER_SIZE, max(size, 1)))
+            with memoryview(buffer) as view:
+                while True:
+                    n = f.readinto(buffer)
+                    if not n:
+                        break
+                    digest.update(view[:n])
+    return digest.hexdigest()
+
+
+def get_edge_hash(file_path, st=None):
+    return cached_attribute(
+        file_path, "edge_hash", lambda: hash_file_edges(file_path), st=st
+    )
+
+
+def get_full_hash(file_path, st=None):
+    return cached_attribute(file_path, "blake2b", lambda: hash_file(file_path), st=st)
+
+
+def _regroup(groups, key_function, check_if_running, progress_callback, stage):
+    # Splits every group of (path, st) by key_function, computed on worker
+    # threads, and returns the groups that still hold more than one file
+    files = [item for group in groups for item in group]
+    total = len(files)
+    split = {}
+    results = ordered_map(
+        lambda item: key_function(item[0], item[1]), files, check_if_running
+    )
+    with closing(results):
+        for done, ((file_path, st), future) in enumerate(results, 1):
+            if not check_if_running():
+                return []
+            try:
+                key = future.result()
+            except OSError:
+                continue  # Unreadable or gone; can't be a duplicate
+            split.setdefault((st.st_size, key), []).append((file_path, st))
+            percentage = int(done / total * 100) if total else 100
+            progress_callback(
+                done, total, percentage, f"{stage}: {os.path.basename(file_path)}"
+            )
+    return [group for group in split.values() if len(group) > 1]
+
+
+def plan_duplicates(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    summary,
+):
+    # Yields a PlannedMove for every file that is an exact copy of another
+    log_callback("Scanning files...")
+    scanner = StreamingScanner(
+        source_folder, exclude=[destination_folder], check_if_running=check_if_running
+    )
+    by_size = {}
+    inodes = set()  # (st_dev, st_ino) of every file kept
+    hard_links = 0
+    processed_files = 0
+    try:
+        for entry in scanner:
+            if not check_if_running():
+                return
+            processed_files += 1
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            if not stat.S_ISREG(st.st_mode) or st.st_size == 0:
+                continue  # Links and empty files are never treated as copies
+            if st.st_ino:
+                # Hard links share their data; moving one would free nothing
+                inode = (st.st_dev, st.st_ino)
+                if inode in inodes:
+                    hard_links += 1
+                    continue
+                inodes.add(inode)
+            by_size.setdefault(st.st_size, []).append((entry.path, st))
+            if processed_files % 1000 == 0:
+                report_progress(progress_callback, processed_files, scanner, entry.name)
+    finally:
+        scanner.close()
+        summary.examined = scanner.discovered
+
+    groups = [group for group in by_size.values() if len(group) > 1]
+    by_size = inodes = None
+    if hard_links:
+        log_callback(f"Skipped {hard_links} hard links to files already found")
+    log_callback(
+        f"{sum(len(group) for group in groups)} files share their size with another file"
+    )
+
+    groups = _regroup(
+        groups, get_edge_hash, check_if_running, progress_callback, "Comparing"
+    )
+    # Files no larger than two chunks were hashed whole already
+    small = [group for group in groups if group[0][1].st_size <= 2 * EDGE_CHUNK]
+    large = [group for group in groups if group[0][1].st_size > 2 * EDGE_CHUNK]
+    if large:
+        log_callback(f"Hashing {sum(len(group) for group in large)} files in full")
+    groups = small + _regroup(
+        large, get_full_hash, check_if_running, progress_callback, "Hashing"
+    )
+    if not check_if_running():
+        return
+
+    for group in groups:
+        # The oldest copy stays where it is
+        group.sort(key=lambda item: (item[1].st_mtime_ns, item[0]))
+        original = group[0][0]
+        for file_path, st in group[1:]:
+            rel_path = os.path.relpath(file_path, source_folder)
+            move = PlannedMove(
+                file_path,
+                os.path.join(destination_folder, rel_path),
+                f"duplicate of {original}",
+                st.st_size,
+                message=f"Moved: {rel_path} (duplicate of {os.path.relpath(original, source_folder)})",
+                st=st,
+            )
+            summary.add(move)
+            yield move
+
+
+def move_duplicates(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    parallel_moves=1,
+):
+    journal = open_journal(
+        "duplicates", [source_folder, destination_folder], log_callback
+    )
+    summary = PlanSummary()
+    moves = plan_duplicates(
+        source_folder,
+        destination_folder,
+        log_callback,
+        progress_callback,
+        check_if_running,
+        summary,
+    )
+    completed = False
+    try:
+        executor = run_plan(
+            moves, log_callback, check_if_running, parallel_moves, journal=journal
+        )
+        completed = check_if_running()
+    finally:
+        if journal is not None:
+            # Kept after a cancel or a crash so the next run picks up where
+            # this one stopped
+            journal.close(completed=completed)
+    flush_catalog()
+    if not check_if_running():
+        return
+
+    total_files = summary.examined
+    if total_files == 0:
+        log_callback("No files found.")
+        progress_callback(0, 0, 0, "")
+        return
+
+    progress_callback(total_files, total_files, 100, "Complete")
+    log_callback(
+        f"Moved {executor.moved} duplicates ({summary.planned_bytes / 1024 / 1024:.1f} MB) "
+        f"out of {total_files} files."
+    )
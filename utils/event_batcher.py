@@ -0,0 +1,69 @@
+import threading
+from collections import deque
+
+# Collects log lines and progress updates from a worker so the UI can pick
+# them up at its own pace. The worker only ever appends under a short lock;
+# it never waits for the UI to draw anything. With a spill (a LogSpill),
+# every line is also written to disk in order, so only the window's copy
+# loses lines when the worker outpaces it.
+
+MAX_PENDING_LINES = 5000  # Oldest lines are dropped beyond this between flushes
+SPILL_BATCH_LINES = 256  # Lines gathered before they are written to the spill
+
+
+class EventBatch:
+    def __init__(self, lines, progress, dropped, compacted):
+        self.lines = lines
+        self.progress = progress  # Latest (current, total, percentage, file) or None
+        self.dropped = dropped  # Log lines left out since the previous batch
+        self.compacted = compacted  # Progress updates superseded since the previous batch
+
+
+class EventBatcher:
+    def __init__(self, max_pending_lines=MAX_PENDING_LINES, spill=None):
+        self.spill = spill
+        self._lines = deque(maxlen=max_pending_lines)
+        self._unwritten = []  # Lines not yet in the spill
+        self._progress = None
+        self._dropped = 0
+        self._compacted = 0
+        self.total_dropped = 0
+        self.total_compacted = 0
+        self._lock = threading.Lock()
+
+    def log(self, message):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(message)
+            if self.spill is not None:
+                self._unwritten.append(message)
+                if len(self._unwritten) >= SPILL_BATCH_LINES:
+                    self._write_spill()
+
+    def _write_spill(self):
+        # Under the lock, so batches reach the file in the order logged
+        if self._unwritten:
+            self.spill.write(self._unwritten)
+            self._unwritten = []
+
+    def progress(self, current, total, percentage, current_file=""):
+        with self._lock:
+            if self._progress is not None:
+                self._compacted += 1
+            self._progress = (current, total, percentage, current_file)
+
+    def drain(self):
+        with self._lock:
+            if self.spill is not None:
+                self._write_spill()
+            batch = EventBatch(
+                list(self._lines), self._progress, self._dropped, self._compacted
+            )
+            self._lines.clear()
+            self._progress = None
+            self.total_dropped += self._dropped
+            self.total_compacted += self._compacted
+            self._dropped = 0
+            self._compacted = 0
+        return batch
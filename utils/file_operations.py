@@ -1,13 +1,42 @@
 import os
-import shutil
-import subprocess
-from PIL import Image  # Add this import at the beginning of the file
+from contextlib import closing
+from utils.catalog import cached_attribute, flush_catalog
+from utils.journal import open_journal
+from utils.manifest import PlannedMove, PlanSummary, run_plan
+from utils.pipeline import PipelineMonitor
+from utils.probe_pool import batched_map, ordered_map
+from utils.probe_runner import run_probe
+from utils.rules import FileFacts, RuleError, get_rule
+from utils.scanner import open_scanner, report_progress
+from utils.video_headers import read_video_duration
 
 
-def get_video_duration(file_path):
+def get_video_duration(file_path, st=None):
+    # Unknown durations aren't cached: ffprobe may simply be missing this time
+    return cached_attribute(
+        file_path,
+        "duration",
+        lambda: read_duration(file_path),
+        st=st,
+        cache_none=False,
+    )
+
+
+def read_duration(file_path):
+    # Most containers store the duration in their header, which is far
+    # cheaper to read than spawning ffprobe
+    duration = read_video_duration(file_path)
+    if duration is not None:
+        return duration
+    return probe_video_duration(file_path)
+
+
+def probe_video_duration(file_path):
+    # Raises ProbeTimeout when ffprobe hangs (the file isn't cached as
+    # unknown, so it is tried again next run)
     ffprobe_path = os.environ.get("FFPROBE_PATH", "ffprobe")
     try:
-        result = subprocess.run(
+        returncode, stdout, _ = run_probe(
             [
                 ffprobe_path,
                 "-v",
@@ -17,146 +46,356 @@ def get_video_duration(file_path):
                 "-of",
                 "default=noprint_wrappers=1:nokey=1",
                 file_path,
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
+            ]
         )
-        return float(result.stdout.strip())
-    except (subprocess.SubprocessError, FileNotFoundError, ValueError):
+        return float(stdout.decode().strip())
+    except (OSError, ValueError):
         return None
 
 
-def move_short_videos(
-    source_folder, destination_folder, log_callback, progress_callback, check_if_running
+def apply_rule(rule, entry):
+    # Returns (FileFacts, label of the condition the file failed or None)
+    facts = FileFacts(entry)
+    return facts, rule.first_failure(facts)
+
+
+def load_rule(name, log_callback):
+    try:
+        return get_rule(name)
+    except RuleError as e:
+        log_callback(f"Invalid rules: {str(e)}")
+        return None
+
+
+def plan_short_videos(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    summary,
+    journal=None,
+    paths=None,
+    probe_workers=None,
+    monitor=None,
+    rule=None,
 ):
-    video_formats = (".mp4", ".mov", ".wmv", ".avi", ".flv", ".f4v", ".mkv", ".m4v")
-    total_files = 0
+    # Yields a PlannedMove for every video the short-videos rule picks (3
+    # seconds or less by default). The scan has its own thread and the
+    # probes their own pool, with bounded queues in between; decisions are
+    # made on the thread that iterates this generator, in scan order.
+    rule = rule or get_rule("short-videos")
+    monitor = monitor or PipelineMonitor()
+    decide = monitor.stage("decide")
     processed_files = 0
-    moved_files = 0
 
-    # Count total video files
-    log_callback("Counting files...")
-    for root, _, files in os.walk(source_folder):
-        for file in files:
-            if file.lower().endswith(video_formats):
-                total_files += 1
+    # Files are processed while the tree is still being scanned
+    log_callback("Scanning files...")
+    scanner = open_scanner(
+        source_folder,
+        rule.extensions,
+        [destination_folder],
+        check_if_running,
+        paths,
+        stats=monitor.stage("scan"),
+    )
+
+    # Files a resumed run already looked at aren't probed again
+    entries = journal.unfinished(scanner) if journal is not None else scanner
 
-    log_callback(f"Found {total_files} video files")
+    # Probe durations concurrently; results still arrive in scan order
+    probes = ordered_map(
+        lambda entry: apply_rule(rule, entry),
+        entries,
+        check_if_running,
+        max_workers=probe_workers,
+        stats=monitor.stage("probe"),
+    )
 
+    try:
+        with closing(probes):
+            for entry, rule_future in probes:
+                if not check_if_running():
+                    return  # Stop execution if operation is cancelled
+                move = None
+                with decide.measure():
+                    file = entry.name
+                    root = os.path.dirname(entry.path)
+                    # Get relative path from source folder
+                    rel_path = os.path.relpath(root, source_folder)
+                    # Create the same path in destination folder
+                    dest_dir = os.path.join(destination_folder, rel_path)
+
+                    file_path = entry.path
+                    processed_files += 1
+
+                    try:
+                        # Update progress with current file
+                        report_progress(
+                            progress_callback, processed_files, scanner, file
+                        )
+
+                        facts, failure = rule_future.result()
+                        duration = facts.duration_if_read()
+                        if failure is None:
+                            # Keep the folder structure below the destination
+                            st = entry.stat(follow_symlinks=False)
+                            move = PlannedMove(
+                                file_path,
+                                os.path.join(dest_dir, file),
+                                (
+                                    f"duration {duration:.2f}s"
+                                    if duration is not None
+                                    else rule.name
+                                ),
+                                st.st_size,
+                                message=f"Moved: {os.path.join(rel_path, file)}",
+                                st=st,
+                            )
+                        else:
+                            # Unknown durations are looked at again next time
+                            if not facts.duration_unknown() and journal is not None:
+                                journal.keep(file_path, entry.stat())
+                            if duration is not None:
+                                reason = f"duration: {duration:.2f}s"
+                            elif facts.duration_unknown():
+                                reason = "duration: unknown"
+                            else:
+                                reason = failure
+                            log_callback(
+                                f"Skipped: {os.path.join(rel_path, file)} ({reason})"
+                            )
+                    except Exception as e:
+                        log_callback(f"Error processing {file}: {str(e)}")
+
+                if move is not None:
+                    summary.add(move)
+                    yield move
+    finally:
+        scanner.close()
+        summary.examined = scanner.discovered
+
+
+def move_short_videos(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    parallel_moves=1,
+    paths=None,
+    probe_workers=None,
+    monitor=None,
+):
+    rule = load_rule("short-videos", log_callback)
+    if rule is None:
+        return
+    journal = open_journal(
+        "short-videos", [source_folder, destination_folder], log_callback
+    )
+    summary = PlanSummary()
+    monitor = monitor or PipelineMonitor()
+    moves = plan_short_videos(
+        source_folder,
+        destination_folder,
+        log_callback,
+        progress_callback,
+        check_if_running,
+        summary,
+        journal,
+        paths,
+        probe_workers,
+        monitor,
+        rule,
+    )
+    completed = False
+    try:
+        executor = run_plan(
+            moves,
+            log_callback,
+            check_if_running,
+            parallel_moves,
+            journal=journal,
+            monitor=monitor,
+        )
+        completed = check_if_running()
+    finally:
+        if journal is not None:
+            # Kept after a cancel or a crash so the next run picks up where
+            # this one stopped
+            journal.close(completed=completed)
+    flush_catalog()
+    if not check_if_running():
+        return  # Stop execution if operation is cancelled
+
+    total_files = summary.examined
     if total_files == 0:
         log_callback("No video files found.")
         progress_callback(0, 0, 0, "")  # current, total, percentage, filename
         return
 
-    # Move short videos
-    for root, _, files in os.walk(source_folder):
-        for file in files:
-            if not check_if_running():
-                return  # Stop execution if operation is cancelled
-            if file.lower().endswith(video_formats):
-                # Get relative path from source folder
-                rel_path = os.path.relpath(root, source_folder)
-                # Create the same path in destination folder
-                dest_dir = os.path.join(destination_folder, rel_path)
-
-                file_path = os.path.join(root, file)
-                processed_files += 1
-
-                try:
-                    # Update progress with current file
-                    percentage = int((processed_files / total_files) * 100)
-                    progress_callback(processed_files, total_files, percentage, file)
-
-                    duration = get_video_duration(file_path)
-                    if duration is not None and duration <= 3:
-                        # Create destination folder if it doesn't exist
-                        os.makedirs(dest_dir, exist_ok=True)
-                        # Move file while preserving folder structure
-                        dest_file = os.path.join(dest_dir, file)
-                        shutil.move(file_path, dest_file)
-                        moved_files += 1
-                        log_callback(f"Moved: {os.path.join(rel_path, file)}")
-                    else:
-                        duration_str = (
-                            f"{duration:.2f}s" if duration is not None else "unknown"
-                        )
-                        log_callback(
-                            f"Skipped: {os.path.join(rel_path, file)} (duration: {duration_str})"
-                        )
-                except Exception as e:
-                    log_callback(f"Error processing {file}: {str(e)}")
-
     # Final progress update
     progress_callback(total_files, total_files, 100, "Complete")
-    log_callback(f"Moved {moved_files} out of {total_files} video files.")
+    log_callback(f"Moved {executor.moved} out of {total_files} video files.")
+    log_callback(f"Stage occupancy: {monitor.describe()}")
 
 
-def move_screenshots(
-    source_folder, destination_folder, log_callback, progress_callback, check_if_running
+def plan_screenshots(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    summary,
+    journal=None,
+    paths=None,
+    probe_workers=None,
+    monitor=None,
+    rule=None,
 ):
-    image_formats = (".png", ".jpg", ".jpeg", ".tiff", ".bmp")
-    total_files = 0
+    # Yields a PlannedMove for every file the screenshots rule picks. Headers
+    # are read on a pool while the scan goes on, and decisions are made on
+    # the thread that iterates this generator, in scan order.
+    rule = rule or get_rule("screenshots")
+    monitor = monitor or PipelineMonitor()
+    decide = monitor.stage("decide")
     processed_files = 0
-    moved_files = 0
 
-    # Count total files
-    log_callback("Counting files...")
-    for root, _, files in os.walk(source_folder):
-        for file in files:
-            if file.lower().endswith(image_formats):
-                total_files += 1
+    # Files are processed while the tree is still being scanned
+    log_callback("Scanning files...")
+    scanner = open_scanner(
+        source_folder,
+        rule.extensions,
+        [destination_folder],
+        check_if_running,
+        paths,
+        stats=monitor.stage("scan"),
+    )
+
+    # Files a resumed run already looked at aren't read again
+    entries = journal.unfinished(scanner) if journal is not None else scanner
+
+    # Header reads are quick, so they go to the pool a batch at a time
+    probes = batched_map(
+        lambda entry: apply_rule(rule, entry),
+        entries,
+        check_if_running,
+        max_workers=probe_workers,
+        stats=monitor.stage("probe"),
+    )
+
+    try:
+        with closing(probes):
+            for entry, rule_future in probes:
+                if not check_if_running():
+                    return  # Stop execution if operation is cancelled
+                move = None
+                with decide.measure():
+                    file = entry.name
+                    rel_path = os.path.relpath(
+                        os.path.dirname(entry.path), source_folder
+                    )
+                    dest_dir = os.path.join(destination_folder, rel_path)
+                    file_path = entry.path
+                    processed_files += 1
+
+                    try:
+                        # Update progress
+                        report_progress(
+                            progress_callback, processed_files, scanner, file
+                        )
 
-    log_callback(f"Found {total_files} images")
+                        facts, failure = rule_future.result()
+                        if failure is None:
+                            st = entry.stat(follow_symlinks=False)
+                            reason = "screenshot"
+                            message = f"Moved: {os.path.join(rel_path, file)}"
+                            guess = facts.screenshot_if_read()
+                            if guess is not None:
+                                score, reasons = guess
+                                reason = f"screenshot {score:.2f}"
+                                message += f" ({score:.2f}: {'; '.join(reasons)})"
+                            move = PlannedMove(
+                                file_path,
+                                os.path.join(dest_dir, file),
+                                reason,
+                                st.st_size,
+                                message=message,
+                                st=st,
+                            )
+                        elif journal is not None:
+                            journal.keep(file_path, entry.stat())
 
+                    except Exception as e:
+                        log_callback(f"Error processing {file}: {str(e)}")
+
+                if move is not None:
+                    summary.add(move)
+                    yield move
+    finally:
+        scanner.close()
+        summary.examined = scanner.discovered
+
+
+def move_screenshots(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    parallel_moves=1,
+    paths=None,
+    probe_workers=None,
+    monitor=None,
+):
+    rule = load_rule("screenshots", log_callback)
+    if rule is None:
+        return
+    journal = open_journal(
+        "screenshots", [source_folder, destination_folder], log_callback
+    )
+    summary = PlanSummary()
+    monitor = monitor or PipelineMonitor()
+    moves = plan_screenshots(
+        source_folder,
+        destination_folder,
+        log_callback,
+        progress_callback,
+        check_if_running,
+        summary,
+        journal,
+        paths,
+        probe_workers,
+        monitor,
+        rule,
+    )
+    completed = False
+    try:
+        executor = run_plan(
+            moves,
+            log_callback,
+            check_if_running,
+            parallel_moves,
+            journal=journal,
+            monitor=monitor,
+        )
+        completed = check_if_running()
+    finally:
+        if journal is not None:
+            # Kept after a cancel or a crash so the next run picks up where
+            # this one stopped
+            journal.close(completed=completed)
+    flush_catalog()
+    if not check_if_running():
+        return
+
+    total_files = summary.examined
     if total_files == 0:
         log_callback("No images found.")
         progress_callback(0, 0, 0, "")
         return
 
-    # Move screenshots
-    for root, _, files in os.walk(source_folder):
-        for file in files:
-            if not check_if_running():
-                return  # Stop execution if operation is cancelled
-            if file.lower().endswith(image_formats):
-                rel_path = os.path.relpath(root, source_folder)
-                dest_dir = os.path.join(destination_folder, rel_path)
-                file_path = os.path.join(root, file)
-                processed_files += 1
-
-                try:
-                    # Update progress
-                    percentage = int((processed_files / total_files) * 100)
-                    progress_callback(processed_files, total_files, percentage, file)
-
-                    # Check EXIF data
-                    with Image.open(file_path) as img:
-                        is_screenshot = False
-
-                        # Check EXIF
-                        if hasattr(img, "_getexif") and img._getexif() is not None:
-                            exif = img._getexif()
-                            if exif:
-                                for tag, value in exif.items():
-                                    if value is None:
-                                        continue
-                                    value = str(value).lower()
-                                    if "screenshot" in value:
-                                        is_screenshot = True
-                                        break
-
-                        # If it's a screenshot, move the file
-                        if is_screenshot:
-                            os.makedirs(dest_dir, exist_ok=True)
-                            dest_file = os.path.join(dest_dir, file)
-                            shutil.move(file_path, dest_file)
-                            moved_files += 1
-                            log_callback(f"Moved: {os.path.join(rel_path, file)}")
-
-                except Exception as e:
-                    log_callback(f"Error processing {file}: {str(e)}")
-
     # Final progress update
     progress_callback(total_files, total_files, 100, "Complete")
-    log_callback(f"Moved {moved_files} out of {total_files} images.")
+    log_callback(f"Moved {executor.moved} out of {total_files} images.")
+    log_callback(f"Stage occupancy: {monitor.describe()}")
@@ -0,0 +1,395 @@
+import io
+import re
+import struct
+import zlib
+
+from utils.metrics import measured
+from utils.video_headers import iter_boxes
+
+# Reads the few metadata fields HandyMan cares about straight from JPEG, PNG,
+# TIFF and HEIF headers: EXIF tags, XMP, the image size and, when asked for, the
+# embedded ICC color profile. Only metadata segments are read; pixel data is
+# skipped with seeks, so a 20 MB PNG screenshot costs a few kilobytes of I/O.
+
+TAG_IMAGE_WIDTH = 256
+TAG_IMAGE_LENGTH = 257
+TAG_IMAGE_DESCRIPTION = 270
+TAG_MAKE = 271
+TAG_MODEL = 272
+TAG_SOFTWARE = 305
+TAG_DATE_TIME = 306
+TAG_EXPOSURE_TIME = 33434
+TAG_F_NUMBER = 33437
+TAG_EXIF_IFD = 34665
+TAG_ICC_PROFILE = 34675
+TAG_DATE_TIME_ORIGINAL = 36867
+TAG_DATE_TIME_DIGITIZED = 36868
+TAG_FOCAL_LENGTH = 37386
+TAG_USER_COMMENT = 37510
+TAG_XP_COMMENT = 40092
+TAG_PREVIEW_DATE_TIME = 50971
+
+SCREENSHOT_TAGS = (TAG_IMAGE_DESCRIPTION, TAG_SOFTWARE, TAG_USER_COMMENT, TAG_XP_COMMENT)
+
+# Creation date tags, most trustworthy first
+DATE_TAGS = (
+    TAG_DATE_TIME_ORIGINAL,
+    TAG_DATE_TIME_DIGITIZED,
+    TAG_DATE_TIME,
+    TAG_PREVIEW_DATE_TIME,
+)
+
+HEADER_ERRORS = (OSError, EOFError, ValueError, struct.error, zlib.error)
+
+XMP_JPEG_HEADER = b"http://ns.adobe.com/xap/1.0/\x00"
+XMP_PNG_KEYWORD = b"XML:com.adobe.xmp"
+XMP_USER_COMMENT = re.compile(
+    rb"UserComment(?:=\"([^\"]*)\"|>(.*?)</[\w:]*UserComment>)", re.S
+)
+
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 13: 4}
+MAX_IFD_ENTRIES = 1024
+MAX_PROFILE_BYTES = 65536  # ICC profiles are cut off here
+
+ICC_JPEG_HEADER = b"ICC_PROFILE\x00"
+HEIF_BRANDS = (b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1")
+MAX_HEIF_ITEMS = 4096
+# Start-of-frame markers, which carry the image size (C4, C8 and CC aren't)
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7}
+JPEG_SOF_MARKERS |= {0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageHeader:
+    def __init__(self, image_format):
+        self.format = image_format
+        self.tags = {}  # EXIF tag id -> decoded value, for the requested tags only
+        self.xmp = None  # Raw XMP packet, if any
+        self.width = None
+        self.height = None
+        self.icc = None  # Raw ICC profile, if one was embedded and asked for
+        self.chunks = set()  # PNG chunk types seen before the image data
+        self.density = None  # PNG pixels per metre (x, y), if given
+        self.bytes_read = 0
+
+
+class _CountingReader:
+    def __init__(self, f):
+        self._f = f
+        self.bytes_read = 0
+
+    def read(self, size):
+        data = self._f.read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        return self._f.seek(offset, whence)
+
+    def tell(self):
+        return self._f.tell()
+
+
+def _decode_tag(tag, value_type, raw, order):
+    if tag == TAG_ICC_PROFILE:
+        return raw
+    if value_type in (3, 4) and len(raw) == TIFF_TYPE_SIZES[value_type]:
+        return struct.unpack(order + ("H" if value_type == 3 else "I"), raw)[0]
+    if tag == TAG_USER_COMMENT:
+        # 8-byte character code followed by the comment itself
+        code, text = raw[:8], raw[8:]
+        if code.startswith(b"UNICODE"):
+            encoding = "utf-16-be" if text[:1] == b"\x00" else "utf-16-le"
+            return text.decode(encoding, "ignore").strip("\x00 ")
+        return text.decode("utf-8", "ignore").strip("\x00 ")
+    if tag == TAG_XP_COMMENT:
+        return raw.decode("utf-16-le", "ignore").strip("\x00")
+    if value_type in (2, 7):
+        return raw.decode("utf-8", "ignore").strip("\x00 ")
+    return raw
+
+
+def read_tiff_tags(f, base, wanted):
+    # Parses a TIFF structure starting at `base` (the byte-order mark) and
+    # returns the values of `wanted` tags from IFD0 and the Exif sub-IFD
+    f.seek(base)
+    header = f.read(8)
+    if len(header) < 8:
+        return {}
+    if header[:2] == b"II":
+        order = "<"
+    elif header[:2] == b"MM":
+        order = ">"
+    else:
+        return {}
+    if struct.unpack(order + "H", header[2:4])[0] != 42:
+        return {}
+
+    tags = {}
+    ifd_offsets = [struct.unpack(order + "I", header[4:8])[0]]
+    visited = set()
+    while ifd_offsets:
+        offset = ifd_offsets.pop()
+        if offset in visited or not offset:
+            continue
+        visited.add(offset)
+        f.seek(base + offset)
+        count_data = f.read(2)
+        if len(count_data) < 2:
+            continue
+        count = min(struct.unpack(order + "H", count_data)[0], MAX_IFD_ENTRIES)
+        entries = f.read(count * 12)
+        for i in range(len(entries) // 12):
+            tag, value_type, value_count, value = struct.unpack(
+                order + "HHI4s", entries[i * 12 : i * 12 + 12]
+            )
+            if tag == TAG_EXIF_IFD:
+                ifd_offsets.append(struct.unpack(order + "I", value)[0])
+                continue
+            if tag not in wanted or tag in tags:
+                continue
+            size = TIFF_TYPE_SIZES.get(value_type, 1) * value_count
+            if size <= 4:
+                raw = value[:size]
+            else:
+                position = f.tell()
+                f.seek(base + struct.unpack(order + "I", value)[0])
+                raw = f.read(min(size, 65536))
+                f.seek(position)
+            tags[tag] = _decode_tag(tag, value_type, raw, order)
+    return tags
+
+
+def _read_jpeg(f, header, wanted, profile):
+    f.seek(2)
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return header
+        kind = marker[1]
+        if kind == 0xFF:
+            f.seek(-1, 1)  # Fill byte
+            continue
+        if kind in (0xD8, 0x01) or 0xD0 <= kind <= 0xD7:
+            continue  # Markers without a payload
+        if kind in (0xDA, 0xD9):
+            return header  # Start of scan: metadata can't follow
+        length = struct.unpack(">H", f.read(2))[0]
+        start = f.tell()
+        if kind in JPEG_SOF_MARKERS:
+            header.height, header.width = struct.unpack(">xHH", f.read(5))
+        elif kind == 0xE2 and profile:
+            if f.read(len(ICC_JPEG_HEADER)) == ICC_JPEG_HEADER:
+                # Sequence number and chunk count, then a piece of the profile
+                f.read(2)
+                icc = (header.icc or b"") + f.read(length - 16)
+                header.icc = icc[:MAX_PROFILE_BYTES]
+        elif kind == 0xE1:
+            signature = f.read(6)
+            if signature == b"Exif\x00\x00":
+                segment = io.BytesIO(f.read(length - 8))
+                header.tags.update(read_tiff_tags(segment, 0, wanted))
+            elif signature == XMP_JPEG_HEADER[:6]:
+                rest = f.read(len(XMP_JPEG_HEADER) - 6)
+                if signature + rest == XMP_JPEG_HEADER:
+                    header.xmp = f.read(length - 2 - len(XMP_JPEG_HEADER))
+        f.seek(start + length - 2)
+
+
+def _read_png_text(chunk_type, data):
+    # Returns (keyword, text bytes) for tEXt/zTXt/iTXt chunks
+    keyword, _, rest = data.partition(b"\x00")
+    if chunk_type == b"tEXt":
+        return keyword, rest
+    if chunk_type == b"zTXt":
+        return keyword, zlib.decompress(rest[1:])
+    compressed = rest[:1] == b"\x01"
+    # Skip compression method, language tag and translated keyword
+    _, _, rest = rest[2:].partition(b"\x00")
+    _, _, text = rest.partition(b"\x00")
+    return keyword, zlib.decompress(text) if compressed else text
+
+
+def _read_png(f, header, wanted, profile):
+    f.seek(8)
+    while True:
+        chunk_header = f.read(8)
+        if len(chunk_header) < 8:
+            return header
+        length, chunk_type = struct.unpack(">I4s", chunk_header)
+        if chunk_type in (b"IDAT", b"IEND"):
+            return header
+        header.chunks.add(chunk_type.decode("latin-1"))
+        if chunk_type == b"IHDR":
+            header.width, header.height = struct.unpack(">II", f.read(length)[:8])
+            f.seek(4, 1)
+        elif chunk_type == b"pHYs":
+            x, y, unit = struct.unpack(">IIB", f.read(length)[:9])
+            if unit == 1:  # Metres; 0 means only the aspect ratio is known
+                header.density = (x, y)
+            f.seek(4, 1)
+        elif chunk_type == b"iCCP" and profile:
+            # Profile name, compression method, zlib-compressed profile
+            _, _, data = f.read(length).partition(b"\x00")
+            header.icc = zlib.decompressobj().decompress(data[1:], MAX_PROFILE_BYTES)
+            f.seek(4, 1)
+        elif chunk_type == b"eXIf":
+            segment = io.BytesIO(f.read(length))
+            header.tags.update(read_tiff_tags(segment, 0, wanted))
+            f.seek(4, 1)
+        elif chunk_type in (b"tEXt", b"zTXt", b"iTXt"):
+            keyword, text = _read_png_text(chunk_type, f.read(length))
+            if keyword == XMP_PNG_KEYWORD:
+                header.xmp = text
+            elif keyword == b"Software":
+                header.tags.setdefault(TAG_SOFTWARE, text.decode("latin-1"))
+            elif keyword == b"Description":
+                header.tags.setdefault(
+                    TAG_IMAGE_DESCRIPTION, text.decode("latin-1")
+                )
+            f.seek(4, 1)
+        else:
+            f.seek(length + 4, 1)  # Payload and CRC
+
+
+def _read_tiff(f, header, wanted, profile):
+    extra = (TAG_IMAGE_WIDTH, TAG_IMAGE_LENGTH)
+    if profile:
+        extra += (TAG_ICC_PROFILE,)
+    tags = read_tiff_tags(f, 0, tuple(wanted) + extra)
+    width = tags.get(TAG_IMAGE_WIDTH)
+    height = tags.get(TAG_IMAGE_LENGTH)
+    if isinstance(width, int) and isinstance(height, int):
+        header.width, header.height = width, height
+    if profile:
+        header.icc = tags.get(TAG_ICC_PROFILE)
+    header.tags.update((tag, tags[tag]) for tag in wanted if tag in tags)
+    return header
+
+
+def _read_uint(f, size):
+    return int.from_bytes(f.read(size), "big") if size else 0
+
+
+def _heif_exif_item(f, start, end):
+    # ID of the Exif item listed in an iinf box
+    f.seek(start)
+    version = f.read(4)[0]
+    count_size = 2 if version == 0 else 4
+    for box_type, item_start, _ in iter_boxes(f, start + 4 + count_size, end):
+        if box_type != b"infe":
+            continue
+        f.seek(item_start)
+        item_version = f.read(4)[0]
+        if item_version < 2:
+            continue
+        id_size = 2 if item_version == 2 else 4
+        item_id = _read_uint(f, id_size)
+        f.seek(2, 1)  # Protection index
+        if f.read(4) == b"Exif":
+            return item_id
+    return None
+
+
+def _heif_item_extent(f, start, wanted_id):
+    # (offset, length) of the first extent of an item, from an iloc box
+    f.seek(start)
+    version = f.read(4)[0]
+    sizes = f.read(2)
+    offset_size, length_size = sizes[0] >> 4, sizes[0] & 15
+    base_offset_size = sizes[1] >> 4
+    index_size = sizes[1] & 15 if version in (1, 2) else 0
+    id_size = 2 if version < 2 else 4
+    count = _read_uint(f, id_size)
+    for _ in range(min(count, MAX_HEIF_ITEMS)):
+        item_id = _read_uint(f, id_size)
+        method = _read_uint(f, 2) & 15 if version in (1, 2) else 0
+        f.seek(2, 1)  # Data reference index
+        base = _read_uint(f, base_offset_size)
+        extents = [
+            (
+                _read_uint(f, index_size),
+                _read_uint(f, offset_size),
+                _read_uint(f, length_size),
+            )
+            for _ in range(_read_uint(f, 2))
+        ]
+        if item_id == wanted_id:
+            # Only plain file offsets; items stored inside idat are skipped
+            if method != 0 or not extents:
+                return None
+            return base + extents[0][1], extents[0][2]
+    return None
+
+
+def _read_heif(f, header, wanted):
+    # HEIF (HEIC) keeps EXIF as an item: iinf names it and iloc says where
+    # its bytes are
+    for box_type, start, end in iter_boxes(f, 0, None):
+        if box_type != b"meta":
+            continue
+        children = {
+            child_type: (child_start, child_end)
+            for child_type, child_start, child_end in iter_boxes(f, start + 4, end)
+        }
+        if b"iinf" not in children or b"iloc" not in children:
+            return header
+        exif_id = _heif_exif_item(f, *children[b"iinf"])
+        if exif_id is None:
+            return header
+        extent = _heif_item_extent(f, children[b"iloc"][0], exif_id)
+        if extent is None:
+            return header
+        offset, length = extent
+        f.seek(offset)
+        # The payload starts with the offset of the TIFF header within it
+        skip = struct.unpack(">I", f.read(4))[0]
+        payload = f.read(min(length - 4, MAX_PROFILE_BYTES))
+        header.tags.update(read_tiff_tags(io.BytesIO(payload[skip:]), 0, wanted))
+        return header
+    return header
+
+
+def _read_bmp(f, header):
+    # BMP has nowhere to keep EXIF; the DIB header gives the size
+    f.seek(14)
+    dib = f.read(12)
+    if len(dib) == 12:
+        size = struct.unpack("<I", dib[:4])[0]
+        if size == 12:  # OS/2 BITMAPCOREHEADER
+            header.width, header.height = struct.unpack("<HH", dib[4:8])
+        elif size >= 40:
+            width, height = struct.unpack("<ii", dib[4:12])
+            header.width, header.height = width, abs(height)  # < 0: top-down
+    return header
+
+
+@measured("header.image")
+def read_image_header(file_path, wanted=SCREENSHOT_TAGS, profile=False):
+    # Returns an ImageHeader, or None for formats we don't parse. With
+    # profile, the embedded ICC profile is read too.
+    with open(file_path, "rb") as raw:
+        f = _CountingReader(raw)
+        signature = f.read(12)
+        if signature[:2] == b"\xff\xd8":
+            header = _read_jpeg(f, ImageHeader("JPEG"), wanted, profile)
+        elif signature[:8] == b"\x89PNG\r\n\x1a\n":
+            header = _read_png(f, ImageHeader("PNG"), wanted, profile)
+        elif signature[:4] in (b"II*\x00", b"MM\x00*"):
+            header = _read_tiff(f, ImageHeader("TIFF"), wanted, profile)
+        elif signature[:2] == b"BM":
+            header = _read_bmp(f, ImageHeader("BMP"))
+        elif signature[4:8] == b"ftyp" and signature[8:12] in HEIF_BRANDS:
+            header = _read_heif(f, ImageHeader("HEIF"), wanted)
+        else:
+            return None
+        header.bytes_read = f.bytes_read
+        return header
+
+
+def xmp_user_comments(xmp):
+    comments = []
+    for match in XMP_USER_COMMENT.finditer(xmp):
+        value = match.group(1) if match.group(1) is not None else match.group(2)
+        # rdf:Alt wraps the text in rdf:li elements
+        comments.append(re.sub(rb"<[^>]+>", b" ", value).decode("utf-8", "ignore"))
+    return comments
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+from utils.catalog import file_fingerprint, record_move
+from utils.move_engine import PARTIAL_SUFFIX, MoveEngine
+
+# Append-only record of a run, so a run that was killed can resume. Every
+# move is written as "begin" before it starts and "done" once it finished,
+# and files a planner looked at and left alone are written as "kept". On the
+# next run of the same operation over the same folders, kept files are not
+# examined again and moves that were cut short are reconciled. The journal
+# is deleted when a run completes.
+#
+# Records are handed to the OS as they are written, which is enough to
+# survive the process being killed; fsync runs in batches, and always before
+# a copy across filesystems starts.
+
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".handyman", "journals")
+JOURNAL_ENV = "HANDYMAN_JOURNAL"  # Folder for journals, or "off" to disable them
+
+SYNC_EVERY = 256  # Records between fsyncs
+SYNC_INTERVAL = 1.0  # Seconds between fsyncs while records trickle in
+
+
+def journal_path(operation, *paths):
+    # One journal per operation and set of folders (or manifest); None when
+    # journals are disabled
+    directory = os.environ.get(JOURNAL_ENV, DEFAULT_JOURNAL_DIR)
+    if not directory or directory.lower() == "off":
+        return None
+    key = "\0".join(os.path.abspath(path) for path in paths)
+    key = hashlib.sha1(key.encode()).hexdigest()[:16]
+    return os.path.join(directory, f"{operation}-{key}.jsonl")
+
+
+def _fingerprint(st):
+    # As the catalog sees it, in the form it takes in JSON
+    return list(file_fingerprint(st))
+
+
+class MoveJournal:
+    def __init__(self, path):
+        self.path = path
+        self.kept = {}  # path -> [size, mtime_ns] when it was kept
+        self.in_flight = {}  # source -> record of a move that never finished
+        self.resumed = False
+        self._lock = threading.Lock()
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        if os.path.exists(path):
+            self._load()
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        self.resumed = True
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # Torn last line from a crash
+                state = record.get("state")
+                if state == "kept":
+                    self.kept[record["path"]] = record["fingerprint"]
+                elif state == "begin":
+                    self.in_flight[record["source"]] = record
+                elif state == "done":
+                    self.in_flight.pop(record["source"], None)
+
+    def _write(self, record, sync=False):
+        with self._lock:
+            self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self._file.flush()
+            self._unsynced += 1
+            now = time.monotonic()
+            if (
+                sync
+                or self._unsynced >= SYNC_EVERY
+                or now - self._last_sync >= SYNC_INTERVAL
+            ):
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+                self._last_sync = now
+
+    def is_kept(self, path, st):
+        fingerprint = self.kept.get(path)
+        return fingerprint is not None and fingerprint == _fingerprint(st)
+
+    def unfinished(self, entries):
+        # Drops scanned entries that an earlier run already looked at
+        for entry in entries:
+            if self.kept and entry.path in self.kept:
+                try:
+                    if self.is_kept(entry.path, entry.stat()):
+                        continue
+                except OSError:
+                    pass
+            yield entry
+
+    def keep(self, path, st):
+        self._write({"state": "kept", "path": path, "fingerprint": _fingerprint(st)})
+
+    def begin(self, move, sync=False):
+        self._write(
+            {
+                "state": "begin",
+                "source": move.source,
+                "destination": move.destination,
+                "kind": move.kind,
+            },
+            sync,
+        )
+
+    def done(self, move):
+        self._write({"state": "done", "source": move.source})
+
+    def reconcile(self, log_callback, engine=None):
+        # Settles moves that were in flight when the last run stopped.
+        # Renames are atomic, so only copies across filesystems can be half
+        # done: either the copy finished and the source is still there, or a
+        # partial file was left next to the destination.
+        engine = engine or MoveEngine()
+        for source, record in list(self.in_flight.items()):
+            destination = record["destination"]
+            try:
+                partial = destination + PARTIAL_SUFFIX
+                if os.path.lexists(partial):
+                    os.unlink(partial)
+                if not os.path.lexists(destination):
+                    continue  # Not started; planned again by this run
+                if os.path.lexists(source):
+                    if not engine.finish(source, destination):
+                        continue  # Destination isn't our copy
+                    log_callback(f"Finished interrupted move: {source}")
+                if record.get("kind", "file") == "file":
+                    record_move(source, destination)
+                self._write({"state": "done", "source": source})
+                del self.in_flight[source]
+            except OSError as e:
+                log_callback(f"Could not finish interrupted move {source}: {str(e)}")
+
+    def close(self, completed=False):
+        # A completed run needs no journal; otherwise it is kept to resume
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._file.close()
+        if completed:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+
+def open_journal(operation, paths, log_callback):
+    # Journal for this run with earlier interrupted work reconciled, or None
+    # when journals are disabled or can't be written
+    path = journal_path(operation, *paths)
+    if path is None:
+        return None
+    try:
+        journal = MoveJournal(path)
+    except OSError:
+        return None
+    if journal.resumed:
+        log_callback(
+            f"Resuming interrupted run: {len(journal.kept)} files already examined, "
+            f"{len(journal.in_flight)} moves to check"
+        )
+        journal.reconcile(log_callback)
+    return journal
@@ -0,0 +1,142 @@
+import os
+import threading
+
+# Keeps the window's log bounded: the newest lines live in a fixed-size ring,
+# and every line is also appended to a rotating file on disk as it is logged,
+# so a run over millions of files uses the same memory as a short one and
+# its full log survives, whatever the window had to leave out.
+
+DEFAULT_LOG_DIR = os.path.join(os.path.expanduser("~"), ".handyman", "logs")
+LOG_ENV = "HANDYMAN_LOGS"  # Folder for the log file, or "off"
+LOG_FILE = "handyman.log"
+RING_LINES = 50000  # Lines kept in memory for the log view
+SPILL_BYTES = 10 * 1024 * 1024  # Size at which the spill file is rotated
+SPILL_BACKUPS = 3  # Rotated files kept (handyman.log.1 ... .3)
+
+# Levels, from per-file noise to problems; filters show a level and above
+SKIPPED = 0
+MOVED = 1
+INFO = 2
+ERROR = 3
+
+LEVEL_NAMES = {SKIPPED: "skipped", MOVED: "moved", INFO: "info", ERROR: "error"}
+
+ERROR_PREFIXES = ("Error", "Could not", "Invalid")
+MOVED_PREFIXES = ("Moved:", "Moved entire folder:", "Finished interrupted move:")
+
+
+def log_level(message):
+    # Operations log plain strings; their wording gives the level away
+    if message.startswith("Skipped:"):
+        return SKIPPED
+    if message.startswith(MOVED_PREFIXES):
+        return MOVED
+    if message.startswith(ERROR_PREFIXES):
+        return ERROR
+    return INFO
+
+
+def spill_path():
+    directory = os.environ.get(LOG_ENV, DEFAULT_LOG_DIR)
+    if not directory or directory.lower() == "off":
+        return None
+    return os.path.join(directory, LOG_FILE)
+
+
+class LogSpill:
+    # Appends lines to path, rotating it like logging's RotatingFileHandler.
+    # Opened on the first write; gives up quietly if the disk refuses. The
+    # worker and the window both write to it.
+
+    def __init__(self, path, max_bytes=SPILL_BYTES, backups=SPILL_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.written = 0  # Lines written since the store was created
+        self._file = None
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def write(self, lines):
+        if not lines:
+            return
+        with self._lock:
+            self._write(lines)
+
+    def _write(self, lines):
+        if self.path is None:
+            return
+        data = ("\n".join(lines) + "\n").encode("utf-8", "replace")
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                self._file = open(self.path, "ab")
+                self._size = self._file.tell()
+            if self._size and self._size + len(data) > self.max_bytes:
+                self._rotate()
+            self._file.write(data)
+            self._file.flush()
+        except OSError:
+            self._close()
+            self.path = None
+            return
+        self._size += len(data)
+        self.written += len(lines)
+
+    def _rotate(self):
+        self._file.close()
+        for number in range(self.backups - 1, 0, -1):
+            older = f"{self.path}.{number}"
+            if os.path.exists(older):
+                os.replace(older, f"{self.path}.{number + 1}")
+        if self.backups:
+            os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "wb")
+        self._size = 0
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        if self._file is not None:
+            try:
+                self._file.close()
+            except OSError:
+                pass
+            self._file = None
+
+
+class LogRing:
+    # Fixed-capacity ring of (level, message) with O(1) access by row, so a
+    # list view can ask for any visible line without walking the buffer
+
+    def __init__(self, capacity=RING_LINES):
+        self.capacity = capacity
+        self._entries = [None] * capacity
+        self._start = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, row):
+        return self._entries[(self._start + row) % self.capacity]
+
+    def room(self):
+        return self.capacity - self._count
+
+    def drop_oldest(self, count):
+        # Removes and returns the oldest count entries
+        dropped = [self[row] for row in range(count)]
+        for row in range(count):
+            self._entries[(self._start + row) % self.capacity] = None
+        self._start = (self._start + count) % self.capacity
+        self._count -= count
+        return dropped
+
+    def extend(self, entries):
+        # The caller makes room first
+        for entry in entries:
+            self._entries[(self._start + self._count) % self.capacity] = entry
+            self._count += 1
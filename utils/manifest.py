@@ -0,0 +1,289 @@
+import json
+import os
+import queue
+import threading
+
+from utils.catalog import record_move
+from utils.destination_index import DestinationIndex
+from utils.journal import open_journal
+from utils.metrics import measured
+from utils.move_engine import MoveEngine
+
+# Every operation is split into a planner, which decides what goes where, and
+# an executor, which performs the moves. Plans can be streamed straight into
+# the executor (the normal run), or written to a manifest so they can be
+# reviewed and executed later without recomputing any metadata.
+
+
+class PlannedMove:
+    def __init__(
+        self, source, destination, reason, size=0, kind="file", message=None, st=None
+    ):
+        self.source = source
+        self.destination = destination
+        self.reason = reason
+        self.size = size
+        self.kind = kind  # "file" or "folder"
+        # Not stored in manifests: log line on success and the source's
+        # stat result from the scan
+        self.message = message
+        self.st = st
+
+    def to_dict(self):
+        record = {
+            "source": self.source,
+            "destination": self.destination,
+            "reason": self.reason,
+            "size": self.size,
+        }
+        if self.kind != "file":
+            record["kind"] = self.kind
+        return record
+
+    @classmethod
+    def from_dict(cls, record):
+        return cls(
+            record["source"],
+            record["destination"],
+            record.get("reason", ""),
+            record.get("size", 0),
+            record.get("kind", "file"),
+        )
+
+
+class PlanSummary:
+    # Filled in by a planner while it runs
+    def __init__(self):
+        self.examined = 0
+        self.planned = 0
+        self.planned_bytes = 0
+        self.rules = {}  # Rule name -> moves planned by it, for combined runs
+
+    def add(self, move, rule=None):
+        self.planned += 1
+        self.planned_bytes += move.size
+        if rule is not None:
+            self.rules[rule] = self.rules.get(rule, 0) + 1
+
+
+def write_manifest(path, moves):
+    # One JSON object per line; returns the number of moves written
+    count = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for move in moves:
+            f.write(json.dumps(move.to_dict(), ensure_ascii=False) + "\n")
+            count += 1
+    return count
+
+
+def read_manifest(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield PlannedMove.from_dict(json.loads(line))
+
+
+class MoveExecutor:
+    # Performs planned moves on `parallelism` threads of their own, so the
+    # planner keeps deciding while files are moved. Moves are spread over the
+    # threads' lanes by destination folder; each lane runs its moves in order,
+    # so one folder is never written concurrently.
+
+    def __init__(
+        self,
+        log_callback,
+        check_if_running=None,
+        parallelism=1,
+        engine=None,
+        index=None,
+        check_existing=False,
+        queue_size=256,
+        journal=None,
+        stats=None,
+    ):
+        self.log_callback = log_callback
+        self.check_if_running = check_if_running
+        self.parallelism = max(1, parallelism or 1)
+        self.engine = engine or MoveEngine()
+        self.index = index or DestinationIndex()
+        # Manifests may be stale by the time they run; never overwrite then
+        self.check_existing = check_existing
+        self.journal = journal
+        self.stats = stats  # StageStats of the move stage, if monitored
+        if stats is not None:
+            stats.workers = self.parallelism
+        self.capacity = queue_size * self.parallelism
+        self.moved = 0
+        self.failed = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._lanes = []
+        self._threads = []
+        for _ in range(self.parallelism):
+            lane = queue.Queue(maxsize=queue_size)
+            thread = threading.Thread(target=self._run_lane, args=(lane,), daemon=True)
+            thread.start()
+            self._lanes.append(lane)
+            self._threads.append(thread)
+
+    def _is_running(self):
+        return self.check_if_running is None or self.check_if_running()
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _run_lane(self, lane):
+        while True:
+            move = lane.get()
+            try:
+                if move is None:
+                    return
+                if not self._is_running():
+                    continue
+                if self.stats is None:
+                    self.execute(move)
+                else:
+                    with self.stats.measure():
+                        self.execute(move)
+            finally:
+                lane.task_done()
+
+    def queued(self):
+        # Moves handed over and not started yet
+        return sum(lane.qsize() for lane in self._lanes)
+
+    def wait(self):
+        # Blocks until every move submitted so far has finished
+        for lane in self._lanes:
+            lane.join()
+
+    def submit(self, move):
+        if move.kind == "folder":
+            # Files planned out of the folder have to leave before it moves
+            self.wait()
+        lane = hash(os.path.dirname(move.destination)) % len(self._lanes)
+        # Blocks when the lane is full, which keeps the planner from running
+        # arbitrarily far ahead of the moves
+        self._lanes[lane].put(move)
+
+    def close(self):
+        for lane in self._lanes:
+            lane.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._lanes = []
+        self._threads = []
+
+    @measured("move")
+    def execute(self, move):
+        source_name = os.path.basename(move.source)
+        try:
+            if self.check_existing:
+                if not os.path.lexists(move.source):
+                    self._count("skipped")
+                    self.log_callback(f"Skipped: {move.source} (no longer exists)")
+                    return
+                if os.path.lexists(move.destination):
+                    self._count("skipped")
+                    self.log_callback(
+                        f"Skipped: {move.source} ({move.destination} already exists)"
+                    )
+                    return
+            self.index.ensure_dir(os.path.dirname(move.destination))
+            if self.journal is not None:
+                # A copy across filesystems must be on record before it starts
+                self.journal.begin(
+                    move,
+                    sync=not self.engine.same_device(
+                        move.source, move.destination, move.st
+                    ),
+                )
+            self.engine.move(move.source, move.destination, move.st)
+            if move.kind == "file":
+                record_move(move.source, move.destination)
+            if self.journal is not None:
+                self.journal.done(move)
+            self._count("moved")
+            self.log_callback(
+                move.message or f"Moved: {move.source} -> {move.destination}"
+            )
+        except Exception as e:
+            self._count("failed")
+            self.index.discard(move.destination)
+            if move.kind == "folder":
+                self.log_callback(f"Error moving folder {move.source}: {str(e)}")
+            else:
+                self.log_callback(f"Error moving {source_name}: {str(e)}")
+
+
+def run_plan(
+    moves,
+    log_callback,
+    check_if_running=None,
+    parallelism=1,
+    index=None,
+    journal=None,
+    monitor=None,
+):
+    # Streams planned moves into an executor; returns the executor so
+    # callers can read its counters. With a PipelineMonitor, the moves and
+    # the queue of moves waiting for them are recorded.
+    executor = MoveExecutor(
+        log_callback,
+        check_if_running,
+        parallelism,
+        index=index,
+        journal=journal,
+        stats=monitor.stage("move") if monitor is not None else None,
+    )
+    decide = None
+    if monitor is not None:
+        decide = monitor.stage("decide", capacity=executor.capacity)
+    try:
+        for move in moves:
+            executor.submit(move)
+            if decide is not None:
+                decide.sample_queue(executor.queued())
+    finally:
+        executor.close()
+    return executor
+
+
+def execute_manifest(
+    path, log_callback, progress_callback, check_if_running=None, parallelism=4
+):
+    # Count first so progress has a total, then stream the moves
+    with open(path, encoding="utf-8") as f:
+        total = sum(1 for line in f if line.strip())
+    log_callback(f"Executing {total} planned moves from {path}")
+    journal = open_journal("execute", [path], log_callback)
+    executor = MoveExecutor(
+        log_callback,
+        check_if_running,
+        parallelism,
+        check_existing=True,
+        journal=journal,
+    )
+    completed = False
+    try:
+        for done, move in enumerate(read_manifest(path), 1):
+            if check_if_running is not None and not check_if_running():
+                break
+            executor.submit(move)
+            progress_callback(
+                done, total, int(done / total * 100), os.path.basename(move.source)
+            )
+        executor.close()
+        completed = check_if_running is None or check_if_running()
+    finally:
+        executor.close()
+        if journal is not None:
+            # Kept after a cancel or a crash so the next run picks up where
+            # this one stopped
+            journal.close(completed=completed)
+    log_callback(
+        f"Moved {executor.moved}, skipped {executor.skipped}, failed {executor.failed} of {total} planned moves."
+    )
+    return executor
@@ -0,0 +1,205 @@
+import bisect
+import functools
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+# Counters and latency histograms for the run in progress, so a slow run can
+# be explained: how long folder listings, stat calls, header reads and
+# ffprobe took, how many moves were renames and how many copies. Code
+# records into whatever run is active; with no run active, recording is a
+# single global lookup. A JSON summary of every run is written to
+# $HANDYMAN_METRICS (default ~/.handyman/runs).
+#
+# Only this process is measured: by-date's EXIF worker processes and the
+# ffprobe children are timed from here, not from inside.
+
+DEFAULT_METRICS_DIR = os.path.join(os.path.expanduser("~"), ".handyman", "runs")
+METRICS_ENV = "HANDYMAN_METRICS"  # Folder for run summaries, or "off"
+MAX_SUMMARIES = 100  # Older summaries are deleted
+
+# Histogram bucket bounds grow by 2^(1/4) (19%) from 2^-20 s (1 µs) to 2^7 s
+BUCKETS_PER_DOUBLING = 4
+BUCKET_BOUNDS = [
+    2.0 ** (step / BUCKETS_PER_DOUBLING)
+    for step in range(-20 * BUCKETS_PER_DOUBLING, 7 * BUCKETS_PER_DOUBLING + 1)
+]
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKET_BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, fraction):
+        # Upper bound of the bucket holding the quantile, capped at the max
+        wanted = fraction * self.count
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= wanted and count:
+                if bucket == len(BUCKET_BOUNDS):
+                    return self.max
+                return min(BUCKET_BOUNDS[bucket], self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "seconds": round(self.total, 6),
+            "mean": round(self.total / self.count, 6) if self.count else 0.0,
+            "p50": round(self.quantile(0.5), 6),
+            "p90": round(self.quantile(0.9), 6),
+            "p99": round(self.quantile(0.99), 6),
+            "max": round(self.max, 6),
+        }
+
+
+class RunMetrics:
+    def __init__(self, operation=None):
+        self.operation = operation
+        self.started_at = datetime.now()
+        self.started = time.perf_counter()
+        self.ended = None
+        self.counters = {}
+        self.timings = {}
+        self._lock = threading.Lock()
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name, seconds):
+        with self._lock:
+            histogram = self.timings.get(name)
+            if histogram is None:
+                histogram = self.timings[name] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "operation": self.operation,
+                "started": self.started_at.isoformat(timespec="seconds"),
+                "elapsed": round((self.ended or time.perf_counter()) - self.started, 3),
+                "counters": dict(sorted(self.counters.items())),
+                "timings": {
+                    name: histogram.snapshot()
+                    for name, histogram in sorted(self.timings.items())
+                },
+            }
+
+    def describe(self):
+        # One line per metric, for the metrics panel and logs
+        snapshot = self.snapshot()
+        lines = [f"elapsed: {_duration(snapshot['elapsed'])}"]
+        for name, timing in snapshot["timings"].items():
+            lines.append(
+                f"{name}: {timing['count']} in {_duration(timing['seconds'])} "
+                f"(p50 {_duration(timing['p50'])}, p90 {_duration(timing['p90'])}, "
+                f"max {_duration(timing['max'])})"
+            )
+        for name, value in snapshot["counters"].items():
+            if name.startswith("bytes"):
+                lines.append(f"{name}: {value / 1024 / 1024:.1f} MB")
+            else:
+                lines.append(f"{name}: {value}")
+        return lines
+
+
+def _duration(seconds):
+    if seconds < 0.001:
+        return f"{seconds * 1000000:.0f} µs"
+    if seconds < 1:
+        return f"{seconds * 1000:.1f} ms"
+    return f"{seconds:.2f} s"
+
+
+_active = None
+
+
+def start_run(operation=None):
+    global _active
+    _active = RunMetrics(operation)
+    return _active
+
+
+def active_run():
+    return _active
+
+
+def finish_run(metrics, **extra):
+    # Stops recording into metrics and writes its summary; returns the
+    # summary and the file it went to (None when summaries are off)
+    global _active
+    if _active is metrics:
+        _active = None
+    metrics.ended = time.perf_counter()
+    summary = metrics.snapshot()
+    summary.update(extra)
+    return summary, write_summary(summary)
+
+
+def count(name, amount=1):
+    metrics = _active
+    if metrics is not None:
+        metrics.count(name, amount)
+
+
+def observe(name, seconds):
+    metrics = _active
+    if metrics is not None:
+        metrics.observe(name, seconds)
+
+
+def measured(name):
+    # Decorator timing every call of a function into the `name` histogram
+    def decorate(function):
+        @functools.wraps(function)
+        def run(*args, **kwargs):
+            metrics = _active
+            if metrics is None:
+                return function(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.observe(name, time.perf_counter() - started)
+
+        return run
+
+    return decorate
+
+
+def write_summary(summary):
+    directory = os.environ.get(METRICS_ENV, DEFAULT_METRICS_DIR)
+    if not directory or directory.lower() == "off":
+        return None
+    stamp = summary["started"].replace(":", "").replace("-", "")
+    name = f"{summary.get('operation') or 'run'}-{stamp}.json"
+    path = os.path.join(directory, name)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        summaries = sorted(
+            (entry.stat().st_mtime, entry.path)
+            for entry in os.scandir(directory)
+            if entry.name.endswith(".json")
+        )
+        for _, old in summaries[:-MAX_SUMMARIES]:
+            os.unlink(old)
+    except OSError:
+        return None
+    return path
@@ -0,0 +1,243 @@
+import errno
+import hashlib
+import os
+import shutil
+import stat
+import threading
+
+from utils import metrics
+
+# Moves files and folders for every operation. Moves within one filesystem
+# are a single atomic rename; anything else is copied by the kernel where it
+# can (or, when checksums are asked for, through a large buffer while the
+# data is hashed and then verified against the copy), then the source is
+# removed.
+
+BUFFER_SIZE = 4 * 1024 * 1024
+PARTIAL_SUFFIX = ".handyman-partial"  # Copies in progress; renamed when complete
+
+
+class MoveResult:
+    def __init__(self, method, bytes_copied=0, checksum=None):
+        self.method = method  # "rename" or "copy"
+        self.bytes_copied = bytes_copied
+        self.checksum = checksum  # blake2b of the copied data, hex
+
+
+UNSUPPORTED_ERRNOS = (
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.ENOTSOCK,
+    errno.EOPNOTSUPP,
+)
+
+
+def _kernel_copy(fsrc, fdst, size):
+    # Let the kernel move the bytes when it can; returns bytes copied
+    for name in ("copy_file_range", "sendfile"):
+        if not hasattr(os, name):
+            continue
+        copied = 0
+        try:
+            while copied < size:
+                if name == "copy_file_range":
+                    sent = os.copy_file_range(
+                        fsrc.fileno(), fdst.fileno(), size - copied
+                    )
+                else:
+                    sent = os.sendfile(
+                        fdst.fileno(), fsrc.fileno(), copied, size - copied
+                    )
+                if sent == 0:
+                    break
+                copied += sent
+            return copied
+        except OSError as e:
+            if copied or e.errno not in UNSUPPORTED_ERRNOS:
+                raise
+    return _buffered_copy(fsrc, fdst, None)
+
+
+def _buffered_copy(fsrc, fdst, digest, buffer_size=BUFFER_SIZE):
+    copied = 0
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    while True:
+        n = fsrc.readinto(buffer)
+        if not n:
+            break
+        chunk = view[:n]
+        if digest is not None:
+            digest.update(chunk)
+        if fdst is not None:
+            fdst.write(chunk)
+        copied += n
+    return copied
+
+
+def _file_digest(path, buffer_size=BUFFER_SIZE):
+    digest = hashlib.blake2b()
+    with open(path, "rb") as f:
+        _buffered_copy(f, None, digest, buffer_size)
+    return digest.hexdigest()
+
+
+def copy_file(src, dst, checksum=False, buffer_size=BUFFER_SIZE):
+    # Copies src to dst through a partial file and returns
+    # (bytes copied, checksum or None). By default the copy is offloaded to
+    # copy_file_range/sendfile where available. With checksum=True the data
+    # is hashed as it goes through one large reusable buffer, and the copy
+    # is read back and compared before it replaces dst.
+    partial = dst + PARTIAL_SUFFIX
+    digest = hashlib.blake2b() if checksum else None
+    try:
+        with open(src, "rb") as fsrc, open(partial, "wb") as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            if digest is None:
+                copied = _kernel_copy(fsrc, fdst, size)
+            else:
+                copied = _buffered_copy(fsrc, fdst, digest, buffer_size)
+            fdst.flush()
+            os.fsync(fdst.fileno())
+            written = os.fstat(fdst.fileno()).st_size
+        if copied != size or written != size:
+            raise OSError(
+                errno.EIO, f"Copy of {src} is incomplete ({written} of {size} bytes)"
+            )
+        if digest is not None and _file_digest(partial) != digest.hexdigest():
+            raise OSError(errno.EIO, f"Copy of {src} doesn't match the original")
+        shutil.copystat(src, partial)
+        os.replace(partial, dst)
+    except BaseException:
+        try:
+            os.unlink(partial)
+        except OSError:
+            pass
+        raise
+    return copied, digest.hexdigest() if digest is not None else None
+
+
+def _copied_before(src, dst):
+    # Finished copies have src's size and mtime, since copystat runs before
+    # the final rename; symlinks are recreated in one step
+    try:
+        dst_stat = os.lstat(dst)
+    except FileNotFoundError:
+        return False
+    src_stat = os.lstat(src)
+    if stat.S_ISLNK(src_stat.st_mode):
+        return True
+    return (src_stat.st_size, src_stat.st_mtime_ns) == (
+        dst_stat.st_size,
+        dst_stat.st_mtime_ns,
+    )
+
+
+class MoveEngine:
+    def __init__(self, checksum=False):
+        self.checksum = checksum
+        self.renamed = 0
+        self.copied = 0
+        self.bytes_copied = 0
+        self._devices = {}
+        self._lock = threading.Lock()
+
+    def _device(self, directory):
+        # st_dev of the closest existing folder, cached per folder
+        device = self._devices.get(directory)
+        if device is None:
+            path = directory
+            while True:
+                try:
+                    device = os.stat(path).st_dev
+                    break
+                except FileNotFoundError:
+                    parent = os.path.dirname(path)
+                    if parent == path:
+                        raise
+                    path = parent
+            with self._lock:
+                self._devices[directory] = device
+        return device
+
+    def same_device(self, src, dst, src_stat=None):
+        if src_stat is None:
+            src_stat = os.lstat(src)
+        return src_stat.st_dev == self._device(os.path.dirname(os.path.abspath(dst)))
+
+    def _count(self, result):
+        with self._lock:
+            if result.method == "rename":
+                self.renamed += 1
+            else:
+                self.copied += 1
+                self.bytes_copied += result.bytes_copied
+        metrics.count(f"moves.{result.method}")
+        if result.bytes_copied:
+            metrics.count("bytes.copied", result.bytes_copied)
+        return result
+
+    def move(self, src, dst, src_stat=None):
+        # Like shutil.move for a file or folder whose destination doesn't
+        # exist yet
+        if self.same_device(src, dst, src_stat):
+            try:
+                os.rename(src, dst)
+                return self._count(MoveResult("rename"))
+            except OSError as e:
+                # Bind mounts and some network filesystems share st_dev
+                if e.errno != errno.EXDEV:
+                    raise
+        if os.path.isdir(src) and not os.path.islink(src):
+            return self._count(self._copy_tree(src, dst))
+        return self._count(self._copy_file(src, dst))
+
+    def finish(self, src, dst):
+        # Completes a copy-then-delete move that was interrupted, returning
+        # False when dst doesn't look like a copy of src
+        if os.path.isdir(src) and not os.path.islink(src):
+            if not os.path.isdir(dst):
+                return False
+            self._count(self._copy_tree(src, dst, resume=True))
+            return True
+        if not _copied_before(src, dst):
+            return False
+        os.unlink(src)
+        return True
+
+    def _copy_file(self, src, dst):
+        if os.path.islink(src):
+            os.symlink(os.readlink(src), dst)
+            os.unlink(src)
+            return MoveResult("copy")
+        copied, checksum = copy_file(src, dst, self.checksum)
+        os.unlink(src)
+        return MoveResult("copy", copied, checksum)
+
+    def _copy_tree(self, src, dst, resume=False):
+        total = 0
+        # Bottom-up, so each folder's timestamps are copied after its contents
+        for root, dirs, files in os.walk(src, topdown=False):
+            target = os.path.join(dst, os.path.relpath(root, src))
+            os.makedirs(target, exist_ok=True)
+            # os.walk lists symlinks to folders with the folders, without
+            # following them
+            for name in dirs:
+                link_path = os.path.join(root, name)
+                target_path = os.path.join(target, name)
+                if os.path.islink(link_path) and not os.path.lexists(target_path):
+                    os.symlink(os.readlink(link_path), target_path)
+            for file in files:
+                file_path = os.path.join(root, file)
+                target_path = os.path.join(target, file)
+                if resume and _copied_before(file_path, target_path):
+                    continue
+                if os.path.islink(file_path):
+                    os.symlink(os.readlink(file_path), target_path)
+                else:
+                    total += copy_file(file_path, target_path, self.checksum)[0]
+            shutil.copystat(root, target)
+        # Only remove the source once every file has been copied
+        shutil.rmtree(src)
+        return MoveResult("copy", total)
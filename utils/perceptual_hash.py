@@ -0,0 +1,181 @@
+# Perceptual hashes for finding near-duplicate photos (burst shots, resized
+# or re-saved copies). Each image gets a 64-bit dHash (brightness gradients)
+# and a 64-bit pHash (low DCT frequencies), both taken from a small greyscale
+# decode. Similar images have hashes a few bits apart, and a multi-index
+# join finds those neighbours without comparing every pair.
+
+import itertools
+import math
+
+from utils.metrics import measured
+
+HASH_SIZE = 8  # Hashes are HASH_SIZE * HASH_SIZE bits
+PHASH_SCALE = 4  # pHash is taken from a (HASH_SIZE * PHASH_SCALE)^2 image
+QUERY_CHUNK = 65536  # Hashes joined at once when looking for similar pairs
+TABLE_BITS = 24  # Hash blocks up to this wide are looked up in a flat table
+
+try:
+    _popcount = int.bit_count
+except AttributeError:  # Python < 3.10
+
+    def _popcount(value):
+        return bin(value).count("1")
+
+
+def hamming(a, b):
+    return _popcount(a ^ b)
+
+
+def _bits_to_int(bits):
+    import numpy as np
+
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), "big")
+
+
+def _dct_matrix(size):
+    import numpy as np
+
+    k = np.arange(size).reshape(-1, 1)
+    n = np.arange(size).reshape(1, -1)
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2 / size)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_dct_cache = {}
+
+
+def dhash(pixels):
+    # pixels: HASH_SIZE x (HASH_SIZE + 1) greyscale array
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(pixels):
+    # pixels: square greyscale array; keeps the sign of the lowest
+    # frequencies against their median (the DC term is left out)
+    import numpy as np
+
+    size = pixels.shape[0]
+    matrix = _dct_cache.get(size)
+    if matrix is None:
+        matrix = _dct_cache[size] = _dct_matrix(size)
+    low = (matrix @ pixels @ matrix.T)[:HASH_SIZE, :HASH_SIZE]
+    median = np.median(low.ravel()[1:])
+    return _bits_to_int(low > median)
+
+
+@measured("hash.perceptual")
+def image_hashes(file_path):
+    # Returns [dhash, phash, width, height]. Only a reduced image is decoded:
+    # JPEGs are scaled down inside the decoder through draft().
+    import numpy as np
+    from PIL import Image, ImageOps
+
+    side = HASH_SIZE * PHASH_SCALE
+    with Image.open(file_path) as img:
+        width, height = img.size
+        img.draft("L", (side, side))
+        img = ImageOps.exif_transpose(img).convert("L")
+        small = img.resize((side, side), Image.Resampling.BOX)
+        tiny = small.resize((HASH_SIZE + 1, HASH_SIZE), Image.Resampling.BOX)
+    pixels = np.asarray(small, dtype=np.float32)
+    return [dhash(np.asarray(tiny, dtype=np.int16)), phash(pixels), width, height]
+
+
+_POPCOUNT_TABLE = None
+
+
+def hamming_many(a, b):
+    # Element-wise Hamming distances between uint64 arrays
+    global _POPCOUNT_TABLE
+    import numpy as np
+
+    xor = np.bitwise_xor(a, b)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor)
+    if _POPCOUNT_TABLE is None:
+        _POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], np.uint8)
+    return _POPCOUNT_TABLE[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _flip_masks(width, bits):
+    # Every mask of `width` bits with at most `bits` bits set
+    masks = [0]
+    for count in range(1, bits + 1):
+        masks.extend(
+            sum(1 << bit for bit in chosen)
+            for chosen in itertools.combinations(range(width), count)
+        )
+    return masks
+
+
+def _block_layout(count, max_distance):
+    # Splitting a hash into b blocks, two hashes at most max_distance apart
+    # differ in at most max_distance // b bits in one of the blocks. Picks
+    # the b with the least work: one sorted lookup per block and flip mask,
+    # plus the candidates that share a block by chance.
+    best = None
+    for blocks in range(1, max_distance + 2):
+        width = 64 // blocks
+        flips = sum(
+            math.comb(width, bits) for bits in range(max_distance // blocks + 1)
+        )
+        cost = blocks * flips * (1 + count / 2**width)
+        if best is None or cost < best[0]:
+            best = (cost, blocks, max_distance // blocks)
+    return best[1], best[2]
+
+
+def similar_pairs(values, max_distance, chunk_size=QUERY_CHUNK):
+    # Yields (left, right) index arrays of every pair of 64-bit hashes at
+    # most max_distance bits apart (left < right; a pair may come up more
+    # than once). Multi-index hashing: each block of the hash is sorted once
+    # and joined against itself with a few bits flipped, and the candidates
+    # are checked on the full hash, all in NumPy.
+    import numpy as np
+
+    values = np.asarray(values, dtype=np.uint64)
+    count = len(values)
+    blocks, flip_bits = _block_layout(count, max_distance)
+    bounds = [64 * block // blocks for block in range(blocks + 1)]
+    for start, end in zip(bounds, bounds[1:]):
+        width = end - start
+        keys = (values >> np.uint64(start)) & np.uint64((1 << width) - 1)
+        order = np.argsort(keys, kind="stable")
+        if width <= TABLE_BITS:
+            # Offsets of every key in the sorted order, so a lookup is a gather
+            offsets = np.zeros((1 << width) + 1, dtype=np.int64)
+            np.cumsum(
+                np.bincount(keys.astype(np.int64), minlength=1 << width),
+                out=offsets[1:],
+            )
+            keys = keys.astype(np.int64)
+        else:
+            offsets = None
+            sorted_keys = keys[order]
+        for flip in _flip_masks(width, flip_bits):
+            for first in range(0, count, chunk_size):
+                rows = np.arange(first, min(first + chunk_size, count))
+                if offsets is not None:
+                    wanted = keys[rows] ^ flip
+                    low = offsets[wanted]
+                    high = offsets[wanted + 1]
+                else:
+                    wanted = keys[rows] ^ np.uint64(flip)
+                    low = np.searchsorted(sorted_keys, wanted, "left")
+                    high = np.searchsorted(sorted_keys, wanted, "right")
+                matches = high - low
+                total = int(matches.sum())
+                if not total:
+                    continue
+                left = np.repeat(rows, matches)
+                # Positions low..high-1 for every row, without a Python loop
+                steps = np.arange(total) - np.repeat(
+                    np.cumsum(matches) - matches, matches
+                )
+                right = order[np.repeat(low, matches) + steps]
+                keep = left < right
+                left, right = left[keep], right[keep]
+                close = hamming_many(values[left], values[right]) <= max_distance
+                if close.any():
+                    yield left[close], right[close]
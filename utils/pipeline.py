@@ -0,0 +1,138 @@
+import threading
+import time
+
+# Operations run as a pipeline: a scanner thread walks the tree, a pool
+# probes files (durations, EXIF), the planner decides where each file goes,
+# and mover threads perform the moves. Every hand-off is a bounded queue, so
+# a slow stage holds the ones before it back instead of letting work pile up
+# in memory. Each stage keeps a StageStats, which tells how busy its workers
+# were and how full the queue after it was: a stage that is busy all the time
+# with a full queue before it and an empty one after it is the bottleneck.
+
+STAGES = ("scan", "probe", "decide", "move")
+
+
+class StageStats:
+    def __init__(self, name, workers=1, capacity=0):
+        self.name = name
+        self.workers = workers
+        self.capacity = capacity  # Size of the queue the stage feeds
+        self.processed = 0
+        self.busy = 0  # Workers inside the stage right now
+        self.busy_seconds = 0.0
+        self.queued = 0  # Items waiting for the next stage right now
+        self._fill_sum = 0
+        self._fill_samples = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.busy += 1
+        return time.perf_counter()
+
+    def end(self, started, count=1):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.busy -= 1
+            self.busy_seconds += elapsed
+            self.processed += count
+
+    def measure(self):
+        return _Measure(self)
+
+    def timed(self, function):
+        # Wraps function so every call counts as one item of work
+        def run(*args, **kwargs):
+            started = self.begin()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.end(started)
+
+        return run
+
+    def sample_queue(self, queued):
+        with self._lock:
+            self.queued = queued
+            self._fill_sum += queued
+            self._fill_samples += 1
+
+    def snapshot(self, elapsed):
+        with self._lock:
+            utilization = (
+                self.busy_seconds / (elapsed * self.workers) if elapsed > 0 else 0.0
+            )
+            fill = (
+                self._fill_sum / self._fill_samples / self.capacity
+                if self.capacity and self._fill_samples
+                else 0.0
+            )
+            return {
+                "stage": self.name,
+                "workers": self.workers,
+                "busy": self.busy,
+                "processed": self.processed,
+                "utilization": round(min(utilization, 1.0), 3),
+                "queued": self.queued,
+                "capacity": self.capacity,
+                "queue_fill": round(fill, 3),
+            }
+
+
+class _Measure:
+    def __init__(self, stats):
+        self.stats = stats
+        self.started = None
+
+    def __enter__(self):
+        self.started = self.stats.begin()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stats.end(self.started)
+        return False
+
+
+class PipelineMonitor:
+    def __init__(self):
+        self.started = time.monotonic()
+        self._stages = {}
+        self._lock = threading.Lock()
+
+    def stage(self, name, workers=None, capacity=None):
+        # Stats for a stage, created on first use; workers and capacity are
+        # updated by whoever sets the stage up
+        with self._lock:
+            stats = self._stages.get(name)
+            if stats is None:
+                stats = self._stages[name] = StageStats(name)
+            if workers is not None:
+                stats.workers = max(1, workers)
+            if capacity is not None:
+                stats.capacity = capacity
+            return stats
+
+    def snapshot(self):
+        elapsed = time.monotonic() - self.started
+        with self._lock:
+            stages = list(self._stages.values())
+        order = {name: position for position, name in enumerate(STAGES)}
+        stages.sort(key=lambda stats: order.get(stats.name, len(order)))
+        return [stats.snapshot(elapsed) for stats in stages]
+
+    def bottleneck(self):
+        stages = self.snapshot()
+        if not stages:
+            return None
+        return max(stages, key=lambda stage: stage["utilization"])["stage"]
+
+    def describe(self):
+        parts = []
+        for stage in self.snapshot():
+            text = f"{stage['stage']} {stage['utilization'] * 100:.0f}%"
+            if stage["workers"] > 1:
+                text += f" of {stage['workers']}"
+            if stage["capacity"]:
+                text += f" (output queue {stage['queue_fill'] * 100:.0f}% full)"
+            parts.append(text)
+        return ", ".join(parts)
@@ -0,0 +1,171 @@
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
+
+PROBE_BATCH_SIZE = 16  # Quick probes sent to the pool per task
+
+
+def default_probe_workers():
+    # ffprobe spends most of its time in the child process, so the pool can
+    # safely run a couple of probes per core
+    return max(2, (os.cpu_count() or 1) * 2)
+
+
+def ordered_map(
+    function,
+    items,
+    check_if_running=None,
+    max_workers=None,
+    executor=None,
+    payload=None,
+    stats=None,
+):
+    # Run function over items with a bounded number of calls in flight.
+    # Yields (item, future) pairs in input order, so callers keep their own
+    # error handling around future.result(). A caller-owned executor (e.g. a
+    # process pool) may be passed in; payload(item) then selects what is sent
+    # to it when the item itself can't be pickled. With stats (a StageStats),
+    # time spent in function and the results waiting for the caller are
+    # recorded; work sent to a process pool is timed from here instead.
+    max_workers = max_workers or default_probe_workers()
+    min_in_flight = max(1, min(max_workers, os.cpu_count() or 1))
+    in_flight_limit = min_in_flight
+
+    items = iter(items)
+    pending = deque()
+    exhausted = False
+    owns_executor = executor is None
+    if owns_executor:
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+    submitter = executor
+    if stats is not None:
+        stats.workers = max_workers
+        stats.capacity = max_workers
+        if owns_executor:
+            function = stats.timed(function)
+        else:
+            submitter = _TimedSubmitter(executor, stats)
+
+    try:
+        while True:
+            if check_if_running is not None and not check_if_running():
+                return
+
+            # Keep the window full
+            while not exhausted and len(pending) < in_flight_limit:
+                try:
+                    item = next(items)
+                except StopIteration:
+                    exhausted = True
+                    break
+                argument = payload(item) if payload is not None else item
+                pending.append((item, submitter.submit(function, argument)))
+
+            if not pending:
+                return
+
+            item, future = pending[0]
+            if future.done():
+                # Everything in the window finished before we got to it: the
+                # consumer is the bottleneck, so stop spawning extra probes
+                if in_flight_limit > min_in_flight and all(
+                    f.done() for _, f in pending
+                ):
+                    in_flight_limit -= 1
+            else:
+                # Waiting on the head of the queue: probes are the bottleneck
+                if in_flight_limit < max_workers:
+                    in_flight_limit += 1
+                    continue
+                # Wake up regularly so cancellation is noticed promptly
+                while not wait([future], timeout=0.1).done:
+                    if check_if_running is not None and not check_if_running():
+                        return
+
+            pending.popleft()
+            if stats is not None:
+                stats.sample_queue(sum(1 for _, f in pending if f.done()) + 1)
+            yield item, future
+    finally:
+        for _, future in pending:
+            future.cancel()
+        if owns_executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class _Outcome:
+    # Future-like result of one item of a batch
+    def __init__(self, value=None, error=None):
+        self.value = value
+        self.error = error
+
+    def result(self):
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+def batched_map(
+    function,
+    items,
+    check_if_running=None,
+    max_workers=None,
+    batch_size=PROBE_BATCH_SIZE,
+    stats=None,
+):
+    # Same as ordered_map, but items go to the pool in batches. For quick
+    # probes (header reads) the hand-off to a worker thread costs more than
+    # the probe itself; batching spreads it over several files. Each item
+    # still gets its own result or exception.
+    def run_batch(batch):
+        started = stats.begin() if stats is not None else None
+        outcomes = []
+        for item in batch:
+            try:
+                outcomes.append(_Outcome(function(item)))
+            except Exception as e:
+                outcomes.append(_Outcome(error=e))
+        if started is not None:
+            stats.end(started, len(batch))
+        return outcomes
+
+    if stats is not None:
+        workers = max_workers or default_probe_workers()
+        stats.workers = workers
+        stats.capacity = workers * batch_size
+    results = ordered_map(
+        run_batch, batched(items, batch_size), check_if_running, max_workers
+    )
+    try:
+        for batch, future in results:
+            outcomes = future.result()
+            if stats is not None:
+                stats.sample_queue(len(outcomes))
+            yield from zip(batch, outcomes)
+    finally:
+        results.close()
+
+
+class _TimedSubmitter:
+    # Times tasks sent to a caller-owned (e.g. process) pool from submission
+    # to completion, since they can't be timed where they run
+    def __init__(self, executor, stats):
+        self.executor = executor
+        self.stats = stats
+
+    def submit(self, function, argument):
+        started = self.stats.begin()
+        future = self.executor.submit(function, argument)
+        future.add_done_callback(lambda _: self.stats.end(started))
+        return future
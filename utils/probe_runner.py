@@ -0,0 +1,122 @@
+import asyncio
+import os
+import threading
+import time
+
+from utils import metrics
+
+# Runs probe subprocesses (ffprobe) on one asyncio event loop thread, so
+# every probe in flight is known and can be killed: a probe that outlives
+# its timeout is killed and reported, and cancelling kills all of them at
+# once instead of waiting for each to finish. Callers block on the result
+# from their own (pool) threads.
+
+PROBE_TIMEOUT_ENV = "HANDYMAN_PROBE_TIMEOUT"  # Seconds per probe
+DEFAULT_PROBE_TIMEOUT = 30.0
+
+
+class ProbeTimeout(Exception):
+    pass
+
+
+class ProbeCancelled(Exception):
+    pass
+
+
+def probe_timeout():
+    try:
+        return float(os.environ.get(PROBE_TIMEOUT_ENV, DEFAULT_PROBE_TIMEOUT))
+    except ValueError:
+        return DEFAULT_PROBE_TIMEOUT
+
+
+class ProbeRunner:
+    def __init__(self):
+        self._loop = None
+        self._processes = set()
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def _event_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="probe-runner", daemon=True
+                ).start()
+            return self._loop
+
+    async def _run(self, args, timeout):
+        if self._cancelled:
+            raise ProbeCancelled()
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._processes.add(process)
+        started = time.perf_counter()
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            _kill(process)
+            await process.wait()
+            metrics.count("ffprobe.timeouts")
+            raise ProbeTimeout(
+                f"{os.path.basename(args[0])} timed out after {timeout:g}s"
+            )
+        finally:
+            self._processes.discard(process)
+            metrics.observe("ffprobe", time.perf_counter() - started)
+        if self._cancelled:
+            raise ProbeCancelled()
+        return process.returncode, stdout, stderr
+
+    def run(self, args, timeout=None):
+        # Returns (returncode, stdout, stderr) as bytes. Raises ProbeTimeout,
+        # ProbeCancelled, or OSError when the program can't be started.
+        timeout = timeout or probe_timeout()
+        if self._cancelled:
+            raise ProbeCancelled()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run(args, timeout), self._event_loop()
+        )
+        return future.result()
+
+    def cancel(self):
+        # Kills every probe in flight; later probes fail until allow()
+        self._cancelled = True
+        with self._lock:
+            loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._kill_all)
+
+    def allow(self):
+        self._cancelled = False
+
+    def _kill_all(self):
+        for process in list(self._processes):
+            _kill(process)
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except ProcessLookupError:
+        pass  # Already gone
+
+
+_runner = ProbeRunner()
+
+
+def run_probe(args, timeout=None):
+    return _runner.run(args, timeout)
+
+
+def cancel_probes():
+    _runner.cancel()
+
+
+def allow_probes():
+    _runner.allow()
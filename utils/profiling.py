@@ -0,0 +1,169 @@
+import json
+import marshal
+import os
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+
+# Wall-clock sampling profiler for a whole run. A background thread takes
+# the stack of every thread at a fixed interval, so the pool threads that
+# probe files and the lanes that move them show up next to the worker, and
+# time spent waiting on ffprobe or a slow disk counts like time spent
+# computing. Nothing is installed when profiling is off.
+#
+# A run writes three files next to each other:
+#   <name>.collapsed  one "thread;frame;frame count" line per stack, for
+#                     flamegraph.pl, speedscope or inferno
+#   <name>.pstats     the same samples as pstats data (for pstats, snakeviz);
+#                     call counts are sample counts
+#   <name>.json       sampling details and the run's filesystem and ffprobe
+#                     wall time from utils.metrics
+
+DEFAULT_PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".handyman", "profiles")
+PROFILE_ENV = "HANDYMAN_PROFILES"  # Folder for profiles
+SAMPLE_INTERVAL = 0.005  # Seconds between samples
+
+# Metrics that are wall time spent outside Python
+WALL_TIME_METRICS = (
+    "walk.folder",
+    "stat",
+    "header.image",
+    "header.video",
+    "exif.pillow",
+    "ffprobe",
+    "move",
+)
+
+
+def _thread_group(name):
+    # Pool threads are numbered; their samples are merged
+    return re.sub(r"[-_]\d+", "", name)
+
+
+class SamplingProfiler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = {}  # (thread group, stack of (file, line, function)) -> count
+        self.sample_count = 0
+        self.started = None
+        self.elapsed = 0.0
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(
+            target=self._run, name="handyman-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((code.co_filename, code.co_firstlineno, code.co_name))
+                    frame = frame.f_back
+                stack.reverse()
+                key = (_thread_group(names.get(ident, "thread")), tuple(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.sample_count += 1
+
+    def collapsed(self):
+        lines = []
+        for (thread, stack), count in sorted(self.samples.items()):
+            frames = [thread] + [
+                f"{function} ({os.path.basename(filename)}:{line})"
+                for filename, line, function in stack
+            ]
+            lines.append(f"{';'.join(frames)} {count}")
+        return lines
+
+    def sample_seconds(self):
+        # Wall time each sample stands for. Walking the stacks takes time on
+        # top of the interval, so it is measured rather than assumed.
+        if self.sample_count and self.elapsed:
+            return self.elapsed / self.sample_count
+        return self.interval
+
+    def pstats_data(self):
+        # {function: (calls, primitive calls, own time, cumulative time,
+        # {caller: (calls, primitive calls, own time, cumulative time)})}
+        stats = {}
+        sample_seconds = self.sample_seconds()
+        for (_, stack), count in self.samples.items():
+            seconds = count * sample_seconds
+            seen = set()
+            for depth, function in enumerate(stack):
+                entry = stats.setdefault(function, [0, 0, 0.0, 0.0, {}])
+                if function not in seen:
+                    # Recursion counts once per sample
+                    seen.add(function)
+                    entry[0] += count
+                    entry[1] += count
+                    entry[3] += seconds
+                if depth == len(stack) - 1:
+                    entry[2] += seconds
+                if depth:
+                    caller = stack[depth - 1]
+                    calls = entry[4].get(caller, (0, 0, 0.0, 0.0))
+                    entry[4][caller] = (
+                        calls[0] + count,
+                        calls[1] + count,
+                        calls[2] + (seconds if depth == len(stack) - 1 else 0.0),
+                        calls[3] + seconds,
+                    )
+        return {function: tuple(entry) for function, entry in stats.items()}
+
+    def write(self, base_path, metrics=None):
+        # Returns the paths written
+        directory = os.path.dirname(base_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        paths = {
+            "collapsed": base_path + ".collapsed",
+            "pstats": base_path + ".pstats",
+            "summary": base_path + ".json",
+        }
+        with open(paths["collapsed"], "w", encoding="utf-8") as f:
+            for line in self.collapsed():
+                f.write(line + "\n")
+        with open(paths["pstats"], "wb") as f:
+            marshal.dump(self.pstats_data(), f)
+        summary = {
+            "interval": self.interval,
+            "samples": self.sample_count,
+            "seconds_per_sample": round(self.sample_seconds(), 6),
+            "elapsed": round(self.elapsed, 3),
+            "threads": sorted({thread for thread, _ in self.samples}),
+        }
+        if metrics is not None:
+            timings = metrics.snapshot()["timings"]
+            summary["wall_time"] = {
+                name: timings[name]["seconds"]
+                for name in WALL_TIME_METRICS
+                if name in timings
+            }
+        with open(paths["summary"], "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+        return paths
+
+
+def profile_path(operation):
+    # Base path (without extension) for a new profile of operation
+    directory = os.environ.get(PROFILE_ENV) or DEFAULT_PROFILE_DIR
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    return os.path.join(directory, f"{operation}-{stamp}")
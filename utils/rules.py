@@ -0,0 +1,447 @@
+import fnmatch
+import hashlib
+import json
+import os
+import re
+import threading
+
+from utils.catalog import MISSING, cached_attribute
+from utils.image_headers import (
+    DATE_TAGS,
+    HEADER_ERRORS,
+    TAG_DATE_TIME,
+    TAG_DATE_TIME_DIGITIZED,
+    TAG_DATE_TIME_ORIGINAL,
+    TAG_IMAGE_DESCRIPTION,
+    TAG_MAKE,
+    TAG_MODEL,
+    TAG_SOFTWARE,
+    TAG_USER_COMMENT,
+    TAG_XP_COMMENT,
+    read_image_header,
+    xmp_user_comments,
+)
+from utils.metrics import measured
+from utils.screenshot_heuristics import (
+    CACHE_KEY as SCREENSHOT_CACHE_KEY,
+    HEURISTIC_TAGS,
+    classify,
+    pillow_header,
+)
+
+# Declarative rules for picking files. A rule is a JSON object:
+#
+#   "short-videos": {
+#       "extensions": [".mp4", ".mov"],
+#       "name": ["IMG_*"],                 filename globs, any may match
+#       "name_regex": "^IMG_\\d+",         searched in the filename
+#       "size": {"min": 0, "max": 50000000},           bytes
+#       "duration": {"max": 3},                        seconds
+#       "screenshot": {"min": 0.6},                    confidence, 0 to 1
+#       "exif": [{"fields": ["Software"], "contains": "screenshot"},
+#                {"fields": ["Model"], "matches": "^iPhone"}]
+#   }
+#
+# Every condition given must hold; an exif condition holds when any of its
+# fields matches. The screenshot confidence comes from the image header alone
+# (see utils.screenshot_heuristics). Conditions are checked cheapest first:
+# the file name, then its stat result, then its image header, then its
+# duration (which may spawn ffprobe), so an expensive check only runs on
+# files that passed the cheap ones. Rules are read from $HANDYMAN_RULES or ~/.handyman/rules.json
+# when present, on top of the built-in rules below.
+
+RULES_ENV = "HANDYMAN_RULES"  # Path to a rules file
+DEFAULT_RULES_PATH = os.path.join(os.path.expanduser("~"), ".handyman", "rules.json")
+
+COST_NAME = 0
+COST_STAT = 1
+COST_HEADER = 2
+COST_PROBE = 3
+
+EXIF_FIELDS = {
+    "ImageDescription": TAG_IMAGE_DESCRIPTION,
+    "Make": TAG_MAKE,
+    "Model": TAG_MODEL,
+    "Software": TAG_SOFTWARE,
+    "DateTime": TAG_DATE_TIME,
+    "DateTimeOriginal": TAG_DATE_TIME_ORIGINAL,
+    "DateTimeDigitized": TAG_DATE_TIME_DIGITIZED,
+    "UserComment": TAG_USER_COMMENT,
+    "XPComment": TAG_XP_COMMENT,
+}
+XMP_USER_COMMENT_FIELD = "XMPUserComment"
+HEADER_TAGS = tuple(EXIF_FIELDS.values()) + tuple(
+    tag for tag in DATE_TAGS + HEURISTIC_TAGS if tag not in EXIF_FIELDS.values()
+)
+
+VIDEO_FORMATS = (".mp4", ".mov", ".wmv", ".avi", ".flv", ".f4v", ".mkv", ".m4v")
+SCREENSHOT_FORMATS = (".png", ".jpg", ".jpeg", ".tiff", ".bmp")
+
+DEFAULT_RULES = {
+    "short-videos": {
+        "extensions": list(VIDEO_FORMATS),
+        "duration": {"max": 3},  # Seconds
+    },
+    "screenshots": {
+        "extensions": list(SCREENSHOT_FORMATS),
+        # "Screenshot" in the EXIF or XMP text counts as 1
+        "screenshot": {"min": 0.6},
+    },
+}
+RESERVED_NAMES = ("by-date",)  # Built into combined runs, not a rule
+
+RULE_KEYS = (
+    "extensions",
+    "name",
+    "name_regex",
+    "size",
+    "duration",
+    "exif",
+    "screenshot",
+)
+
+
+class RuleError(ValueError):
+    pass
+
+
+class FileFacts:
+    # What is known about one file while rules look at it. Each piece (stat
+    # result, image header, screenshot score, duration) is read at most once,
+    # and only when a rule gets that far.
+
+    def __init__(self, entry):
+        self.entry = entry
+        self.errors = []  # Rules that failed on the file, with the error
+        self.exif_date = None
+        self._header = MISSING
+        self._screenshot = MISSING
+        self._duration = MISSING
+
+    def stat(self):
+        return self.entry.stat()
+
+    def image_header(self):
+        if self._header is MISSING:
+            try:
+                self._header = read_image_header(
+                    self.entry.path, HEADER_TAGS, profile=True
+                )
+            except HEADER_ERRORS:
+                self._header = None
+        return self._header
+
+    def screenshot(self):
+        # (confidence, reasons) that the file is a screenshot
+        if self._screenshot is MISSING:
+            score, reasons = cached_attribute(
+                self.entry.path,
+                SCREENSHOT_CACHE_KEY,
+                self._classify_screenshot,
+                st=self.stat(),
+            )
+            self._screenshot = (score, reasons)
+        return self._screenshot
+
+    def _classify_screenshot(self):
+        header = self.image_header()
+        if header is None:
+            header = pillow_header(self.entry.path)
+        return list(classify(header))
+
+    def screenshot_if_read(self):
+        return None if self._screenshot is MISSING else self._screenshot
+
+    def duration(self):
+        if self._duration is MISSING:
+            # Imported here: file_operations builds on this module
+            from utils.file_operations import get_video_duration
+
+            self._duration = get_video_duration(self.entry.path, self.stat())
+        return self._duration
+
+    def duration_if_read(self):
+        return None if self._duration is MISSING else self._duration
+
+    def duration_unknown(self):
+        # Probed, but no duration came back
+        return self._duration is None
+
+
+def _string_list(spec, key):
+    value = spec[key]
+    if isinstance(value, str):
+        return [value]
+    if (
+        not isinstance(value, list)
+        or not value
+        or not all(isinstance(item, str) for item in value)
+    ):
+        raise RuleError(f"'{key}' must be a string or a list of strings")
+    return value
+
+
+def _range_check(spec, key, unit):
+    if not isinstance(spec, dict) or not set(spec) <= {"min", "max"}:
+        raise RuleError(f"'{key}' must be an object with 'min' and/or 'max'")
+    for bound in spec.values():
+        if not isinstance(bound, (int, float)) or isinstance(bound, bool):
+            raise RuleError(f"'{key}' bounds must be numbers ({unit})")
+    low = spec.get("min")
+    high = spec.get("max")
+
+    def within(value):
+        if value is None:
+            return False
+        if low is not None and value < low:
+            return False
+        return high is None or value <= high
+
+    parts = []
+    if low is not None:
+        parts.append(f">= {low}{unit}")
+    if high is not None:
+        parts.append(f"<= {high}{unit}")
+    return within, f"{key} {' and '.join(parts)}"
+
+
+def _exif_values(header, fields):
+    values = []
+    for field in fields:
+        if field == XMP_USER_COMMENT_FIELD:
+            if header.xmp:
+                values.extend(xmp_user_comments(header.xmp))
+            continue
+        value = header.tags.get(EXIF_FIELDS[field])
+        if isinstance(value, str):
+            values.append(value)
+    return values
+
+
+@measured("exif.pillow")
+def _pillow_exif_values(file_path, fields):
+    # For formats the header reader doesn't parse
+    from PIL import Image
+
+    tags = [EXIF_FIELDS[field] for field in fields if field in EXIF_FIELDS]
+    values = []
+    with Image.open(file_path) as img:
+        exif = img._getexif() if hasattr(img, "_getexif") else None
+        for tag in tags:
+            value = (exif or {}).get(tag)
+            if isinstance(value, bytes):
+                value = value.decode("utf-8", "ignore").strip("\x00 ")
+            if isinstance(value, str):
+                values.append(value)
+    return values
+
+
+def _exif_check(conditions):
+    if isinstance(conditions, dict):
+        conditions = [conditions]
+    if not isinstance(conditions, list) or not conditions:
+        raise RuleError("'exif' must be an object or a list of objects")
+    compiled = []
+    for condition in conditions:
+        if not isinstance(condition, dict):
+            raise RuleError("'exif' conditions must be objects")
+        fields = condition.get("fields")
+        if isinstance(fields, str):
+            fields = [fields]
+        if not fields:
+            raise RuleError("'exif' conditions need 'fields'")
+        for field in fields:
+            if field not in EXIF_FIELDS and field != XMP_USER_COMMENT_FIELD:
+                known = ", ".join(sorted(EXIF_FIELDS) + [XMP_USER_COMMENT_FIELD])
+                raise RuleError(f"Unknown EXIF field '{field}' (known: {known})")
+        if ("contains" in condition) == ("matches" in condition):
+            raise RuleError("'exif' conditions need one of 'contains' or 'matches'")
+        if "contains" in condition:
+            needle = str(condition["contains"]).lower()
+            test = lambda value, needle=needle: needle in value.lower()
+            label = f"contains '{condition['contains']}'"
+        else:
+            try:
+                pattern = re.compile(condition["matches"], re.I)
+            except (re.error, TypeError) as e:
+                raise RuleError(f"Bad 'matches' pattern: {e}")
+            test = lambda value, pattern=pattern: pattern.search(value) is not None
+            label = f"matches '{condition['matches']}'"
+        compiled.append((fields, test, f"{'/'.join(fields)} {label}"))
+
+    def verdict(file_path, facts):
+        header = facts.image_header()
+        for fields, test, _ in compiled:
+            if header is not None:
+                values = _exif_values(header, fields)
+            else:
+                values = _pillow_exif_values(file_path, fields)
+            if not any(test(value) for value in values):
+                return False
+        return True
+
+    # Verdicts are cached per condition set, so editing a rule starts afresh
+    key = hashlib.sha1(json.dumps(conditions, sort_keys=True).encode()).hexdigest()
+    cache_key = f"exif:{key[:12]}"
+
+    def check(facts):
+        entry = facts.entry
+        return cached_attribute(
+            entry.path,
+            cache_key,
+            lambda: verdict(entry.path, facts),
+            st=facts.stat(),
+        )
+
+    return check, "; ".join(label for _, _, label in compiled)
+
+
+class Rule:
+    def __init__(self, name, spec):
+        if not isinstance(spec, dict):
+            raise RuleError(f"Rule '{name}' must be an object")
+        unknown = set(spec) - set(RULE_KEYS)
+        if unknown:
+            raise RuleError(
+                f"Rule '{name}' has unknown keys: {', '.join(sorted(unknown))}"
+            )
+        self.name = name
+        self.spec = spec
+        self.extensions = None
+        checks = []  # (cost, label, check(facts))
+        try:
+            if "extensions" in spec:
+                extensions = _string_list(spec, "extensions")
+                self.extensions = tuple(
+                    ext.lower() if ext.startswith(".") else "." + ext.lower()
+                    for ext in extensions
+                )
+                checks.append(
+                    (
+                        COST_NAME,
+                        f"extension in {', '.join(self.extensions)}",
+                        lambda facts: facts.entry.name.lower().endswith(
+                            self.extensions
+                        ),
+                    )
+                )
+            if "name" in spec:
+                globs = _string_list(spec, "name")
+                patterns = [re.compile(fnmatch.translate(glob), re.I) for glob in globs]
+                checks.append(
+                    (
+                        COST_NAME,
+                        f"name like {', '.join(globs)}",
+                        lambda facts: any(
+                            pattern.match(facts.entry.name) for pattern in patterns
+                        ),
+                    )
+                )
+            if "name_regex" in spec:
+                try:
+                    name_pattern = re.compile(spec["name_regex"])
+                except (re.error, TypeError) as e:
+                    raise RuleError(f"Bad 'name_regex': {e}")
+                checks.append(
+                    (
+                        COST_NAME,
+                        f"name matches '{spec['name_regex']}'",
+                        lambda facts: name_pattern.search(facts.entry.name) is not None,
+                    )
+                )
+            if "size" in spec:
+                within, label = _range_check(spec["size"], "size", " bytes")
+                checks.append(
+                    (COST_STAT, label, lambda facts: within(facts.stat().st_size))
+                )
+            if "exif" in spec:
+                check, label = _exif_check(spec["exif"])
+                checks.append((COST_HEADER, f"exif {label}", check))
+            if "screenshot" in spec:
+                likely, label = _range_check(spec["screenshot"], "screenshot", "")
+                checks.append(
+                    (COST_HEADER, label, lambda facts: likely(facts.screenshot()[0]))
+                )
+            if "duration" in spec:
+                within, label = _range_check(spec["duration"], "duration", "s")
+                checks.append(
+                    (COST_PROBE, label, lambda facts: within(facts.duration()))
+                )
+        except RuleError as e:
+            raise RuleError(f"Rule '{name}': {e}")
+        if not checks:
+            raise RuleError(f"Rule '{name}' has no conditions")
+        # Cheapest first; sorted() keeps the written order within a cost
+        self.checks = sorted(checks, key=lambda check: check[0])
+
+    def first_failure(self, facts):
+        # Label of the first condition the file fails, or None if it matches
+        for _, label, check in self.checks:
+            if not check(facts):
+                return label
+        return None
+
+    def test(self, facts):
+        return self.first_failure(facts) is None
+
+    def describe(self):
+        return " -> ".join(label for _, label, _ in self.checks)
+
+
+def compile_rules(specs):
+    rules = {}
+    for name, spec in specs.items():
+        if name in RESERVED_NAMES:
+            raise RuleError(f"'{name}' is built in and can't be redefined")
+        rules[name] = Rule(name, spec)
+    return rules
+
+
+def rules_path():
+    path = os.environ.get(RULES_ENV)
+    if path:
+        return path
+    return DEFAULT_RULES_PATH if os.path.exists(DEFAULT_RULES_PATH) else None
+
+
+def load_rules(path=None):
+    # Built-in rules, overridden and extended by the rules file
+    specs = dict(DEFAULT_RULES)
+    path = path or rules_path()
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                custom = json.load(f)
+        except (OSError, ValueError) as e:
+            raise RuleError(f"Can't read rules from {path}: {e}")
+        if not isinstance(custom, dict):
+            raise RuleError(f"{path} must hold an object of rules")
+        specs.update(custom)
+    return compile_rules(specs)
+
+
+_rules = None
+_rules_key = None
+_rules_lock = threading.Lock()
+
+
+def get_rules():
+    # Rules for this process, reloaded when the rules file changes
+    global _rules, _rules_key
+    path = rules_path()
+    try:
+        key = (path, os.stat(path).st_mtime_ns) if path else None
+    except OSError:
+        key = (path, None)
+    with _rules_lock:
+        if _rules is None or key != _rules_key:
+            _rules = load_rules(path)
+            _rules_key = key
+        return _rules
+
+
+def get_rule(name):
+    rules = get_rules()
+    if name not in rules:
+        raise RuleError(f"No rule named '{name}'")
+    return rules[name]
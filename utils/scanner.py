@@ -0,0 +1,241 @@
+import os
+import queue
+import threading
+import time
+
+from utils import metrics
+
+CHUNK_SIZE = 256  # Entries handed to the consumer per queue operation
+BUFFER_CHUNKS = 64  # How far the scanner may run ahead of the consumer
+
+
+# Stat calls that reach the filesystem, timed into the run's metrics
+@metrics.measured("stat")
+def _stat(path):
+    return os.stat(path)
+
+
+@metrics.measured("stat")
+def _lstat(path):
+    return os.lstat(path)
+
+
+@metrics.measured("stat")
+def _entry_stat(entry):
+    return entry.stat()
+
+
+def iter_entries(root, extensions=None, exclude=(), check_if_running=None):
+    # Depth-first walk built on os.scandir. Files are yielded as DirEntry
+    # objects straight from the directory iterator, so huge flat folders are
+    # streamed instead of being collected into lists first. Like os.walk, all
+    # files of a folder come out before any of its subfolders.
+    excluded = {os.path.normpath(path) for path in exclude if path}
+    stack = [root]
+    while stack:
+        if check_if_running is not None and not check_if_running():
+            return
+        directory = stack.pop()
+        subdirs = []
+        # Folder listing time, without the time spent by the consumer
+        timed = metrics.active_run() is not None
+        listing = 0.0
+        started = time.perf_counter() if timed else 0.0
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        continue
+                    if is_dir:
+                        # Same as os.walk: symlinked folders aren't followed
+                        if not entry.is_symlink() and entry.path not in excluded:
+                            subdirs.append(entry.path)
+                    elif extensions is None or entry.name.lower().endswith(extensions):
+                        if timed:
+                            listing += time.perf_counter() - started
+                        yield entry
+                        if timed:
+                            started = time.perf_counter()
+        except OSError:
+            # Folder vanished (e.g. moved by the consumer) or is unreadable
+            continue
+        if timed:
+            metrics.observe("walk.folder", listing + time.perf_counter() - started)
+        stack.extend(reversed(subdirs))
+
+
+class StreamingScanner:
+    # Runs iter_entries on a background thread so processing can start right
+    # away. `discovered` grows while the walk is in progress and can be used
+    # as the running total for progress reporting.
+
+    def __init__(
+        self,
+        root,
+        extensions=None,
+        exclude=(),
+        check_if_running=None,
+        prefetch_stat=True,
+        stats=None,
+    ):
+        self.root = root
+        self.extensions = extensions
+        self.exclude = [os.path.abspath(path) for path in exclude if path]
+        self.check_if_running = check_if_running
+        self.prefetch_stat = prefetch_stat
+        self.stats = stats  # StageStats of the scan stage, if monitored
+        if stats is not None:
+            stats.capacity = BUFFER_CHUNKS * CHUNK_SIZE
+        self.discovered = 0
+        self.finished = False
+        self._queue = queue.Queue(maxsize=BUFFER_CHUNKS)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def _is_running(self):
+        if self._stopped.is_set():
+            return False
+        return self.check_if_running is None or self.check_if_running()
+
+    def _put(self, item):
+        # Block while the consumer is behind, but give up once it has gone
+        if self.stats is not None:
+            self.stats.sample_queue(self._queue.qsize() * CHUNK_SIZE)
+        while self._is_running():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _scan(self):
+        chunk = []
+        started = self.stats.begin() if self.stats is not None else None
+        try:
+            for entry in iter_entries(
+                os.path.abspath(self.root),
+                self.extensions,
+                self.exclude,
+                self._is_running,
+            ):
+                if self.prefetch_stat:
+                    # Warm DirEntry's stat cache off the consumer's thread
+                    try:
+                        _entry_stat(entry)
+                    except OSError:
+                        pass
+                chunk.append(entry)
+                self.discovered += 1
+                if len(chunk) >= CHUNK_SIZE:
+                    # Time blocked on a full queue isn't work
+                    if started is not None:
+                        self.stats.end(started, len(chunk))
+                    if not self._put(chunk):
+                        started = None
+                        return
+                    started = self.stats.begin() if self.stats is not None else None
+                    chunk = []
+            if started is not None:
+                self.stats.end(started, len(chunk))
+                started = None
+            if chunk:
+                self._put(chunk)
+        finally:
+            if started is not None:
+                self.stats.end(started, len(chunk))
+            self.finished = True
+            self._put(None)
+
+    def __iter__(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._scan, daemon=True)
+            self._thread.start()
+        while True:
+            try:
+                chunk = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                if not self._is_running():
+                    return
+                continue
+            if chunk is None:
+                return
+            yield from chunk
+
+    def close(self):
+        self._stopped.set()
+
+
+def report_progress(progress_callback, processed, scanner, current_file):
+    # Percentage against the files found so far; the total keeps growing
+    # until the scanner reaches the end of the tree
+    total = max(scanner.discovered, processed)
+    percentage = int((processed / total) * 100) if total else 0
+    progress_callback(processed, total, percentage, current_file)
+
+
+class PathEntry:
+    # Stand-in for os.DirEntry when the path came from somewhere other than
+    # a directory listing (e.g. a watch event). Stat results are cached the
+    # same way.
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.basename(path)
+        self._stat = None
+        self._lstat = None
+
+    def stat(self, follow_symlinks=True):
+        if not follow_symlinks:
+            if self._lstat is None:
+                self._lstat = _lstat(self.path)
+            return self._lstat
+        if self._stat is None:
+            self._stat = _stat(self.path)
+        return self._stat
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+
+class PathListScanner:
+    # Scanner interface over a known list of files. Paths are grouped by
+    # folder, as a walk would return them, and anything outside `extensions`,
+    # under `exclude` or no longer a regular file is dropped.
+
+    def __init__(self, paths, extensions=None, exclude=()):
+        excluded = tuple(
+            os.path.join(os.path.abspath(path), "") for path in exclude if path
+        )
+        self.entries = []
+        for path in sorted(set(paths), key=lambda path: os.path.split(path)):
+            if extensions is not None and not path.lower().endswith(extensions):
+                continue
+            if excluded and path.startswith(excluded):
+                continue
+            if os.path.isfile(path) and not os.path.islink(path):
+                self.entries.append(PathEntry(path))
+        self.discovered = len(self.entries)
+        self.finished = True
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def close(self):
+        pass
+
+
+def open_scanner(
+    root,
+    extensions=None,
+    exclude=(),
+    check_if_running=None,
+    paths=None,
+    stats=None,
+):
+    # Walks root, or only looks at `paths` when they are given
+    if paths is not None:
+        return PathListScanner(paths, extensions, exclude)
+    return StreamingScanner(root, extensions, exclude, check_if_running, stats=stats)
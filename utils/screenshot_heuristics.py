@@ -0,0 +1,310 @@
+import struct
+
+from utils.image_headers import (
+    TAG_EXIF_IFD,
+    TAG_EXPOSURE_TIME,
+    TAG_F_NUMBER,
+    TAG_FOCAL_LENGTH,
+    TAG_IMAGE_DESCRIPTION,
+    TAG_MAKE,
+    TAG_MODEL,
+    TAG_SOFTWARE,
+    TAG_USER_COMMENT,
+    TAG_XP_COMMENT,
+    ImageHeader,
+    xmp_user_comments,
+)
+from utils.metrics import measured
+
+# Guesses whether an image is a screenshot from its header alone, for the
+# many screenshots that lost their "Screenshot" EXIF text on the way (sent
+# through a messenger, exported, re-saved). Nothing here decodes pixels:
+# the image size, the container and its chunks, the embedded color profile
+# and the EXIF tags are all in the first few kilobytes.
+#
+# Each signal adds to (or, for camera EXIF, takes from) a confidence score
+# between 0 and 1. "Screenshot" written in the metadata settles it. The size
+# and the absence of camera EXIF fit wallpapers, charts, video frames and
+# recompressed photos just as well, so without a sign of a screen capture
+# (the app, Apple's iDOT chunk, a display profile, 144 dpi) the score stays
+# below the default threshold.
+
+CACHE_KEY = "screenshot_score:2"  # Catalog key; bump when the weights change
+
+CERTAIN = 1.0
+WEIGHT_SCREENSHOT_APP = 0.9  # Software tag names a screen capture tool
+WEIGHT_DEVICE_SCREEN = 0.5  # Exactly a phone or tablet screen
+WEIGHT_DESKTOP_SCREEN = 0.35  # Exactly a monitor; also a common video size
+WEIGHT_PHONE_ASPECT = 0.3  # Phone screen shape, e.g. resized by a messenger
+WEIGHT_APPLE_CAPTURE = 0.35  # PNG iDOT chunk, written by Apple screen capture
+WEIGHT_DISPLAY_PROFILE = 0.3  # ICC profile of a particular monitor
+WEIGHT_RETINA_DENSITY = 0.1  # PNG at 144 dpi, as macOS saves screenshots
+WEIGHT_NO_CAMERA = 0.15  # No camera EXIF at all
+WEIGHT_LOSSLESS = 0.15  # PNG or BMP without camera EXIF
+WEIGHT_CAMERA = -0.5  # Make, model or exposure settings of a camera
+UNCONFIRMED_MAX = 0.5  # Highest score without a sign of a screen capture
+
+# Tags the classifier looks at, on top of those in the screenshot text
+CAMERA_TAGS = (TAG_MAKE, TAG_MODEL, TAG_EXPOSURE_TIME, TAG_F_NUMBER, TAG_FOCAL_LENGTH)
+TEXT_TAGS = (TAG_IMAGE_DESCRIPTION, TAG_SOFTWARE, TAG_USER_COMMENT, TAG_XP_COMMENT)
+HEURISTIC_TAGS = TEXT_TAGS + CAMERA_TAGS
+
+SCREENSHOT_APPS = (
+    "cleanshot",
+    "flameshot",
+    "gnome-screenshot",
+    "greenshot",
+    "lightshot",
+    "sharex",
+    "shottr",
+    "snagit",
+    "snipping tool",
+    "spectacle",
+)
+
+# Screen sizes in pixels, (short side, long side) so either orientation
+# matches, to the devices that have them. 16:9 and 16:10 sizes are only
+# listed as desktop screens: videos, wallpapers and exports share them.
+PHONE_SCREENS = {
+    (640, 960): "iPhone 4",
+    (640, 1136): "iPhone 5/SE",
+    (750, 1334): "iPhone 6/7/8/SE",
+    (1242, 2208): "iPhone Plus",
+    (1125, 2436): "iPhone X/XS/11 Pro",
+    (828, 1792): "iPhone XR/11",
+    (1242, 2688): "iPhone XS Max/11 Pro Max",
+    (1080, 2340): "iPhone mini / Android",
+    (1170, 2532): "iPhone 12/13/14",
+    (1284, 2778): "iPhone 12-14 Pro Max/Plus",
+    (1179, 2556): "iPhone 14 Pro/15/16",
+    (1290, 2796): "iPhone 14 Pro Max/15-16 Plus",
+    (1206, 2622): "iPhone 16 Pro",
+    (1320, 2868): "iPhone 16 Pro Max",
+    (720, 1520): "Android HD+",
+    (720, 1600): "Android HD+",
+    (1080, 2160): "Android 18:9",
+    (1080, 2220): "Galaxy S8/S9",
+    (1080, 2280): "Android 19:9",
+    (1080, 2400): "Android 20:9",
+    (1080, 2408): "Android 20:9",
+    (1080, 2412): "Android 20:9",
+    (1080, 2424): "Pixel 7/8",
+    (1440, 2960): "Galaxy S8/S9 QHD",
+    (1440, 3040): "Galaxy S10 QHD",
+    (1440, 3088): "Galaxy Ultra QHD",
+    (1440, 3120): "Pixel Pro / OnePlus",
+    (1440, 3200): "Galaxy S20/S21 QHD",
+    (1344, 2992): "Pixel 8 Pro",
+    (1220, 2712): "Android 20:9",
+}
+TABLET_SCREENS = {
+    (768, 1024): "iPad",
+    (1536, 2048): "iPad Retina",
+    (1620, 2160): "iPad 10.2",
+    (1640, 2360): "iPad Air/10th gen",
+    (1668, 2224): "iPad Pro 10.5",
+    (1668, 2388): "iPad Pro 11",
+    (2048, 2732): "iPad Pro 12.9",
+    (1488, 2266): "iPad mini 6",
+}
+DESKTOP_SCREENS = {
+    (720, 1280): "HD",
+    (768, 1366): "laptop",
+    (800, 1280): "laptop",
+    (900, 1440): "laptop",
+    (1024, 1280): "monitor",
+    (900, 1600): "laptop",
+    (1050, 1680): "monitor",
+    (1080, 1920): "Full HD",
+    (1200, 1920): "monitor",
+    (1440, 2560): "QHD",
+    (1600, 2560): "MacBook / tablet",
+    (1664, 2560): "MacBook Air",
+    (1800, 2880): "MacBook Pro",
+    (1912, 2940): "MacBook Air 15",
+    (1964, 3024): "MacBook Pro 14",
+    (2234, 3456): "MacBook Pro 16",
+    (2160, 3840): "4K",
+    (2520, 4480): "iMac 24",
+    (2880, 5120): "5K",
+}
+
+# Taller than 16:9: modern phone screens (18:9 to 21:9), which photos,
+# at 4:3, 3:2 or 16:9, aren't
+PHONE_ASPECT = (1.95, 2.4)
+MIN_SCREEN_SIDE = 320  # Narrower images are icons and thumbnails, whatever the shape
+RETINA_DENSITY = 5669  # 144 dpi in pixels per metre
+
+# Descriptions of color spaces, as opposed to particular monitors. Photos
+# and exports carry these; a screenshot carries the display it was taken on.
+STANDARD_PROFILES = (
+    "sRGB",
+    "Display P3",
+    "DCI-P3",
+    "P3",
+    "Adobe RGB",
+    "ProPhoto",
+    "Generic",
+    "Rec. 2020",
+    "Rec. 709",
+    "ITU-R",
+    "ColorMatch",
+    "Apple RGB",
+    "Wide Gamut",
+    "Dot Gain",
+    "Gray",
+)
+
+
+def profile_description(icc):
+    # Returns (device class, description) from an ICC profile; either may
+    # be None when the profile is cut off or malformed
+    if not icc or len(icc) < 132:
+        return None, None
+    device_class = icc[12:16].decode("latin-1")
+    count = struct.unpack(">I", icc[128:132])[0]
+    for i in range(min(count, 100)):
+        entry = icc[132 + i * 12 : 144 + i * 12]
+        if len(entry) < 12:
+            break
+        signature, offset, size = struct.unpack(">4sII", entry)
+        if signature != b"desc":
+            continue
+        data = icc[offset : offset + size]
+        if data[:4] == b"desc" and len(data) >= 12:
+            # ICC v2: ASCII count, then the text
+            length = struct.unpack(">I", data[8:12])[0]
+            text = data[12 : 12 + length].decode("latin-1")
+        elif data[:4] == b"mluc" and len(data) >= 28:
+            # ICC v4: localized records; the first one will do
+            length, start = struct.unpack(">II", data[20:28])
+            text = data[start : start + length].decode("utf-16-be", "ignore")
+        else:
+            break
+        return device_class, text.strip("\x00 ") or None
+    return device_class, None
+
+
+def _text_values(header):
+    values = [
+        header.tags[tag] for tag in TEXT_TAGS if isinstance(header.tags.get(tag), str)
+    ]
+    if header.xmp:
+        values.extend(xmp_user_comments(header.xmp))
+    return values
+
+
+def classify(header):
+    # Returns (score, reasons) for an ImageHeader read with HEURISTIC_TAGS
+    # and its profile
+    texts = _text_values(header)
+    if any("screenshot" in text.lower() for text in texts):
+        return CERTAIN, ["marked as a screenshot"]
+
+    score = 0.0
+    reasons = []
+    captured = False  # Any signal that only a screen capture leaves
+    software = header.tags.get(TAG_SOFTWARE)
+    if isinstance(software, str):
+        app = next((app for app in SCREENSHOT_APPS if app in software.lower()), None)
+        if app is not None:
+            score += WEIGHT_SCREENSHOT_APP
+            captured = True
+            reasons.append(f"made with {software}")
+
+    if header.width and header.height:
+        size = (min(header.width, header.height), max(header.width, header.height))
+        device = PHONE_SCREENS.get(size) or TABLET_SCREENS.get(size)
+        if device is not None:
+            score += WEIGHT_DEVICE_SCREEN
+            reasons.append(f"{header.width}x{header.height} ({device})")
+        elif size in DESKTOP_SCREENS:
+            score += WEIGHT_DESKTOP_SCREEN
+            reasons.append(f"{header.width}x{header.height} ({DESKTOP_SCREENS[size]})")
+        elif (
+            size[0] >= MIN_SCREEN_SIDE
+            and PHONE_ASPECT[0] <= size[1] / size[0] <= PHONE_ASPECT[1]
+        ):
+            score += WEIGHT_PHONE_ASPECT
+            reasons.append(f"{header.width}x{header.height} (phone screen shape)")
+
+    if "iDOT" in header.chunks:
+        score += WEIGHT_APPLE_CAPTURE
+        captured = True
+        reasons.append("Apple screen capture")
+    if header.density and min(header.density) == RETINA_DENSITY:
+        score += WEIGHT_RETINA_DENSITY
+        captured = True
+        reasons.append("144 dpi")
+
+    device_class, description = profile_description(header.icc)
+    if (
+        device_class == "mntr"
+        and description
+        and not description.startswith(STANDARD_PROFILES)
+    ):
+        score += WEIGHT_DISPLAY_PROFILE
+        captured = True
+        reasons.append(f"display profile '{description}'")
+
+    if any(tag in header.tags for tag in CAMERA_TAGS):
+        score += WEIGHT_CAMERA
+        reasons.append("camera EXIF")
+    else:
+        score += WEIGHT_NO_CAMERA
+        reasons.append("no camera EXIF")
+        if header.format in ("PNG", "BMP"):
+            score += WEIGHT_LOSSLESS
+            reasons.append(header.format)
+
+    if not captured and score > UNCONFIRMED_MAX:
+        score = UNCONFIRMED_MAX
+        reasons.append("no sign of a screen capture")
+    return round(min(max(score, 0.0), 1.0), 2), reasons
+
+
+@measured("exif.pillow")
+def pillow_header(file_path):
+    # ImageHeader for formats the header reader doesn't parse. Image.open
+    # only reads the header; pixels are never loaded.
+    from PIL import Image
+
+    with Image.open(file_path) as img:
+        header = ImageHeader(img.format)
+        header.width, header.height = img.size
+        header.icc = img.info.get("icc_profile")
+        exif = img.getexif()
+        exif_ifd = exif.get_ifd(TAG_EXIF_IFD)
+        for tag in HEURISTIC_TAGS:
+            value = exif.get(tag, exif_ifd.get(tag))
+            if isinstance(value, bytes):
+                value = value.decode("utf-8", "ignore").strip("\x00 ")
+            if value is not None:
+                header.tags[tag] = value
+    return header
+
+
+def main(argv=None):
+    import argparse
+
+    from utils.image_headers import HEADER_ERRORS, read_image_header
+
+    parser = argparse.ArgumentParser(
+        description="Show how screenshot-like images look from their headers"
+    )
+    parser.add_argument("files", nargs="+")
+    args = parser.parse_args(argv)
+    for path in args.files:
+        try:
+            header = read_image_header(path, HEURISTIC_TAGS, profile=True)
+            if header is None:
+                header = pillow_header(path)
+        except HEADER_ERRORS + (ImportError,) as e:
+            print(f"{path}: {e}")
+            continue
+        score, reasons = classify(header)
+        print(f"{path}: {score:.2f} ({'; '.join(reasons)})")
+
+
+if __name__ == "__main__":
+    main()
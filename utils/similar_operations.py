@@ -0,0 +1,213 @@
+import os
+from contextlib import closing
+from utils.catalog import cached_attribute, flush_catalog
+from utils.journal import open_journal
+from utils.manifest import PlannedMove, PlanSummary, run_plan
+from utils.perceptual_hash import hamming, hamming_many, image_hashes, similar_pairs
+from utils.probe_pool import ordered_map
+from utils.scanner import StreamingScanner, report_progress
+
+# Near-duplicate photos: every image is reduced to two perceptual hashes,
+# candidates come from a multi-index join on the pHash and are confirmed on
+# the dHash, and connected images form a cluster. In each cluster the
+# largest image stays, and only images similar to it are moved; the rest
+# are grouped again around the largest of them, so a chain of small steps
+# (a burst, a slow pan) never moves a frame far from the one that is kept.
+
+IMAGE_FORMATS = (".jpg", ".jpeg", ".png", ".tiff", ".bmp", ".webp")
+DEFAULT_MAX_DISTANCE = 8  # Differing bits (out of 64) still counted as similar
+
+
+def get_image_hashes(file_path, st=None):
+    return cached_attribute(
+        file_path, "perceptual_hash", lambda: read_image_hashes(file_path), st=st
+    )
+
+
+def read_image_hashes(file_path):
+    from PIL import Image, UnidentifiedImageError
+
+    try:
+        return image_hashes(file_path)
+    except (
+        UnidentifiedImageError,
+        Image.DecompressionBombError,
+        SyntaxError,
+        ValueError,
+    ):
+        # Not an image Pillow can decode. Read errors propagate instead, so
+        # a file that is locked or still being written isn't cached as such.
+        return None
+
+
+def find_similar_groups(hashes, max_distance, check_if_running=None):
+    # hashes: list of [dhash, phash, width, height]; returns lists of indexes
+    # of images that are similar, directly or through each other. Members
+    # of a cluster can be far apart; see split_around_keepers.
+    import numpy as np
+
+    dhashes = np.array([item[0] for item in hashes], dtype=np.uint64)
+    phashes = np.array([item[1] for item in hashes], dtype=np.uint64)
+    parents = list(range(len(hashes)))
+
+    def find(index):
+        while parents[index] != index:
+            parents[index] = parents[parents[index]]
+            index = parents[index]
+        return index
+
+    # Candidates come from the pHash and are confirmed on the dHash
+    for left, right in similar_pairs(phashes, max_distance):
+        if check_if_running is not None and not check_if_running():
+            return []
+        close = hamming_many(dhashes[left], dhashes[right]) <= max_distance
+        for a, b in zip(left[close].tolist(), right[close].tolist()):
+            parents[find(a)] = find(b)
+
+    groups = {}
+    for index in range(len(hashes)):
+        groups.setdefault(find(index), []).append(index)
+    return [group for group in groups.values() if len(group) > 1]
+
+
+def split_around_keepers(cluster, hashes, max_distance):
+    # cluster: indexes sorted best first. Yields (keep, similar indexes) with
+    # every similar image within max_distance of keep on both hashes.
+    remaining = list(cluster)
+    while len(remaining) > 1:
+        keep = remaining[0]
+        similar = []
+        rest = []
+        for index in remaining[1:]:
+            if (
+                hamming(hashes[index][0], hashes[keep][0]) <= max_distance
+                and hamming(hashes[index][1], hashes[keep][1]) <= max_distance
+            ):
+                similar.append(index)
+            else:
+                rest.append(index)
+        if similar:
+            yield keep, similar
+        remaining = rest
+
+
+def plan_similar_images(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    summary,
+    max_distance=DEFAULT_MAX_DISTANCE,
+):
+    # Yields a PlannedMove for every image that has a larger similar image
+    log_callback("Scanning files...")
+    scanner = StreamingScanner(
+        source_folder, IMAGE_FORMATS, [destination_folder], check_if_running
+    )
+    images = []  # (path, st)
+    hashes = []
+    processed_files = 0
+
+    # Decode and hash on worker threads; Pillow releases the GIL while decoding
+    results = ordered_map(
+        lambda entry: get_image_hashes(entry.path, entry.stat()),
+        scanner,
+        check_if_running,
+    )
+    try:
+        with closing(results):
+            for entry, future in results:
+                if not check_if_running():
+                    return
+                processed_files += 1
+                report_progress(progress_callback, processed_files, scanner, entry.name)
+                try:
+                    image_hash = future.result()
+                    st = entry.stat(follow_symlinks=False)
+                except Exception as e:
+                    log_callback(f"Error processing {entry.name}: {str(e)}")
+                    continue
+                if image_hash is None:
+                    continue
+                images.append((entry.path, st))
+                hashes.append(image_hash)
+    finally:
+        scanner.close()
+        summary.examined = scanner.discovered
+
+    log_callback(f"Comparing {len(images)} images")
+    groups = find_similar_groups(hashes, max_distance, check_if_running)
+    if not check_if_running():
+        return
+
+    for group in groups:
+        # Keep the most pixels, then the biggest file, then the oldest
+        group.sort(
+            key=lambda index: (
+                -hashes[index][2] * hashes[index][3],
+                -images[index][1].st_size,
+                images[index][1].st_mtime_ns,
+            )
+        )
+        for keep, similar in split_around_keepers(group, hashes, max_distance):
+            original = os.path.relpath(images[keep][0], source_folder)
+            for index in similar:
+                file_path, st = images[index]
+                rel_path = os.path.relpath(file_path, source_folder)
+                distance = hamming(hashes[index][1], hashes[keep][1])
+                move = PlannedMove(
+                    file_path,
+                    os.path.join(destination_folder, rel_path),
+                    f"similar to {images[keep][0]} (distance {distance})",
+                    st.st_size,
+                    message=f"Moved: {rel_path} (similar to {original})",
+                    st=st,
+                )
+                summary.add(move)
+                yield move
+
+
+def move_similar_images(
+    source_folder,
+    destination_folder,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    parallel_moves=1,
+    max_distance=DEFAULT_MAX_DISTANCE,
+):
+    journal = open_journal("similar", [source_folder, destination_folder], log_callback)
+    summary = PlanSummary()
+    moves = plan_similar_images(
+        source_folder,
+        destination_folder,
+        log_callback,
+        progress_callback,
+        check_if_running,
+        summary,
+        max_distance,
+    )
+    completed = False
+    try:
+        executor = run_plan(
+            moves, log_callback, check_if_running, parallel_moves, journal=journal
+        )
+        completed = check_if_running()
+    finally:
+        if journal is not None:
+            # Kept after a cancel or a crash so the next run picks up where
+            # this one stopped
+            journal.close(completed=completed)
+    flush_catalog()
+    if not check_if_running():
+        return
+
+    total_files = summary.examined
+    if total_files == 0:
+        log_callback("No images found.")
+        progress_callback(0, 0, 0, "")
+        return
+
+    progress_callback(total_files, total_files, 100, "Complete")
+    log_callback(f"Moved {executor.moved} similar images out of {total_files} images.")
@@ -1,8 +1,27 @@
 import platform
+import shutil
 import subprocess
 import os
 import tempfile
 
+FFPROBE_PATHS = [
+    "ffprobe",  # Check if ffprobe is available globally
+    "/opt/homebrew/bin/ffprobe",  # Path for Homebrew on M1 Mac
+    "/usr/local/bin/ffprobe",  # Standard path for Homebrew on Intel Mac
+    "/opt/homebrew/opt/ffmpeg/bin/ffprobe",  # Alternative path for Homebrew
+]
+
+
+def find_ffprobe():
+    # Points FFPROBE_PATH at the first ffprobe found, unless already set
+    if os.environ.get("FFPROBE_PATH") and shutil.which(os.environ["FFPROBE_PATH"]):
+        return os.environ["FFPROBE_PATH"]
+    for path in FFPROBE_PATHS:
+        if shutil.which(path):
+            os.environ["FFPROBE_PATH"] = path
+            return path
+    return None
+
 
 def is_homebrew_installed():
     try:
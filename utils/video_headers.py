@@ -0,0 +1,327 @@
+import os
+import struct
+import time
+from datetime import datetime
+
+from utils.metrics import measured
+
+# Container headers are read directly so most durations can be resolved
+# without spawning ffprobe. Every reader returns the duration in seconds, or
+# None when the file doesn't look like what we expected; callers then fall
+# back to ffprobe.
+
+MAX_BOXES = 256  # Give up on files with an absurd number of top-level boxes
+MAX_HEADER_BYTES = 1024 * 1024  # Never read more than this looking for metadata
+QUICKTIME_EPOCH = 2082844800  # Seconds from 1904-01-01, where mvhd counts from, to 1970
+
+
+def _read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise EOFError
+    return data
+
+
+# ISO base media file format (.mp4, .mov, .m4v, .f4v)
+
+
+def iter_boxes(f, start, end):
+    offset = start
+    for _ in range(MAX_BOXES):
+        if end is not None and offset + 8 > end:
+            return
+        f.seek(offset)
+        header = f.read(8)
+        if len(header) < 8:
+            return
+        size, box_type = struct.unpack(">I4s", header)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack(">Q", _read_exact(f, 8))[0]
+            header_size = 16
+        elif size == 0:
+            # Box runs to the end of the enclosing container
+            size = (end if end is not None else os.fstat(f.fileno()).st_size) - offset
+        if size < header_size:
+            return
+        yield box_type, offset + header_size, offset + size
+        offset += size
+
+
+def read_mvhd(f):
+    # Returns (timescale, duration, creation_time) from moov/mvhd
+    for box_type, start, end in iter_boxes(f, 0, None):
+        if box_type != b"moov":
+            continue
+        for child_type, child_start, child_end in iter_boxes(f, start, end):
+            if child_type != b"mvhd":
+                continue
+            f.seek(child_start)
+            version = _read_exact(f, 4)[0]
+            if version == 1:
+                creation, _, timescale, duration = struct.unpack(
+                    ">QQIQ", _read_exact(f, 28)
+                )
+                unknown = 0xFFFFFFFFFFFFFFFF
+            else:
+                creation, _, timescale, duration = struct.unpack(
+                    ">IIII", _read_exact(f, 16)
+                )
+                unknown = 0xFFFFFFFF
+            if duration == unknown:
+                duration = None
+            return timescale, duration, creation
+        return None
+    return None
+
+
+def read_isobmff_duration(f):
+    mvhd = read_mvhd(f)
+    if mvhd is None:
+        return None
+    timescale, duration, _ = mvhd
+    # Fragmented files leave the duration at zero; ffprobe handles those
+    if not timescale or not duration:
+        return None
+    return duration / timescale
+
+
+# Matroska / WebM (.mkv)
+
+EBML_HEADER = 0x1A45DFA3
+EBML_SEGMENT = 0x18538067
+EBML_INFO = 0x1549A966
+EBML_CLUSTER = 0x1F43B675
+EBML_TIMECODE_SCALE = 0x2AD7B1
+EBML_DURATION = 0x4489
+
+
+def _read_vint(f, keep_marker):
+    first = f.read(1)
+    if not first:
+        raise EOFError
+    first = first[0]
+    length = 1
+    mask = 0x80
+    while length <= 8 and not first & mask:
+        length += 1
+        mask >>= 1
+    if length > 8:
+        raise ValueError("Invalid EBML variable length integer")
+    value = first if keep_marker else first & (mask - 1)
+    rest = _read_exact(f, length - 1)
+    for byte in rest:
+        value = (value << 8) | byte
+    # All data bits set means "unknown size"
+    unknown = not keep_marker and value == (1 << (7 * length)) - 1
+    return value, unknown
+
+
+def _iter_ebml(f, start, end):
+    offset = start
+    while end is None or offset < end:
+        f.seek(offset)
+        element_id, _ = _read_vint(f, keep_marker=True)
+        size, unknown = _read_vint(f, keep_marker=False)
+        data_start = f.tell()
+        data_end = None if unknown else data_start + size
+        yield element_id, data_start, data_end
+        if data_end is None:
+            return  # Only master elements may have unknown size; caller descends
+        offset = data_end
+
+
+def read_ebml_duration(f):
+    elements = _iter_ebml(f, 0, None)
+    element_id, _, _ = next(elements)
+    if element_id != EBML_HEADER:
+        return None
+    for element_id, start, end in elements:
+        if element_id != EBML_SEGMENT:
+            continue
+        for child_id, child_start, child_end in _iter_ebml(f, start, end):
+            if child_start > MAX_HEADER_BYTES or child_id == EBML_CLUSTER:
+                return None  # Info always precedes the media data
+            if child_id != EBML_INFO or child_end is None:
+                continue
+            timecode_scale = 1000000
+            duration = None
+            for info_id, info_start, info_end in _iter_ebml(f, child_start, child_end):
+                f.seek(info_start)
+                data = _read_exact(f, info_end - info_start)
+                if info_id == EBML_TIMECODE_SCALE:
+                    timecode_scale = int.from_bytes(data, "big")
+                elif info_id == EBML_DURATION and len(data) in (4, 8):
+                    duration = struct.unpack(">f" if len(data) == 4 else ">d", data)[0]
+            if not duration or duration <= 0:
+                return None
+            return duration * timecode_scale / 1e9
+        return None
+    return None
+
+
+# AVI (.avi)
+
+
+def _iter_riff(f, start, end):
+    offset = start
+    while offset + 8 <= end:
+        f.seek(offset)
+        chunk_id, size = struct.unpack("<4sI", _read_exact(f, 8))
+        yield chunk_id, offset + 8, size
+        offset += 8 + size + (size & 1)  # Chunks are word aligned
+
+
+def read_avi_duration(f):
+    riff, riff_size, form = struct.unpack("<4sI4s", _read_exact(f, 12))
+    if riff != b"RIFF" or form != b"AVI ":
+        return None
+    for chunk_id, start, size in _iter_riff(f, 12, 8 + riff_size):
+        if chunk_id != b"LIST":
+            continue
+        f.seek(start)
+        if _read_exact(f, 4) != b"hdrl":
+            continue
+        micro_sec_per_frame = total_frames = None
+        for child_id, child_start, child_size in _iter_riff(
+            f, start + 4, start + size
+        ):
+            f.seek(child_start)
+            if child_id == b"avih" and child_size >= 20:
+                micro_sec_per_frame, _, _, _, total_frames = struct.unpack(
+                    "<5I", _read_exact(f, 20)
+                )
+            elif child_id == b"LIST" and _read_exact(f, 4) == b"odml":
+                # OpenDML files over 1 GB keep the real frame count here
+                for odml_id, odml_start, odml_size in _iter_riff(
+                    f, child_start + 4, child_start + child_size
+                ):
+                    if odml_id == b"dmlh" and odml_size >= 4:
+                        f.seek(odml_start)
+                        total_frames = struct.unpack("<I", _read_exact(f, 4))[0]
+        if not micro_sec_per_frame or not total_frames:
+            return None
+        return micro_sec_per_frame * total_frames / 1e6
+    return None
+
+
+# Flash video (.flv)
+
+FLV_TAG_SCRIPT = 18
+
+
+def _read_amf_string(f, long=False):
+    length = struct.unpack(">I" if long else ">H", _read_exact(f, 4 if long else 2))[0]
+    return _read_exact(f, length).decode("utf-8", "replace")
+
+
+def _read_amf_value(f, depth=0):
+    if depth > 16:
+        raise ValueError("AMF nesting too deep")
+    marker = _read_exact(f, 1)[0]
+    if marker == 0:  # Number
+        return struct.unpack(">d", _read_exact(f, 8))[0]
+    if marker == 1:  # Boolean
+        return bool(_read_exact(f, 1)[0])
+    if marker == 2:  # String
+        return _read_amf_string(f)
+    if marker in (3, 8):  # Object, ECMA array
+        if marker == 8:
+            _read_exact(f, 4)  # Approximate count, the end marker is authoritative
+        result = {}
+        while True:
+            key = _read_amf_string(f)
+            if not key and _read_exact(f, 1)[0] == 9:
+                return result
+            if not key:
+                f.seek(-1, os.SEEK_CUR)
+            result[key] = _read_amf_value(f, depth + 1)
+    if marker in (5, 6):  # Null, undefined
+        return None
+    if marker == 10:  # Strict array
+        count = struct.unpack(">I", _read_exact(f, 4))[0]
+        return [_read_amf_value(f, depth + 1) for _ in range(count)]
+    if marker == 11:  # Date
+        return struct.unpack(">dh", _read_exact(f, 10))[0]
+    if marker == 12:  # Long string
+        return _read_amf_string(f, long=True)
+    raise ValueError(f"Unsupported AMF marker {marker}")
+
+
+def read_flv_duration(f):
+    signature, _, _, data_offset = struct.unpack(">3sBBI", _read_exact(f, 9))
+    if signature != b"FLV":
+        return None
+    offset = data_offset + 4  # Skip PreviousTagSize0
+    while offset < MAX_HEADER_BYTES:
+        f.seek(offset)
+        header = f.read(11)
+        if len(header) < 11:
+            return None
+        tag_type = header[0] & 0x1F
+        data_size = int.from_bytes(header[1:4], "big")
+        if tag_type == FLV_TAG_SCRIPT:
+            if _read_amf_value(f) == "onMetaData":
+                metadata = _read_amf_value(f)
+                duration = metadata.get("duration") if isinstance(metadata, dict) else None
+                if isinstance(duration, float) and duration > 0:
+                    return duration
+                return None
+        offset += 11 + data_size + 4
+    return None
+
+
+def detect_container(header):
+    if header[4:8] in (b"ftyp", b"moov", b"mdat", b"wide", b"free", b"skip"):
+        return "isobmff"
+    if header[:4] == b"\x1a\x45\xdf\xa3":
+        return "ebml"
+    if header[:4] == b"RIFF" and header[8:12] == b"AVI ":
+        return "avi"
+    if header[:3] == b"FLV":
+        return "flv"
+    return None
+
+
+READERS = {
+    "isobmff": read_isobmff_duration,
+    "ebml": read_ebml_duration,
+    "avi": read_avi_duration,
+    "flv": read_flv_duration,
+}
+
+
+@measured("header.video")
+def read_video_creation_time(file_path):
+    # Local time an MP4/MOV was recorded, from its mvhd box, or None when the
+    # camera left it unset (0, or nonsense in the future)
+    try:
+        with open(file_path, "rb") as f:
+            if detect_container(f.read(12)) != "isobmff":
+                return None
+            f.seek(0)
+            mvhd = read_mvhd(f)
+    except (OSError, EOFError, ValueError, struct.error, IndexError):
+        return None
+    if mvhd is None:
+        return None
+    timestamp = mvhd[2] - QUICKTIME_EPOCH
+    if timestamp <= 0 or timestamp > time.time() + 86400:
+        return None
+    return datetime.fromtimestamp(timestamp)
+
+
+@measured("header.video")
+def read_video_duration(file_path):
+    try:
+        with open(file_path, "rb") as f:
+            container = detect_container(f.read(12))
+            if container is None:
+                return None
+            f.seek(0)
+            duration = READERS[container](f)
+    except (OSError, EOFError, ValueError, struct.error, IndexError):
+        return None
+    if duration is None or duration <= 0:
+        return None
+    return duration
@@ -0,0 +1,314 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import time
+
+from utils.scanner import iter_entries
+
+# Watch mode: instead of rescanning the whole source folder, collect the
+# files that were added or changed, wait until they have stopped changing,
+# and hand them to the operations in batches. Linux uses inotify; elsewhere
+# (or when inotify runs out of watches) the tree is polled and compared with
+# the previous snapshot.
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_MODIFY | IN_DELETE_SELF | IN_MOVE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, name length
+
+DEFAULT_SETTLE_TIME = 2.0  # Seconds a file must stay unchanged before it's used
+DEFAULT_POLL_INTERVAL = 5.0  # Seconds between snapshots when polling
+
+
+def _load_inotify():
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        return libc
+    except (OSError, AttributeError):
+        return None
+
+
+def _is_excluded(path, excluded):
+    return any(
+        path == folder or path.startswith(folder + os.sep) for folder in excluded
+    )
+
+
+class InotifyWatcher:
+    # One watch per folder, added as folders appear. Files are reported on
+    # close-after-write and when they are moved in; plain modifications only
+    # mark the file so the debouncer keeps waiting.
+
+    def __init__(self, root, exclude=(), libc=None):
+        self.libc = libc or _load_inotify()
+        if self.libc is None:
+            raise OSError(errno.ENOSYS, "inotify is not available")
+        self.root = os.path.abspath(root)
+        self.excluded = [os.path.abspath(path) for path in exclude if path]
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._folders = {}  # watch descriptor -> folder
+        # Set once fs.inotify.max_user_watches is reached. Folders are still
+        # scanned for their files, but the watcher should be replaced by a
+        # PollingWatcher, as watch_folder does.
+        self.exhausted = False
+        self._watch_tree(self.root)
+        if self.exhausted:
+            self.close()
+            raise OSError(errno.ENOSPC, "Too many folders to watch with inotify")
+
+    def _add_watch(self, folder):
+        if self.exhausted:
+            return False
+        wd = self.libc.inotify_add_watch(
+            self.fd, os.fsencode(folder), WATCH_MASK | IN_ONLYDIR
+        )
+        if wd < 0:
+            if ctypes.get_errno() == errno.ENOSPC:
+                self.exhausted = True
+            return False
+        self._folders[wd] = folder
+        return True
+
+    def _watch_tree(self, folder):
+        # Watches folder and everything below it; returns the files found,
+        # which may have been written before their folder was watched
+        files = []
+        stack = [folder]
+        while stack:
+            current = stack.pop()
+            if _is_excluded(current, self.excluded):
+                continue
+            if not self._add_watch(current) and not self.exhausted:
+                continue
+            try:
+                with os.scandir(current) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            files.append(entry.path)
+            except OSError:
+                continue
+        return files
+
+    def poll(self, timeout):
+        # Returns (changed files, files still being written) seen within
+        # timeout seconds
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return [], []
+        changed = []
+        modified = []
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                offset += EVENT_HEADER.size
+                name = data[offset : offset + length].rstrip(b"\0")
+                offset += length
+                if mask & IN_Q_OVERFLOW:
+                    # Events were lost; report everything that is there
+                    changed.extend(
+                        entry.path
+                        for entry in iter_entries(self.root, exclude=self.excluded)
+                    )
+                    continue
+                if mask & IN_IGNORED:
+                    self._folders.pop(wd, None)
+                    continue
+                folder = self._folders.get(wd)
+                if folder is None:
+                    continue
+                if mask & IN_MOVE_SELF:
+                    # Moved within the tree, the watch was already re-pointed
+                    # by the IN_MOVED_TO of its new parent; moved out, it's
+                    # no longer ours
+                    if not os.path.isdir(folder):
+                        self.libc.inotify_rm_watch(self.fd, wd)
+                        self._folders.pop(wd, None)
+                    continue
+                if not name:
+                    continue
+                path = os.path.join(folder, os.fsdecode(name))
+                if mask & IN_ISDIR:
+                    if mask & (IN_CREATE | IN_MOVED_TO):
+                        changed.extend(self._watch_tree(path))
+                elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                    changed.append(path)
+                elif mask & (IN_CREATE | IN_MODIFY):
+                    modified.append(path)
+        return changed, modified
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+class PollingWatcher:
+    # Compares (size, mtime) snapshots of the tree every `interval` seconds.
+    # Files present when the watcher starts are not reported.
+
+    def __init__(self, root, exclude=(), interval=DEFAULT_POLL_INTERVAL):
+        self.root = os.path.abspath(root)
+        self.excluded = [os.path.abspath(path) for path in exclude if path]
+        self.interval = interval
+        self._snapshot = self._take_snapshot()
+        self._next_poll = time.monotonic() + interval
+
+    def _take_snapshot(self):
+        snapshot = {}
+        for entry in iter_entries(self.root, exclude=self.excluded):
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                continue
+            snapshot[entry.path] = (st.st_size, st.st_mtime_ns)
+        return snapshot
+
+    def poll(self, timeout):
+        wait = self._next_poll - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return [], []
+        if wait > 0:
+            time.sleep(wait)
+        self._next_poll = time.monotonic() + self.interval
+        snapshot = self._take_snapshot()
+        changed = [
+            path
+            for path, fingerprint in snapshot.items()
+            if self._snapshot.get(path) != fingerprint
+        ]
+        self._snapshot = snapshot
+        return changed, []
+
+    def close(self):
+        pass
+
+
+def create_watcher(root, exclude=(), poll=False, poll_interval=DEFAULT_POLL_INTERVAL):
+    # inotify where available, polling otherwise
+    if not poll:
+        try:
+            return InotifyWatcher(root, exclude)
+        except OSError:
+            pass
+    return PollingWatcher(root, exclude, poll_interval)
+
+
+class Debouncer:
+    # Holds paths until their size and mtime stayed the same for `settle`
+    # seconds, so files that are still being copied in aren't touched
+
+    def __init__(self, settle=DEFAULT_SETTLE_TIME):
+        self.settle = settle
+        self._pending = {}  # path -> (fingerprint, time it was last seen changing)
+
+    def touch(self, paths, now=None):
+        now = time.monotonic() if now is None else now
+        for path in paths:
+            fingerprint, _ = self._pending.get(path, (None, now))
+            self._pending[path] = (fingerprint, now)
+
+    def ready(self, now=None):
+        # Returns the paths that have settled and forgets them
+        now = time.monotonic() if now is None else now
+        settled = []
+        for path, (fingerprint, since) in list(self._pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self._pending[path]  # Gone again (temporary file)
+                continue
+            current = (st.st_size, st.st_mtime_ns)
+            if current != fingerprint:
+                self._pending[path] = (current, now)
+            elif now - since >= self.settle:
+                settled.append(path)
+                del self._pending[path]
+        return settled
+
+
+def watch_folder(
+    source_folder,
+    destination_folder,
+    operations,
+    log_callback,
+    progress_callback,
+    check_if_running,
+    settle=DEFAULT_SETTLE_TIME,
+    poll=False,
+    poll_interval=DEFAULT_POLL_INTERVAL,
+):
+    # Runs until cancelled. `operations` is a list of (function, kwargs);
+    # each settled batch of files goes through every operation in turn, the
+    # same way a full run would handle them.
+    watcher = create_watcher(source_folder, [destination_folder], poll, poll_interval)
+    debouncer = Debouncer(settle)
+    method = "polling" if isinstance(watcher, PollingWatcher) else "inotify"
+    log_callback(f"Watching {source_folder} for new files ({method})")
+    try:
+        while check_if_running():
+            changed, modified = watcher.poll(min(settle, 0.5))
+            if isinstance(watcher, InotifyWatcher) and watcher.exhausted:
+                # The files of the folder that didn't fit are in `changed`
+                log_callback("Too many folders to watch with inotify; polling instead")
+                watcher.close()
+                watcher = PollingWatcher(
+                    source_folder, [destination_folder], poll_interval
+                )
+            debouncer.touch(changed)
+            debouncer.touch(modified)
+            batch = debouncer.ready()
+            if not batch:
+                continue
+            log_callback(f"Processing {len(batch)} new files")
+            for function, kwargs in operations:
+                if not check_if_running():
+                    break
+                function(
+                    source_folder,
+                    destination_folder,
+                    log_callback,
+                    progress_callback,
+                    check_if_running,
+                    paths=batch,
+                    **kwargs,
+                )
+    finally:
+        watcher.close()